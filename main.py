@@ -1,63 +1,129 @@
-import os
-import pandas as pd
-from modules.data_extraction import extractModelDataToDF
-from modules.hycross_extraction import extract_fpxsec_results
-from modules.geospatial import convertToGeoDataFrame, calculate_cell_size
-from modules.rasterization import create_raster_from_gdf
-from modules.vectorization import convert_gdf_to_shapefile
-from modules.fpxsec_vectorization import create_fpxsec_shapefile
-from modules.utilities import create_required_folders
-from modules.hystruc_vectorization import create_hystruc_shapefile
-from modules.hystruc_extraction import extract_hystruc_results
-from modules.fpxsec_spreadsheet import hycross_spreadsheet
-
-
-# Define file paths
-file_path = r"C:\Users\Anichols\OneDrive - Atwell LLC\Desktop\ironwood"
-coord_system = 2223
-raster_outpath = os.path.join(file_path, 'flo2d_rasters')
-shp_outpath = os.path.join(file_path, 'flo2d_shp')
-folders = [raster_outpath, shp_outpath]
-
-# Create required directories
-create_required_folders(folders)
-
-# Extract data from files and create DataFrame
-model_data = extractModelDataToDF(file_path)
-fpxsec_grids = model_data[pd.notna(model_data['fpxsec'])]
-
-# Convert DataFrame to GeoDataFrame
-geo_df = convertToGeoDataFrame(model_data)
-
-# Save GeoDataFrame to shapefile
-#flo2d_data_shp = os.path.join(shp_outpath, 'flo2d_data.shp')
-#convert_gdf_to_shapefile(geo_df, flo2d_data_shp, coord_system)
-
-# Extract floodplain cross section results from HYCROSS.OUT
-fpxsec_results = extract_fpxsec_results(file_path)
-
-# Save floodplain cross section results to shapefile
-create_fpxsec_shapefile(file_path, coord_system, model_data, fpxsec_results)
-
-# Create HYCROSS.OUT spreadsheet
-hycross_spreadsheet(file_path)
-
-# Save hydraulic structure results to shapefile
-hystruc_df = extract_hystruc_results(file_path)
-create_hystruc_shapefile(hystruc_df, model_data, coord_system, shp_outpath)
-
-# Calculate cell size for raster creation
-cell_size = calculate_cell_size(geo_df)
-
-# Create rasters for each specified column
-columns = ['depth_max', 'xksat', 'psif', 'dtheta',
-           'abstrinf', 'rtimpf', 'soil_depth', 'velocity',
-             'q_max', 'wse_max', 'infil_depth', 'infil_stop',
-               'time_of_oneft', 'time_of_twoft', 'time_to_peak', 'mannings_n',
-                 'topo', 'final_velocity', 'final_depth',
-              ]
-for column in columns:
-    raster_file = os.path.join(raster_outpath, f'{column}.tif')
-    create_raster_from_gdf(geo_df, column, raster_file, cell_size)
-
-print("Processing completed successfully.")
\ No newline at end of file
+# main.py
+
+import argparse
+import sys
+from modules.batch import default_shared_cache, expand_projects, format_batch_report, run_batch, write_batch_report
+from modules.comparison import COMPARE_COLUMNS, COMPARISON_FOLDER, compare_projects
+from modules.derived_products import DERIVED_PRODUCTS, parse_derived_product
+from modules.fpxsec_spreadsheet import PLOT_MODES, WORKBOOK_LAYOUTS
+from modules.pipeline import EXECUTORS
+from modules.postprocess import DEFAULT_OUTPUTS, OUTPUTS, POINT_COLUMNS, POINT_FORMATS, RASTER_COLUMNS, run_project
+from modules.timdep import TIMDEP_FIELDS
+from modules.zonal_statistics import ZONAL_COLUMNS, ZONE_METHODS
+from modules.utilities import PROFILE_ENV, enable_profiling
+
+
+def derived_product(text):
+    try:
+        return parse_derived_product(text)
+    except ValueError as error:
+        raise argparse.ArgumentTypeError(str(error))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Post-process FLO-2D model results into rasters, shapefiles and "
+                                                 "spreadsheets.")
+    parser.add_argument('projects', nargs='+', metavar='project',
+                        help="FLO-2D project folder(s) containing the model input and output files. Glob patterns "
+                             "are expanded. Several projects are processed in batch mode, each logging to "
+                             "flo2d_postprocess.log in its folder.")
+    parser.add_argument('--epsg', type=int, required=True, help="EPSG code of the model coordinate system, e.g. 2223.")
+    parser.add_argument('--outputs', nargs='+', choices=OUTPUTS, default=list(DEFAULT_OUTPUTS),
+                        help="Products to create. Defaults to all of them but the full-grid 'points' layer, the "
+                             "'timdep' step rasters, the 'derived' rasters and the 'zonal' statistics.")
+    parser.add_argument('--rasters', nargs='+', choices=RASTER_COLUMNS, default=None, metavar='COLUMN',
+                        help="Model data columns to rasterize. Defaults to all of them, without the Green and Ampt "
+                             "parameters when INFIL.DAT uses another method.")
+    parser.add_argument('--point-columns', nargs='+', choices=POINT_COLUMNS, default=None, metavar='COLUMN',
+                        help="Model data columns of the 'points' layer. Defaults to all of them, without the Green "
+                             "and Ampt parameters when INFIL.DAT uses another method.")
+    parser.add_argument('--vector-format', choices=POINT_FORMATS, default='parquet',
+                        help="Format of the 'points' layer: GeoParquet, FlatGeobuf or GeoPackage.")
+    parser.add_argument('--derived', nargs='+', type=derived_product, default=list(DERIVED_PRODUCTS.values()),
+                        metavar='PRODUCT',
+                        help=f"Derived rasters: {', '.join(DERIVED_PRODUCTS)} or name=expression over model data "
+                             "columns, e.g. 'dv=depth_max*velocity', optionally classified with ':edge,edge,...'. "
+                             "Defaults to all of the named ones.")
+    parser.add_argument('--zones', default=None,
+                        help="Polygon file, e.g. parcels or drainage basins, summarized by the 'zonal' output into "
+                             "flo2d_shp/zonal_<name>, in the --vector-format.")
+    parser.add_argument('--zonal-columns', nargs='+', choices=RASTER_COLUMNS, default=ZONAL_COLUMNS, metavar='COLUMN',
+                        help="Model data columns summarized per zone (min, max, mean, sum).")
+    parser.add_argument('--zone-method', choices=ZONE_METHODS, default='centers',
+                        help="'centers' tests cell centers against each zone, 'raster' burns the zones onto the grid, "
+                             "faster with many zones but keeping only the last of overlapping zones.")
+    parser.add_argument('--timdep-fields', nargs='+', choices=tuple(TIMDEP_FIELDS), default=['depth'],
+                        help="TIMDEP.OUT fields written as one raster per step to flo2d_rasters/timdep.")
+    parser.add_argument('--timdep-every', type=int, default=1,
+                        help="Write one TIMDEP.OUT step in every N, starting with the first.")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Stages run at the same time. Defaults to the executor's default.")
+    parser.add_argument('--executor', choices=tuple(EXECUTORS), default='thread',
+                        help="Pool running the stages. 'process' copies stage inputs to the worker processes.")
+    parser.add_argument('--plot-mode', choices=PLOT_MODES, default='native', help="Hydrograph plots in the spreadsheet.")
+    parser.add_argument('--layout', choices=WORKBOOK_LAYOUTS, default='sheets', help="Spreadsheet layout.")
+    parser.add_argument('--no-cache', action='store_true', help="Parse every file again instead of using flo2d_cache.")
+    parser.add_argument('--force', action='store_true', help="Rebuild every selected output, even when up to date.")
+    parser.add_argument('--jobs', type=int, default=None,
+                        help="Projects processed at the same time in batch mode. Defaults to the number of cores.")
+    parser.add_argument('--shared-cache', default=None,
+                        help="Folder for work shared by projects with an identical TOPO.DAT, such as the grid index. "
+                             "Defaults to flo2d_shared_cache in the folder common to the projects in batch mode.")
+    parser.add_argument('--compare', action='store_true',
+                        help="Compare two projects instead of post-processing them: the second, e.g. proposed "
+                             "conditions, against the first. Delta rasters and change tables are written to "
+                             f"{COMPARISON_FOLDER} in the second project.")
+    parser.add_argument('--compare-columns', nargs='+', choices=RASTER_COLUMNS, default=COMPARE_COLUMNS,
+                        metavar='COLUMN', help="Model data columns compared. Defaults to depth, WSE, velocity and Q.")
+    parser.add_argument('--compare-tolerance', type=float, default=0.0,
+                        help="Cell changes up to this magnitude count as unchanged in the comparison summary.")
+    parser.add_argument('--report', default=None, help="CSV file receiving the batch run report.")
+    parser.add_argument('--profile', action='store_true',
+                        help="Record wall time, CPU time, rows and bytes of every stage and parsed file in "
+                             f"flo2d_profile.json/.csv in each project folder. Same as setting {PROFILE_ENV}=1.")
+    parser.add_argument('--profile-memory', action='store_true',
+                        help=f"Also trace peak Python memory per span, at some cost in speed. Same as {PROFILE_ENV}=memory.")
+    args = parser.parse_args(argv)
+    if 'zonal' in args.outputs and not args.zones:
+        parser.error("the 'zonal' output needs --zones")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.profile or args.profile_memory:
+        enable_profiling(memory=args.profile_memory)
+    try:
+        projects = expand_projects(args.projects)
+    except ValueError as error:
+        print(error, file=sys.stderr)
+        return 2
+    if not projects:
+        print(f"No project folder matches {' '.join(args.projects)}", file=sys.stderr)
+        return 2
+
+    if args.compare:
+        if len(projects) != 2:
+            print(f"--compare takes two project folders, got {len(projects)}", file=sys.stderr)
+            return 2
+        summary = compare_projects(projects[0], projects[1], crs=f"EPSG:{args.epsg}", columns=args.compare_columns,
+                                   tolerance=args.compare_tolerance, use_cache=not args.no_cache,
+                                   shared_cache=args.shared_cache)
+        print(summary.to_string(index=False))
+        return 0
+
+    if len(projects) == 1:
+        args.project = projects[0]
+        return run_project(args).status
+
+    if args.shared_cache is None:
+        args.shared_cache = default_shared_cache(projects)
+    reports = run_batch(args, projects, args.jobs)
+    print(format_batch_report(reports))
+    if args.report:
+        write_batch_report(reports, args.report)
+    return 0 if all(report.status == 'done' for report in reports) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,142 @@
+# batch.py
+
+import argparse
+import glob
+import os
+import sys
+import time
+import traceback
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager, redirect_stderr, redirect_stdout
+import pandas as pd
+from modules.postprocess import run_project
+
+# Written in each project folder with everything the project's run prints
+PROJECT_LOG_NAME = 'flo2d_postprocess.log'
+# Default shared cache folder, created in the folder common to the batch's projects
+SHARED_CACHE_FOLDER = 'flo2d_shared_cache'
+
+# Files marking a folder matched by a glob pattern as a FLO-2D project
+PROJECT_MARKER_FILES = ('DEPTH.OUT', 'TOPO.DAT')
+
+# Outcome of one project in a batch. status is 'done', 'failed' or 'error' (the run itself raised)
+ProjectReport = namedtuple('ProjectReport', ['project', 'status', 'seconds', 'built', 'up_to_date',
+                                             'failed_stages', 'log', 'error'])
+
+
+def expand_projects(patterns):
+    """
+    Expands project folders and glob patterns (also on shells that do not expand them) into existing folders,
+    in the order given and without duplicates. Glob matches are kept only when they hold FLO-2D files, so output
+    folders such as the shared cache are left out.
+    """
+    projects = []
+    for pattern in patterns:
+        if not glob.has_magic(pattern) and not os.path.isdir(pattern):
+            raise ValueError(f"Project folder not found: {pattern}")
+        if glob.has_magic(pattern):
+            matches = [match for match in sorted(glob.glob(pattern)) if is_project_folder(match)]
+        else:
+            matches = [pattern]
+        for project in matches:
+            project = os.path.normpath(project)
+            if os.path.isdir(project) and project not in projects:
+                projects.append(project)
+    return projects
+
+
+def is_project_folder(path):
+    return any(os.path.exists(os.path.join(path, file_name)) for file_name in PROJECT_MARKER_FILES)
+
+
+def default_shared_cache(projects):
+    return os.path.join(os.path.commonpath([os.path.abspath(project) for project in projects]), SHARED_CACHE_FOLDER)
+
+
+@contextmanager
+def redirect_output(log):
+    """
+    Sends stdout and stderr to log, at the file descriptor level too so warnings printed by GDAL are captured.
+    """
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved = os.dup(1), os.dup(2)
+    os.dup2(log.fileno(), 1)
+    os.dup2(log.fileno(), 2)
+    try:
+        with redirect_stdout(log), redirect_stderr(log):
+            yield
+    finally:
+        log.flush()
+        os.dup2(saved[0], 1)
+        os.dup2(saved[1], 2)
+        os.close(saved[0])
+        os.close(saved[1])
+
+
+def run_logged_project(args):
+    """
+    Runs one project with its output sent to PROJECT_LOG_NAME in the project folder. Runs in worker processes,
+    so it must stay a module-level function. Never raises: failures are returned in the ProjectReport.
+    """
+    log_path = os.path.join(args.project, PROJECT_LOG_NAME)
+    start_time = time.perf_counter()
+    with open(log_path, 'w', buffering=1) as log, redirect_output(log):
+        try:
+            result = run_project(args)
+        except Exception as error:
+            traceback.print_exc()
+            return ProjectReport(args.project, 'error', time.perf_counter() - start_time, 0, 0, '', log_path,
+                                 f"{type(error).__name__}: {error}")
+
+    failed_stages = [report.name for report in result.reports if report.status == 'failed']
+    return ProjectReport(args.project, 'failed' if result.status else 'done', time.perf_counter() - start_time,
+                         result.built, result.up_to_date, ' '.join(failed_stages), log_path, None)
+
+
+def run_batch(args, projects, jobs=None):
+    """
+    Post-processes several projects in a process pool, each with its own log.
+    :param args: Parsed command line options shared by every project.
+    :param projects: Project folders.
+    :param jobs: Projects processed at the same time. None uses every core.
+    :return: List of ProjectReport in the order of projects.
+    """
+    reports = {}
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(run_logged_project, argparse.Namespace(**dict(vars(args), project=project))): project
+                   for project in projects}
+        for future in as_completed(futures):
+            project = futures[future]
+            try:
+                report = future.result()
+            except Exception as error:
+                # The worker process died, e.g. out of memory
+                report = ProjectReport(project, 'error', None, 0, 0, '', None, f"{type(error).__name__}: {error}")
+            reports[project] = report
+            print(f"[{len(reports)}/{len(projects)}] {report.status:<6} {project}")
+    return [reports[project] for project in projects]
+
+
+def batch_report_frame(reports):
+    return pd.DataFrame(reports, columns=ProjectReport._fields)
+
+
+def format_batch_report(reports):
+    """
+    Formats the project reports as a table followed by the totals.
+    """
+    df = batch_report_frame(reports)
+    table = df[['project', 'status', 'seconds', 'built', 'up_to_date', 'failed_stages']].to_string(
+        index=False, na_rep='-', float_format=lambda value: f'{value:.1f}')
+    counts = df['status'].value_counts()
+    totals = (f"{len(df)} project(s): {counts.get('done', 0)} done, {counts.get('failed', 0)} failed, "
+              f"{counts.get('error', 0)} error; {df['built'].sum()} output(s) built, "
+              f"{df['up_to_date'].sum()} up to date")
+    return f"{table}\n{totals}"
+
+
+def write_batch_report(reports, report_file):
+    batch_report_frame(reports).to_csv(report_file, index=False)
+    return report_file
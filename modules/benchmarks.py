@@ -0,0 +1,252 @@
+# benchmarks.py
+
+import argparse
+import json
+import os
+import platform
+import tempfile
+import time
+import tracemalloc
+from collections import namedtuple
+from contextlib import redirect_stdout
+import numpy as np
+import pandas as pd
+from modules.data_extraction import extractModelDataToDF, load_model_data
+from modules.fpxsec_spreadsheet import hycross_spreadsheet
+from modules.grid_index import load_grid_index
+from modules.hycross_extraction import extract_fpxsec_results
+from modules.hystruc_extraction import extract_hystruc_results
+from modules.model_cache import ModelCache
+from modules.rasterization import create_raster_from_gdf, create_rasters_from_gdf
+from modules.synthetic_project import generate_project
+from modules.timdep import iter_timdep, write_timdep_rasters
+
+DEFAULT_SIZES = ['10k', '1M', '10M']
+SIZE_SUFFIXES = {'k': 10 ** 3, 'm': 10 ** 6}
+# Written next to a generated project, so later runs with the same parameters reuse it
+SYNTHETIC_MARKER = 'synthetic_project.json'
+GRID_FILES = ['DEPTH.OUT', 'INFIL.DAT', 'MANNINGS_N.DAT', 'TOPO.DAT', 'VELFP.OUT', 'MAXQHYD.OUT', 'MAXWSELEV.OUT',
+              'INFIL_DEPTH.OUT', 'TIMEONEFT.OUT', 'TIMETWOFT.OUT', 'TIMETOPEAK.OUT', 'FINALVEL.OUT', 'FINALDEP.OUT']
+
+# One timed stage: run(context) is timed, units(context) counts the rows it processes, inputs are the files it reads
+Benchmark = namedtuple('Benchmark', ['name', 'run', 'units', 'unit_name', 'inputs'])
+
+
+def parse_size(size):
+    """
+    Parses cell counts such as 10000, 10k or 1M.
+    """
+    size = str(size).strip().lower()
+    if size[-1] in SIZE_SUFFIXES:
+        return int(float(size[:-1]) * SIZE_SUFFIXES[size[-1]])
+    return int(size)
+
+
+def prepare_project(workdir, cells, cross_sections, structures, timesteps, seed=0, timdep_steps=0):
+    """
+    Returns the folder of a synthetic project with these parameters, generating it unless an identical one exists.
+    """
+    params = dict(cells=cells, cross_sections=cross_sections, structures=structures, timesteps=timesteps, seed=seed,
+                  timdep_steps=timdep_steps)
+    folder = os.path.join(workdir, f'synthetic_{cells}_{cross_sections}_{structures}_{timesteps}_{seed}_{timdep_steps}')
+    marker = os.path.join(folder, SYNTHETIC_MARKER)
+    try:
+        with open(marker, 'r') as file:
+            if json.load(file) == params:
+                return folder
+    except (OSError, ValueError):
+        pass
+
+    generate_project(folder, **params)
+    with open(marker, 'w') as file:
+        json.dump(params, file)
+    return folder
+
+
+def hydrograph_rows(context):
+    return context['timesteps'] * context['cross_sections']
+
+
+def structure_rows(context):
+    return context['timesteps'] * context['structures']
+
+
+def timdep_rows(context):
+    return context['timdep_steps'] * context['cells']
+
+
+def run_cached_model_data(context):
+    return extractModelDataToDF(context['project'], use_cache=True)
+
+
+def run_cold_model_data(context):
+    return extractModelDataToDF(context['project'], use_cache=False)
+
+
+def run_depth_velocity(context):
+    return load_model_data(context['project'], ['depth_max', 'velocity'], use_cache=False).load()
+
+
+def run_grid_index(context):
+    return load_grid_index(context['project'], use_cache=False)
+
+
+def run_raster(context):
+    raster_file = os.path.join(context['output'], 'depth_max.tif')
+    return create_raster_from_gdf(context['model_data'], 'depth_max', raster_file, context['grid_index'].cell_size,
+                                  grid=context['grid_index'].raster_grid)
+
+
+def run_tiled_raster(context):
+    return create_rasters_from_gdf(context['model_data'], ['depth_max'], context['output'],
+                                   context['grid_index'].cell_size, tiled=True, grid=context['grid_index'].raster_grid)
+
+
+def run_fpxsec_results(context):
+    return extract_fpxsec_results(context['project'])
+
+
+def run_spreadsheet(context):
+    return hycross_spreadsheet(context['project'], plot_mode='native')
+
+
+def run_hystruc_results(context):
+    return extract_hystruc_results(context['project'], use_cache=False)
+
+
+def run_timdep_read(context):
+    for _ in iter_timdep(os.path.join(context['project'], 'TIMDEP.OUT')):
+        pass
+
+
+def run_timdep_rasters(context):
+    return write_timdep_rasters(context['project'], os.path.join(context['output'], 'timdep'), context['grid_index'])
+
+
+BENCHMARKS = [
+    Benchmark('extractModelDataToDF', run_cold_model_data, lambda context: context['cells'], 'cells', GRID_FILES),
+    Benchmark('extractModelDataToDF cached', run_cached_model_data, lambda context: context['cells'], 'cells', []),
+    Benchmark('load_model_data depth velocity', run_depth_velocity, lambda context: context['cells'], 'cells',
+              ['DEPTH.OUT', 'VELFP.OUT']),
+    Benchmark('load_grid_index', run_grid_index, lambda context: context['cells'], 'cells', ['DEPTH.OUT']),
+    Benchmark('create_raster_from_gdf', run_raster, lambda context: context['cells'], 'cells', []),
+    Benchmark('create_rasters_from_gdf tiled', run_tiled_raster, lambda context: context['cells'], 'cells', []),
+    Benchmark('extract_fpxsec_results', run_fpxsec_results, hydrograph_rows, 'rows', ['HYCROSS.OUT']),
+    Benchmark('hycross_spreadsheet', run_spreadsheet, hydrograph_rows, 'rows', ['HYCROSS.OUT']),
+    Benchmark('extract_hystruc_results', run_hystruc_results, structure_rows, 'rows',
+              ['HYSTRUC.DAT', 'HYDROSTRUCT.OUT']),
+    Benchmark('iter_timdep', run_timdep_read, timdep_rows, 'rows', ['TIMDEP.OUT']),
+    Benchmark('write_timdep_rasters', run_timdep_rasters, timdep_rows, 'rows', ['TIMDEP.OUT']),
+]
+
+
+def measure(benchmark, context, repeat=1, memory=True):
+    """
+    Times a benchmark, keeping the fastest of repeat runs, then runs it once more under tracemalloc for its peak
+    Python memory, NumPy arrays included.
+    """
+    wall_times, cpu_times = [], []
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        for _ in range(repeat):
+            start_wall, start_cpu = time.perf_counter(), time.process_time()
+            benchmark.run(context)
+            wall_times.append(time.perf_counter() - start_wall)
+            cpu_times.append(time.process_time() - start_cpu)
+
+        peak_mb = None
+        if memory:
+            tracemalloc.start()
+            try:
+                benchmark.run(context)
+                peak_mb = tracemalloc.get_traced_memory()[1] / (1 << 20)
+            finally:
+                tracemalloc.stop()
+
+    best = int(np.argmin(wall_times))
+    units = benchmark.units(context)
+    input_mb = sum(os.path.getsize(os.path.join(context['project'], name)) for name in benchmark.inputs) / (1 << 20)
+    seconds = wall_times[best]
+    return {
+        'benchmark': benchmark.name,
+        'cells': context['cells'],
+        'seconds': seconds,
+        'cpu_seconds': cpu_times[best],
+        'peak_mem_mb': peak_mb,
+        'units': units,
+        'unit': benchmark.unit_name,
+        'units_per_s': units / seconds if seconds else None,
+        'input_mb': input_mb,
+        'mb_per_s': input_mb / seconds if seconds and input_mb else None,
+    }
+
+
+def run_benchmarks(sizes, workdir, cross_sections=50, structures=20, timesteps=500, repeat=1, memory=True,
+                   selected=None, timdep_steps=5):
+    """
+    Generates (or reuses) a synthetic project per size and times each benchmark on it.
+    :param sizes: Cell counts.
+    :param selected: Benchmark names to run. Defaults to all of BENCHMARKS.
+    :param timdep_steps: Output intervals in TIMDEP.OUT. With 0, the TIMDEP.OUT benchmarks are skipped.
+    :return: DataFrame with one row per size and benchmark.
+    """
+    benchmarks = [benchmark for benchmark in BENCHMARKS if (not selected or benchmark.name in selected)
+                  and (timdep_steps or 'TIMDEP.OUT' not in benchmark.inputs)]
+    results = []
+    for cells in sizes:
+        print(f"Preparing a synthetic project with {cells} cells")
+        project = prepare_project(workdir, cells, cross_sections, structures, timesteps, timdep_steps=timdep_steps)
+        ModelCache(project).clear()
+        output = os.path.join(project, 'benchmark_output')
+        os.makedirs(output, exist_ok=True)
+
+        context = dict(project=project, output=output, cells=cells, cross_sections=cross_sections,
+                       structures=structures, timesteps=timesteps, timdep_steps=timdep_steps)
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            # Shared inputs of the export benchmarks, and a warm model cache for the cached read
+            context['model_data'] = run_cached_model_data(context)
+            context['grid_index'] = load_grid_index(project)
+
+        for benchmark in benchmarks:
+            result = measure(benchmark, context, repeat, memory)
+            print(f"  {benchmark.name:<30} {result['seconds']:9.3f} s  {result['units_per_s'] or 0:14,.0f} "
+                  f"{benchmark.unit_name}/s  peak {result['peak_mem_mb'] or 0:9.1f} MB")
+            results.append(result)
+    return pd.DataFrame(results)
+
+
+def write_results(results, output_path):
+    """
+    Writes results as CSV, or as JSON with the environment when output_path ends in .json.
+    """
+    if output_path.endswith('.json'):
+        environment = {'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pd.__version__,
+                       'machine': platform.machine(), 'cpus': os.cpu_count(), 'created': time.time()}
+        with open(output_path, 'w') as file:
+            json.dump({'environment': environment, 'results': results.to_dict(orient='records')}, file, indent=2)
+    else:
+        results.to_csv(output_path, index=False)
+    return output_path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Time the post-processing stages on synthetic FLO-2D projects.")
+    parser.add_argument('--sizes', nargs='+', default=DEFAULT_SIZES, help="Cell counts, e.g. 10k 1M 10M.")
+    parser.add_argument('--workdir', default=os.path.join(tempfile.gettempdir(), 'flo2d_benchmarks'),
+                        help="Folder holding the generated projects, reused between runs.")
+    parser.add_argument('--cross-sections', type=int, default=50)
+    parser.add_argument('--structures', type=int, default=20)
+    parser.add_argument('--timesteps', type=int, default=500)
+    parser.add_argument('--timdep-steps', type=int, default=5,
+                        help="Output intervals in TIMDEP.OUT, 0 to skip the TIMDEP.OUT benchmarks.")
+    parser.add_argument('--repeat', type=int, default=1, help="Timed runs per benchmark, the fastest is kept.")
+    parser.add_argument('--no-memory', action='store_true', help="Skip the tracemalloc run measuring peak memory.")
+    parser.add_argument('--benchmarks', nargs='+', choices=[benchmark.name for benchmark in BENCHMARKS],
+                        metavar='NAME', help="Benchmarks to run. Defaults to all of them.")
+    parser.add_argument('--output', help="CSV or .json file receiving the results.")
+    args = parser.parse_args()
+
+    results = run_benchmarks([parse_size(size) for size in args.sizes], args.workdir, args.cross_sections,
+                             args.structures, args.timesteps, args.repeat, not args.no_memory, args.benchmarks,
+                             args.timdep_steps)
+    if args.output:
+        write_results(results, args.output)
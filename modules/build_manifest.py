@@ -0,0 +1,144 @@
+# build_manifest.py
+
+import json
+import os
+from modules.model_cache import file_digest, file_fingerprint
+from modules.utilities import atomic_write
+
+BUILD_MANIFEST_NAME = 'flo2d_build.json'
+# Bump when the content of the outputs changes so every output is rebuilt once
+BUILD_VERSION = 1
+
+
+def _normalize(value):
+    return json.loads(json.dumps(value))
+
+
+class BuildManifest:
+    """
+    Build record of the outputs in one folder: for each output file, the fingerprints of the input files and the
+    parameters it was built from.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.outputs = self._load()
+
+    def _manifest_path(self):
+        return os.path.join(self.folder, BUILD_MANIFEST_NAME)
+
+    def _load(self):
+        try:
+            with open(self._manifest_path(), 'r') as file:
+                manifest = json.load(file)
+        except (OSError, ValueError):
+            return {}
+        if manifest.get('version') != BUILD_VERSION:
+            return {}
+        return manifest.get('outputs', {})
+
+    def save(self):
+        os.makedirs(self.folder, exist_ok=True)
+        with atomic_write(self._manifest_path(), 'w') as file:
+            json.dump({'version': BUILD_VERSION, 'outputs': self.outputs}, file, indent=2)
+
+
+class BuildPlan:
+    """
+    Decides which outputs of a run are stale and records the ones built successfully.
+
+    An output is up to date when it exists, was built with the same parameters and every input still has the
+    recorded size and mtime, or failing that the same content hash. Input fingerprints are taken while planning,
+    before anything is built, so an input rewritten during the run leaves its outputs stale for the next one.
+    """
+
+    def __init__(self, force=False):
+        self.force = force
+        self._manifests = {}
+        self._stats = {}
+        self._digests = {}
+        self._pending = {}
+        # Outputs found up to date while planning
+        self.up_to_date = []
+
+    def _manifest(self, folder):
+        # normcase so folders differing only in case share one manifest on case-insensitive file systems
+        key = os.path.normcase(os.path.abspath(folder))
+        if key not in self._manifests:
+            self._manifests[key] = BuildManifest(folder)
+        return self._manifests[key]
+
+    def _stat(self, path):
+        if path not in self._stats:
+            self._stats[path] = file_fingerprint(path, with_hash=False) if os.path.exists(path) else None
+        return self._stats[path]
+
+    def _digest(self, path):
+        if path not in self._digests:
+            self._digests[path] = file_digest(path)
+        return self._digests[path]
+
+    def _input_unchanged(self, path, recorded):
+        stat = self._stat(path)
+        if stat is None or recorded is None or stat['size'] != recorded.get('size'):
+            return False
+        if stat['mtime_ns'] == recorded.get('mtime_ns'):
+            return True
+        # Touched but possibly unchanged, fall back to the content hash
+        if recorded.get('hash') != self._digest(path):
+            return False
+        recorded['mtime_ns'] = stat['mtime_ns']
+        return True
+
+    def needs_build(self, output_path, inputs, params=None):
+        """
+        Returns True when output_path has to be (re)built, remembering its inputs so record() can store them.
+        :param output_path: Output file the stage writes.
+        :param inputs: Paths of the files the output is built from.
+        :param params: JSON-serializable parameters the output depends on.
+        """
+        folder, output_name = os.path.split(output_path)
+        inputs = {os.path.basename(path): path for path in inputs}
+        params = _normalize(params)
+        entry = self._manifest(folder).outputs.get(output_name)
+
+        current = (not self.force and entry is not None and os.path.exists(output_path)
+                   and entry.get('params') == params and set(entry.get('inputs', {})) == set(inputs)
+                   and all(self._input_unchanged(path, entry['inputs'][name]) for name, path in inputs.items()))
+        if current:
+            self.up_to_date.append(output_path)
+            return False
+        for path in inputs.values():
+            self._stat(path)
+        self._pending[output_path] = (inputs, params, entry)
+        return True
+
+    def record(self, output_path):
+        """
+        Records a planned output as built. Inputs that changed since planning are left out, so the output stays
+        stale.
+        """
+        inputs, params, entry = self._pending.pop(output_path)
+        recorded = {}
+        for name, path in inputs.items():
+            planned = self._stats[path]
+            if planned is None or file_fingerprint(path, with_hash=False) != planned:
+                recorded[name] = None
+                continue
+            previous = (entry or {}).get('inputs', {}).get(name)
+            if previous and previous.get('size') == planned['size'] and previous.get('mtime_ns') == planned['mtime_ns']:
+                # Unchanged since the last build, reuse its hash instead of reading the file again
+                recorded[name] = previous
+            else:
+                recorded[name] = dict(planned, hash=self._digest(path))
+
+        folder, output_name = os.path.split(output_path)
+        self._manifest(folder).outputs[output_name] = {'inputs': recorded, 'params': params}
+
+    def save(self):
+        """
+        Writes the build manifest of every output folder that was planned.
+        """
+        for manifest in self._manifests.values():
+            if os.path.isdir(manifest.folder):
+                manifest.save()
@@ -0,0 +1,169 @@
+# comparison.py
+
+import os
+import numpy as np
+import pandas as pd
+from modules.data_extraction import load_model_data
+from modules.grid_index import load_grid_index
+from modules.grid_reader import grid_positions
+from modules.hycross_extraction import extract_fpxsec_results
+from modules.hystruc_extraction import extract_hystruc_results
+from modules.rasterization import TILED_RASTER_OPTIONS, build_raster_blocks, write_raster_tiled
+from modules.utilities import add_metrics, create_required_folders, time_function
+
+# Model data columns compared by default
+COMPARE_COLUMNS = ['depth_max', 'wse_max', 'velocity', 'q_max']
+# Written in the compared project unless another folder is given
+COMPARISON_FOLDER = 'flo2d_compare'
+COMPARISON_SUMMARY_NAME = 'comparison_summary.csv'
+# Peak values compared per cross section and per structure
+FPXSEC_PEAK_COLUMNS = ['q_max', 'time_max', 'vol_acft', 'wse_max']
+HYSTRUC_PEAK_COLUMNS = ['Qpeak_cfs', 'Tpeak_hrs', 'Vol_acft', 'HWpeak']
+# Cell centers closer than this fraction of the cell size are the same cell
+CELL_MATCH_TOLERANCE = 0.01
+
+
+def match_cells(base_index, other_index):
+    """
+    Finds the cell of other matching each cell of base: by grid_id when both grids give the same ids the same
+    centers, otherwise by cell center coordinates.
+    :param base_index: GridIndex of the reference model.
+    :param other_index: GridIndex of the compared model.
+    :return: (positions in other of the base cells, -1 where there is no counterpart, 'grid_id' or 'coordinates').
+    """
+    cell_size = base_index.cell_size
+    if not np.isclose(cell_size, other_index.cell_size, rtol=1e-6):
+        raise ValueError(f"Cell sizes differ ({cell_size} and {other_index.cell_size}), the grids cannot be "
+                         f"compared cell by cell")
+    tolerance = cell_size * CELL_MATCH_TOLERANCE
+
+    positions = grid_positions(other_index.grid_ids, base_index.grid_ids)
+    found = positions >= 0
+    if (found.any() and np.allclose(base_index.x[found], other_index.x[positions[found]], rtol=0, atol=tolerance)
+            and np.allclose(base_index.y[found], other_index.y[positions[found]], rtol=0, atol=tolerance)):
+        return positions, 'grid_id'
+
+    # Place the other cell centers in the base raster frame and match them on (row, col)
+    transform = base_index.raster_grid.transform
+    col_offsets = (other_index.x - transform.c) / cell_size - 0.5
+    row_offsets = (transform.f - other_index.y) / cell_size - 0.5
+    cols, rows = np.rint(col_offsets).astype(np.int64), np.rint(row_offsets).astype(np.int64)
+    on_center = ((np.abs(col_offsets - cols) <= CELL_MATCH_TOLERANCE) &
+                 (np.abs(row_offsets - rows) <= CELL_MATCH_TOLERANCE))
+
+    row_min, col_min = min(rows.min(), base_index.rows.min()), min(cols.min(), base_index.cols.min())
+    width = max(cols.max(), base_index.cols.max()) - col_min + 1
+    other_keys = np.where(on_center, (rows - row_min) * width + cols - col_min, -1)
+    base_keys = (base_index.rows - row_min) * width + base_index.cols - col_min
+    return grid_positions(other_keys, base_keys), 'coordinates'
+
+
+def aligned_values(model_data, positions, column):
+    """
+    Returns a column of model_data in the order of the base cells, NaN where a base cell has no counterpart.
+    """
+    found = positions >= 0
+    values = np.full(len(positions), np.nan, dtype=np.float32)
+    values[found] = model_data[column].to_numpy()[positions[found]]
+    return values
+
+
+def delta_statistics(column, base_values, other_values, tolerance=0.0):
+    """
+    Summarizes the change of a column over the cells present in both models.
+    :param tolerance: Changes up to this magnitude count as unchanged.
+    :return: Dict of statistics. Wet cell counts are only given for depth_max.
+    """
+    delta = other_values - base_values
+    compared = ~np.isnan(delta)
+    changes = delta[compared]
+    statistics = {
+        'column': column,
+        'cells_compared': int(compared.sum()),
+        'mean_delta': float(changes.mean()) if len(changes) else np.nan,
+        'min_delta': float(changes.min()) if len(changes) else np.nan,
+        'max_delta': float(changes.max()) if len(changes) else np.nan,
+        'mean_abs_delta': float(np.abs(changes).mean()) if len(changes) else np.nan,
+        'cells_increased': int((changes > tolerance).sum()),
+        'cells_decreased': int((changes < -tolerance).sum()),
+        'cells_newly_wet': None,
+        'cells_newly_dry': None,
+    }
+    if column == 'depth_max':
+        base_wet, other_wet = base_values[compared] > 0, other_values[compared] > 0
+        statistics['cells_newly_wet'] = int((other_wet & ~base_wet).sum())
+        statistics['cells_newly_dry'] = int((base_wet & ~other_wet).sum())
+    return statistics
+
+
+def peak_changes(base_results, other_results, key, columns):
+    """
+    Joins two result tables on key, with the base, other and delta (other minus base) value of each column. Items
+    present in only one of them have NaN deltas.
+    """
+    changes = base_results[[key] + columns].merge(other_results[[key] + columns], on=key, how='outer',
+                                                  suffixes=('_base', '_other'))
+    for column in columns:
+        changes[f'{column}_delta'] = changes[f'{column}_other'] - changes[f'{column}_base']
+    return changes
+
+
+def has_files(file_names, *folders):
+    return all(os.path.exists(os.path.join(folder, file_name)) for folder in folders for file_name in file_names)
+
+
+@time_function
+def compare_projects(base_path, other_path, output_folder=None, crs=None, columns=None, tolerance=0.0,
+                     use_cache=True, shared_cache=None):
+    """
+    Compares two runs of a model, e.g. existing and proposed conditions. Cells are matched on grid_id, or on
+    coordinates when the grids differ, and for each column the change (other minus base) is written as
+    <column>_delta.tif on the base grid, with its statistics in COMPARISON_SUMMARY_NAME. Cross section and
+    structure peak changes go to fpxsec_changes.csv and hystruc_changes.csv when both projects have the files.
+    Parses go through the model caches of both projects.
+    :param base_path: Reference project folder.
+    :param other_path: Compared project folder.
+    :param output_folder: Defaults to COMPARISON_FOLDER in the compared project.
+    :param crs: Raster CRS.
+    :param columns: Model data columns to compare. Defaults to COMPARE_COLUMNS.
+    :param tolerance: Changes up to this magnitude count as unchanged in the summary.
+    :return: Summary DataFrame, one row per column.
+    """
+    columns = COMPARE_COLUMNS if columns is None else columns
+    output_folder = output_folder or os.path.join(other_path, COMPARISON_FOLDER)
+    create_required_folders([output_folder])
+
+    base_index = load_grid_index(base_path, use_cache, shared_cache)
+    other_index = load_grid_index(other_path, use_cache, shared_cache)
+    positions, method = match_cells(base_index, other_index)
+    matched = int((positions >= 0).sum())
+    print(f"Matched {matched} of {len(base_index)} cells on {method}")
+
+    base_data = load_model_data(base_path, columns, use_cache)
+    other_data = load_model_data(other_path, columns, use_cache)
+    grid = base_index.raster_grid
+    blocks = build_raster_blocks(grid, TILED_RASTER_OPTIONS['blocksize'])
+    rows = []
+    for column in columns:
+        base_values = base_data[column].to_numpy()
+        other_values = aligned_values(other_data, positions, column)
+        raster_file = os.path.join(output_folder, f'{column}_delta.tif')
+        write_raster_tiled(grid, blocks, other_values - base_values, raster_file, crs, **TILED_RASTER_OPTIONS)
+        rows.append(delta_statistics(column, base_values, other_values, tolerance))
+    summary = pd.DataFrame(rows).astype({'cells_newly_wet': 'Int64', 'cells_newly_dry': 'Int64'})
+    summary.insert(1, 'matched_on', method)
+    summary.insert(3, 'cells_base_only', len(base_index) - matched)
+    summary.insert(4, 'cells_other_only', len(other_index) - matched)
+    summary.to_csv(os.path.join(output_folder, COMPARISON_SUMMARY_NAME), index=False)
+    add_metrics(rows=len(base_index) * len(columns))
+
+    if has_files(['HYCROSS.OUT'], base_path, other_path):
+        fpxsec_changes = peak_changes(extract_fpxsec_results(base_path), extract_fpxsec_results(other_path),
+                                      'fpxs_id', FPXSEC_PEAK_COLUMNS)
+        fpxsec_changes.to_csv(os.path.join(output_folder, 'fpxsec_changes.csv'), index=False)
+    if has_files(['HYSTRUC.DAT', 'HYDROSTRUCT.OUT'], base_path, other_path):
+        hystruc_changes = peak_changes(extract_hystruc_results(base_path, use_cache),
+                                       extract_hystruc_results(other_path, use_cache),
+                                       'Structure Name', HYSTRUC_PEAK_COLUMNS)
+        hystruc_changes.to_csv(os.path.join(output_folder, 'hystruc_changes.csv'), index=False)
+    return summary
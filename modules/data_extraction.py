@@ -1,98 +1,322 @@
 # data_extraction.py
 
+import numpy as np
 import pandas as pd
 import os
-from modules.utilities import time_function
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from modules.grid_reader import read_grid_columns, align_on_grid_id, grid_positions
+from modules.model_cache import ModelCache
+from modules.utilities import add_metrics, time_function
 
-@time_function
-def extractModelDataToDF(file_path):
+# Per-cell FLO-2D files merged into the model table, in column order:
+# (file name, {column: zero-based field}, header lines to skip, grid_id field or None when row order is grid order)
+DEPTH_SPEC = ('DEPTH.OUT', {'x': 1, 'y': 2, 'depth_max': 3}, 0, 0)
+GREEN_AMPT_SPEC = ('INFIL.DAT', {'xksat': 2, 'psif': 3, 'dtheta': 4, 'abstrinf': 5, 'rtimpf': 6, 'soil_depth': 7}, 3, 1)
+GRID_FILE_SPECS = [
+    ('MANNINGS_N.DAT', {'mannings_n': 1}, 0, 0),
+    ('TOPO.DAT', {'topo': 2}, 0, None),
+    ('VELFP.OUT', {'velocity': 3}, 0, 0),
+    ('MAXQHYD.OUT', {'q_max': 7, 'flow_dir': 8}, 4, 0),
+    ('MAXWSELEV.OUT', {'wse_max': 3}, 0, 0),
+    ('INFIL_DEPTH.OUT', {'infil_depth': 4, 'infil_stop': 5}, 1, 0),
+    ('TIMEONEFT.OUT', {'time_of_oneft': 3}, 0, 0),
+    ('TIMETWOFT.OUT', {'time_of_twoft': 3}, 0, 0),
+    ('TIMETOPEAK.OUT', {'time_to_peak': 3}, 0, 0),
+    ('FINALVEL.OUT', {'final_velocity': 3}, 0, 0),
+    ('FINALDEP.OUT', {'final_depth': 3}, 0, 0),
+]
+
+# Compact dtypes of ModelData columns. Other value columns are float32; coordinates keep float64 precision
+COLUMN_DTYPES = {'grid_id': np.int32, 'x': np.float64, 'y': np.float64, 'flow_dir': np.int8}
+VALUE_DTYPE = np.float32
+
+INFIL_METHODS = {
+    '1': 'Green and Ampt',
+    '2': 'SCS Curve Number',
+    '3': 'SCS Curve Number and Green and Ampt',
+    '4': 'Horton',
+}
+
+
+def read_infil_method(file_path):
     """
-    Extracts model data from various files and compiles it into a DataFrame.
-    :param file_path: Path to the directory containing the model data files.
-    :return: A DataFrame containing the compiled model data.
+    Returns the infiltration method named on the first line of INFIL.DAT, 'None' when the project has no INFIL.DAT.
     """
-    # Read DEPTH.OUT file and create DataFrame
-    data_df = pd.read_csv(os.path.join(file_path, 'DEPTH.OUT'), sep=r'\s+', header=None, names=['grid_id', 'x', 'y', 'depth_max'])
-
-    # Read INFIL.DAT file and add to DataFrame
-    with open(os.path.join(file_path, 'INFIL.DAT'), 'r') as file:
+    infil_path = os.path.join(file_path, 'INFIL.DAT')
+    if not os.path.exists(infil_path):
+        return 'None'
+    with open(infil_path, 'r') as file:
         first_line = file.readline().strip()
-        if first_line == '1':
-            infil_method = 'Green and Ampt'
-            infil_df = pd.read_csv(os.path.join(file_path, 'INFIL.DAT'), sep=r'\s+', header=None, names=['xksat', 'psif', 'dtheta', 'abstrinf', 'rtimpf', 'soil_depth'], usecols=[2, 3, 4, 5, 6, 7], skiprows=3)
-            data_df['xksat'] = infil_df['xksat']
-            data_df['psif'] = infil_df['psif']
-            data_df['dtheta'] = infil_df['dtheta']
-            data_df['abstrinf'] = infil_df['abstrinf']
-            data_df['rtimpf'] = infil_df['rtimpf']
-            data_df['soil_depth'] = infil_df['soil_depth']
-        elif first_line == '2':
-            infil_method = 'SCS Curve Number'
-        elif first_line == '3':
-            infil_method = 'SCS Curve Number and Green and Ampt'
-        elif first_line == '4':
-            infil_method = 'Horton'
-        else:
-            infil_method = 'None'
-
-    # Read MANNINGS_N.DAT and add to DataFrame
-    mannings_n_df = pd.read_csv(os.path.join(file_path, 'MANNINGS_N.DAT'), sep=r'\s+', header=None, names=['mannings_n'], usecols=[1])
-    data_df['mannings_n'] = mannings_n_df['mannings_n']
-
-    # Read TOPO.DAT and add to DataFrame
-    topo_df = pd.read_csv(os.path.join(file_path, 'TOPO.DAT'), sep=r'\s+', header=None, names=['topo'], usecols=[2])
-    data_df['topo'] = topo_df['topo']
-
-    # Read VELFP.OUT and add to DataFrame
-    velfp_df = pd.read_csv(os.path.join(file_path, 'VELFP.OUT'), sep=r'\s+', header=None, usecols=[3], names=['velocity'])
-    data_df['velocity'] = velfp_df['velocity']
-
-    # Read MAXQHYD.OUT and filter valid rows
-    maxqhyd_df = pd.read_csv(os.path.join(file_path, 'MAXQHYD.OUT'), sep=r'\s+', header=None, skiprows=4)
-    maxqhyd_df = maxqhyd_df[maxqhyd_df[0] >= 1]
-    data_df['q_max'] = maxqhyd_df[7]
-    data_df['flow_dir'] = maxqhyd_df[8]
-
-    # Read MAXWSELEV.OUT and add to DataFrame
-    maxwselev_df = pd.read_csv(os.path.join(file_path, 'MAXWSELEV.OUT'), sep=r'\s+', header=None, usecols=[3], names=['wse_max'])
-    data_df['wse_max'] = maxwselev_df['wse_max']
-
-    # Read INFIL_DEPTH.OUT and add to DataFrame
-    infil_depth_df = pd.read_csv(os.path.join(file_path, 'INFIL_DEPTH.OUT'), sep=r'\s+', header=None, names=['infil_depth', 'infil_stop'], usecols=[4, 5], skiprows=1)
-    data_df['infil_depth'] = infil_depth_df['infil_depth']
-    data_df['infil_stop'] = infil_depth_df['infil_stop']
-
-    # Read TIMEONEFT.OUT and add to DataFrame
-    timeoneft_df = pd.read_csv(os.path.join(file_path, 'TIMEONEFT.OUT'), sep=r'\s+', header=None, names=['time_of_oneft'], usecols=[3])
-    data_df['time_of_oneft'] = timeoneft_df['time_of_oneft']
-
-    # Read TIMETWOFT.OUT and add to DataFrame
-    timetwoft_df = pd.read_csv(os.path.join(file_path, 'TIMETWOFT.OUT'), sep=r'\s+', header=None, names=['time_of_twoft'], usecols=[3])
-    data_df['time_of_twoft'] = timetwoft_df['time_of_twoft']
-
-    # Read TIMETOPEAK.OUT and add to DataFrame
-    timetopeak_df = pd.read_csv(os.path.join(file_path, 'TIMETOPEAK.OUT'), sep=r'\s+', header=None, names=['time_to_peak'], usecols=[3])
-    data_df['time_to_peak'] = timetopeak_df['time_to_peak']
-
-    # Read FINALVEL.OUT and add to DataFrame
-    finalvel_df = pd.read_csv(os.path.join(file_path, 'FINALVEL.OUT'), sep=r'\s+', header=None, names=['final_velocity'], usecols=[3])
-    data_df['final_velocity'] = finalvel_df['final_velocity']
-
-    # Read FINALDEP.OUT and add to DataFrame
-    finaldep_df = pd.read_csv(os.path.join(file_path, 'FINALDEP.OUT'), sep=r'\s+', header=None, names=['final_depth'], usecols=[3])
-    data_df['final_depth'] = finaldep_df['final_depth']
-
-    # Read FPXSEC.DAT line by line and update DataFrame
-    with open(os.path.join(file_path, 'FPXSEC.DAT'), 'r') as file:
+    return INFIL_METHODS.get(first_line, 'None')
+
+
+def get_grid_file_specs(file_path):
+    """
+    Returns the file specs to merge for this project. Green and Ampt parameters are only read from INFIL.DAT
+    when it uses that method.
+    """
+    specs = []
+    if read_infil_method(file_path) == 'Green and Ampt':
+        specs.append(GREEN_AMPT_SPEC)
+    return specs + GRID_FILE_SPECS
+
+
+def unavailable_columns(file_path, columns):
+    """
+    Returns the columns this project cannot provide: the Green and Ampt parameters unless INFIL.DAT uses that method.
+    """
+    if read_infil_method(file_path) == 'Green and Ampt':
+        return []
+    return [column for column in columns if column in GREEN_AMPT_SPEC[1]]
+
+
+def grid_column_specs():
+    """
+    Returns the spec each model data column is read from, including the Green and Ampt columns.
+    """
+    return {column: spec for spec in [DEPTH_SPEC, GREEN_AMPT_SPEC] + GRID_FILE_SPECS for column in spec[1]}
+
+
+def read_grid_file(file_path, spec, cache=None):
+    """
+    Reads one per-cell file described by a spec, going through the model cache when one is given.
+    :return: Dict with a 'grid_id' array and one array per spec column.
+    """
+    file_name, columns, skiprows, id_field = spec
+
+    def parse():
+        source = os.path.join(file_path, file_name)
+        grid_ids, values = read_grid_columns(source, columns, skiprows, id_field)
+        add_metrics(nbytes=os.path.getsize(source))
+        return dict(values, grid_id=grid_ids)
+
+    arrays = parse() if cache is None else cache.load(file_name, [columns, skiprows, id_field], parse)
+    add_metrics(rows=len(arrays['grid_id']))
+    return arrays
+
+
+@time_function
+def read_fpxsec_nodes(file_path):
+    """
+    Parses the floodplain cross section node lists of FPXSEC.DAT.
+    :param file_path: Path to the directory containing FPXSEC.DAT.
+    :return: DataFrame with fpxsec (1-based X line number), node_order and grid_id columns in file order.
+    """
+    fpxsec_ids = []
+    grid_ids = []
+    fpxsec_file = os.path.join(file_path, 'FPXSEC.DAT')
+    with open(fpxsec_file, 'r') as file:
         line_number = 0
         for line in file:
             parts = line.split()
             if parts and parts[0] == 'X':
                 line_number += 1
-                grid_ids = [int(grid) - 1 for grid in parts[3:] if grid.isdigit()]
-                for grid_id in grid_ids:
-                    if grid_id >= len(data_df):
-                        data_df = data_df.append(pd.Series(), ignore_index=True)
-                    data_df.at[grid_id, 'fpxsec'] = line_number
+                nodes = [int(grid) for grid in parts[3:] if grid.isdigit()]
+                grid_ids.extend(nodes)
+                fpxsec_ids.extend([line_number] * len(nodes))
+
+    nodes_df = pd.DataFrame({'fpxsec': np.array(fpxsec_ids, dtype=np.int64),
+                             'grid_id': np.array(grid_ids, dtype=np.int64)})
+    nodes_df.insert(1, 'node_order', nodes_df.groupby('fpxsec').cumcount())
+    add_metrics(rows=len(nodes_df), nbytes=os.path.getsize(fpxsec_file))
+    return nodes_df
+
+
+@time_function
+def extractModelDataToDF(file_path, use_cache=True, max_workers=None):
+    """
+    Extracts model data from various files and compiles it into a DataFrame.
+    :param file_path: Path to the directory containing the model data files.
+    :param use_cache: Reuse parsed files from the project's flo2d_cache folder when their sources are unchanged.
+    :param max_workers: Number of threads reading files concurrently. None uses the executor default, 1 reads serially.
+    :return: A DataFrame containing the compiled model data.
+    """
+    cache = ModelCache(file_path) if use_cache else None
+    specs = [DEPTH_SPEC] + get_grid_file_specs(file_path)
+
+    # The files are independent, so read them concurrently and merge in spec order to keep the column order fixed
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(copy_context().run, time_function(read_grid_file, name=f'read_grid_file {spec[0]}'),
+                                   file_path, spec, cache)
+                   for spec in specs]
+        results = [future.result() for future in futures]
+
+    # DEPTH.OUT defines the grid every other file is aligned to
+    depth = results[0]
+    grid_ids = depth.pop('grid_id')
+    data = {'grid_id': grid_ids}
+    data.update(depth)
+
+    for values in results[1:]:
+        file_ids = values.pop('grid_id')
+        for column, column_values in values.items():
+            data[column] = align_on_grid_id(grid_ids, file_ids, column_values)
 
+    if cache is not None:
+        cache.save()
+    data_df = pd.DataFrame(data)
+
+    data_df['fpxsec'] = fpxsec_membership(file_path, grid_ids)
+
+    add_metrics(rows=len(data_df))
     return data_df
+
+
+def fpxsec_membership(file_path, grid_ids):
+    """
+    Assigns cross section membership from FPXSEC.DAT in one vectorized step. A cell on several cross sections
+    keeps the last one, and nodes outside the grid are ignored.
+    :return: Cross section number of each cell in grid_ids order, NaN for cells on none.
+    """
+    nodes = read_fpxsec_nodes(file_path).drop_duplicates('grid_id', keep='last')
+    positions = grid_positions(grid_ids, nodes['grid_id'].to_numpy())
+    valid = positions >= 0
+    fpxsec = np.full(len(grid_ids), np.nan)
+    fpxsec[positions[valid]] = nodes['fpxsec'].to_numpy()[valid]
+    return fpxsec
+
+
+def compact_column(column, values):
+    """
+    Casts a column to its COLUMN_DTYPES dtype, float32 by default. Missing values of integer columns become 0.
+    """
+    dtype = np.dtype(COLUMN_DTYPES.get(column, VALUE_DTYPE))
+    values = np.asarray(values)
+    if dtype.kind in 'iu' and values.dtype.kind == 'f':
+        values = np.nan_to_num(values, nan=0)
+    return values.astype(dtype, copy=False)
+
+
+class ModelData:
+    """
+    Model table loaded column by column. A source file is only read on first access to one of its columns, and
+    columns are kept with compact dtypes (int32 grid_id, float32 values, int8 flow_dir). Columns are returned as
+    pandas Series, so it stands in for the extractModelDataToDF DataFrame in the exporters. Safe to share between
+    threads: concurrent accesses to columns of the same file read it once.
+    """
+
+    def __init__(self, file_path, columns=None, use_cache=True):
+        """
+        :param file_path: Path to the directory containing the model data files.
+        :param columns: Columns that may be loaded, besides grid_id, x and y. Defaults to every model column.
+        :param use_cache: Go through the project's flo2d_cache folder.
+        """
+        self.file_path = file_path
+        self.use_cache = use_cache
+        self._specs = grid_column_specs()
+        available = list(self._specs) + ['fpxsec']
+        if columns is not None:
+            unknown = [column for column in columns if column not in available]
+            if unknown:
+                raise KeyError(f"Unknown model data column(s) {unknown}")
+        self.columns = ['grid_id', 'x', 'y'] + [column for column in (columns if columns is not None else available)
+                                                 if column not in ('x', 'y')]
+        self._init_locks()
+        self._values = {}
+
+        # DEPTH.OUT defines the grid every other file is aligned to
+        self._load_spec(DEPTH_SPEC)
+
+    def _init_locks(self):
+        self._lock = threading.Lock()
+        self._file_locks = {}
+        self._cache = ModelCache(self.file_path) if self.use_cache else None
+
+    def __getstate__(self):
+        # Locks and the cache handle are recreated on unpickling, e.g. in process pool workers
+        state = dict(self.__dict__)
+        for name in ('_lock', '_file_locks', '_cache'):
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_locks()
+
+    def __len__(self):
+        return len(self._values['grid_id'])
+
+    def __contains__(self, column):
+        return column in self.columns
+
+    def __getitem__(self, column):
+        return pd.Series(self.values(column), name=column, copy=False)
+
+    def _file_lock(self, file_name):
+        with self._lock:
+            return self._file_locks.setdefault(file_name, threading.Lock())
+
+    def _load_spec(self, spec):
+        file_name, columns, _, _ = spec
+        with self._file_lock(file_name):
+            if all(column in self._values for column in columns):
+                return
+            if spec is GREEN_AMPT_SPEC and read_infil_method(self.file_path) != 'Green and Ampt':
+                raise KeyError(f"{list(columns)} are only available when INFIL.DAT uses the Green and Ampt method")
+
+            arrays = time_function(read_grid_file, name=f'read_grid_file {file_name}')(self.file_path, spec, self._cache)
+            if self._cache is not None:
+                self._cache.save()
+            file_ids = arrays.pop('grid_id')
+            if spec is DEPTH_SPEC:
+                self._grid_ids = file_ids
+                self._values['grid_id'] = compact_column('grid_id', file_ids)
+            for column, values in arrays.items():
+                if spec is not DEPTH_SPEC:
+                    values = align_on_grid_id(self._grid_ids, file_ids, values)
+                self._values[column] = compact_column(column, values)
+
+    def values(self, column):
+        """
+        Returns the NumPy array of a column, reading its source file on first access.
+        """
+        if column not in self.columns:
+            raise KeyError(f"Model data column {column!r} was not selected")
+        if column not in self._values:
+            if column == 'fpxsec':
+                with self._file_lock('FPXSEC.DAT'):
+                    if column not in self._values:
+                        self._values[column] = compact_column(column, fpxsec_membership(self.file_path,
+                                                                                         self._grid_ids))
+            else:
+                self._load_spec(self._specs[column])
+        return self._values[column]
+
+    def load(self, columns=None, max_workers=None):
+        """
+        Reads the source files of several columns concurrently.
+        """
+        columns = self.columns if columns is None else columns
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for future in [executor.submit(copy_context().run, self.values, column) for column in columns]:
+                future.result()
+        return self
+
+    def to_dataframe(self, columns=None):
+        """
+        Returns the loaded columns, plus any requested ones, as a DataFrame with compact dtypes.
+        """
+        columns = [column for column in self.columns if column in self._values] if columns is None else columns
+        self.load(columns)
+        return pd.DataFrame({column: self._values[column] for column in columns}, copy=False)
+
+    def memory_usage(self):
+        """
+        Returns the bytes held by the loaded columns.
+        """
+        return sum(values.nbytes for values in self._values.values())
+
+
+@time_function
+def load_model_data(file_path, columns=None, use_cache=True):
+    """
+    Returns a lazily loaded ModelData. Only DEPTH.OUT is read up front; other files are read when a column of
+    theirs is first used.
+    :param columns: Columns that may be loaded. A depth and velocity selection never reads INFIL.DAT or the
+        arrival time files.
+    """
+    model_data = ModelData(file_path, columns, use_cache)
+    add_metrics(rows=len(model_data))
+    return model_data
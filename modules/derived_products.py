@@ -0,0 +1,164 @@
+# derived_products.py
+
+import ast
+import csv
+import os
+from collections import namedtuple
+import numpy as np
+from modules.data_extraction import grid_column_specs
+from modules.rasterization import TILED_RASTER_OPTIONS, build_raster_blocks, write_raster_tiled
+from modules.utilities import add_metrics, time_function
+
+# A layer computed from model data columns. With bins, ascending class edges, the value is classified into classes
+# 1 .. len(bins) + 1, named by labels
+DerivedProduct = namedtuple('DerivedProduct', ['name', 'expression', 'bins', 'labels'], defaults=(None, None))
+
+# Hazard class thresholds of FLO-2D hazard maps, 0.5 m of depth or 0.5 m2/s of depth x velocity for medium and three
+# times that for high, in feet and ft2/s
+HAZARD_DEPTH = 1.64
+HAZARD_DEPTH_VELOCITY = 5.38
+
+DERIVED_PRODUCTS = {product.name: product for product in [
+    DerivedProduct('depth_x_velocity', 'depth_max * velocity'),
+    DerivedProduct('flow_depth', 'wse_max - topo'),
+    DerivedProduct('depth_above_1ft', 'where(depth_max > 1, depth_max - 1, nan)'),
+    DerivedProduct('arrival_time', 'where(time_of_oneft > 0, time_of_oneft, nan)'),
+    DerivedProduct('hazard', f'where(depth_max > 0, maximum(depth_max / {HAZARD_DEPTH}, '
+                             f'depth_max * velocity / {HAZARD_DEPTH_VELOCITY}), nan)',
+                   bins=[1, 3], labels=['Low', 'Medium', 'High']),
+]}
+
+# Names usable in expressions besides the model data columns
+EXPRESSION_FUNCTIONS = {name: getattr(np, name) for name in ['abs', 'sqrt', 'exp', 'log', 'log10', 'floor', 'ceil',
+                                                             'minimum', 'maximum', 'fmin', 'fmax', 'where', 'clip',
+                                                             'isnan']}
+EXPRESSION_CONSTANTS = {'nan': np.nan, 'pi': np.pi}
+_EXPRESSION_NODES = (ast.Expression, ast.BinOp, ast.UnaryOp, ast.Compare, ast.Call, ast.Name, ast.Load, ast.Constant,
+                     ast.operator, ast.unaryop, ast.cmpop)
+# Written as nodata for classified products, whose classes start at 1
+CLASS_NODATA = 0
+
+
+def compile_expression(expression):
+    """
+    Parses an expression over model data columns: numbers, arithmetic, comparisons, & | ~ and EXPRESSION_FUNCTIONS.
+    :return: (code object, sorted list of the columns it reads).
+    """
+    try:
+        tree = ast.parse(expression.strip(), mode='eval')
+    except SyntaxError as error:
+        raise ValueError(f"Invalid expression {expression!r}: {error.msg}") from None
+    columns = set()
+    for node in ast.walk(tree):
+        if not isinstance(node, _EXPRESSION_NODES):
+            raise ValueError(f"Unsupported {type(node).__name__} in expression {expression!r}")
+        if isinstance(node, ast.Call) and (node.keywords or not isinstance(node.func, ast.Name)
+                                           or node.func.id not in EXPRESSION_FUNCTIONS):
+            raise ValueError(f"Unsupported call in expression {expression!r}, use one of "
+                             f"{', '.join(EXPRESSION_FUNCTIONS)} with positional arguments")
+        if isinstance(node, ast.Compare) and len(node.ops) > 1:
+            raise ValueError(f"Chained comparison in expression {expression!r}, combine comparisons with &")
+        if isinstance(node, ast.Name) and node.id not in EXPRESSION_FUNCTIONS and node.id not in EXPRESSION_CONSTANTS:
+            columns.add(node.id)
+    return compile(tree, '<expression>', 'eval'), sorted(columns)
+
+
+def product_columns(products):
+    """
+    Returns the model data columns read by products, in first use order.
+    """
+    columns = []
+    for product in products:
+        columns.extend(compile_expression(product.expression)[1])
+    return list(dict.fromkeys(columns))
+
+
+def parse_derived_product(text):
+    """
+    Returns the DERIVED_PRODUCTS entry named text, or the product defined by 'name=expression', optionally followed
+    by ':edge,edge,...' to classify it.
+    """
+    if text in DERIVED_PRODUCTS:
+        return DERIVED_PRODUCTS[text]
+    name, separator, definition = text.partition('=')
+    name = name.strip()
+    if not separator or not name.isidentifier():
+        raise ValueError(f"Expected one of {', '.join(DERIVED_PRODUCTS)} or name=expression, got {text!r}")
+    model_columns = set(grid_column_specs()) | {'grid_id'}
+    if name in model_columns:
+        raise ValueError(f"Derived product {name!r} would overwrite the model data column raster")
+
+    expression, _, edges = definition.partition(':')
+    unknown = [column for column in compile_expression(expression)[1] if column not in model_columns]
+    if unknown:
+        raise ValueError(f"Unknown model data columns {', '.join(unknown)} in {text!r}")
+    bins = None
+    if edges.strip():
+        bins = [float(edge) for edge in edges.split(',')]
+        if any(upper <= lower for lower, upper in zip(bins, bins[1:])) or len(bins) > 254:
+            raise ValueError(f"Class edges of {name!r} should be ascending, at most 254 of them")
+    return DerivedProduct(name, expression.strip(), bins)
+
+
+def evaluate_product(product, model_data):
+    """
+    Evaluates a product over every cell in one vectorized pass, loading only the columns it reads.
+    :param model_data: ModelData or DataFrame of model cells.
+    :return: float32 values. For classified products, uint8 class numbers with CLASS_NODATA where the value is NaN.
+    """
+    code, columns = compile_expression(product.expression)
+    namespace = dict(EXPRESSION_CONSTANTS, **EXPRESSION_FUNCTIONS)
+    namespace.update({column: model_data[column].to_numpy() for column in columns})
+    with np.errstate(divide='ignore', invalid='ignore'):
+        values = eval(code, {'__builtins__': {}}, namespace)
+    values = np.broadcast_to(np.asarray(values, dtype=np.float32), (len(model_data),))
+    if product.bins is None:
+        return values
+
+    classes = (np.digitize(values, product.bins) + 1).astype(np.uint8)
+    classes[np.isnan(values)] = CLASS_NODATA
+    return classes
+
+
+def write_class_table(product, table_path):
+    edges = [-np.inf] + list(product.bins) + [np.inf]
+    labels = product.labels or [''] * (len(edges) - 1)
+    with open(table_path, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['class', 'min', 'max', 'label'])
+        for k, label in enumerate(labels):
+            writer.writerow([k + 1, edges[k], edges[k + 1], label])
+    return table_path
+
+
+@time_function
+def create_derived_rasters(model_data, products, raster_outpath, grid, blocks=None, crs=None, **tiled_options):
+    """
+    Evaluates derived products and writes each as <name>.tif next to the column rasters, on the same grid and tiled
+    layout. Classified products are written as uint8 class numbers, with their class table in <name>_classes.csv.
+    :param model_data: ModelData or DataFrame of model cells.
+    :param products: DerivedProduct list.
+    :param raster_outpath: Output folder.
+    :param grid: RasterGrid of the model, e.g. GridIndex.raster_grid.
+    :param blocks: Prebuilt build_raster_blocks output for grid and the tiled blocksize.
+    :param crs: Raster CRS.
+    :param tiled_options: Overrides for TILED_RASTER_OPTIONS.
+    :return: List of written raster paths.
+    """
+    options = dict(TILED_RASTER_OPTIONS, **tiled_options)
+    if blocks is None:
+        blocks = build_raster_blocks(grid, options['blocksize'])
+
+    raster_files = []
+    for product in products:
+        raster_file = os.path.join(raster_outpath, f'{product.name}.tif')
+        values = evaluate_product(product, model_data)
+        if product.bins is None:
+            write_raster_tiled(grid, blocks, values, raster_file, crs, **options)
+        else:
+            class_options = dict(options, dtype='uint8', nodata=CLASS_NODATA)
+            write_raster_tiled(grid, blocks, values, raster_file, crs, **class_options)
+            write_class_table(product, os.path.join(raster_outpath, f'{product.name}_classes.csv'))
+        add_metrics(rows=len(values), nbytes=os.path.getsize(raster_file))
+        raster_files.append(raster_file)
+    return raster_files
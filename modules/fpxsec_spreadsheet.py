@@ -1,63 +1,52 @@
-import matplotlib.pyplot as plt
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
 import pandas as pd
 from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.chart import ScatterChart, Reference, Series
 from openpyxl.drawing.image import Image
-from openpyxl.utils.dataframe import dataframe_to_rows
-import os
-import re
+from openpyxl.styles import Font
+from modules.hycross_parser import read_hycross
+
+# 'image' embeds matplotlib PNGs, 'native' adds editable workbook charts referencing each section's data,
+# 'none' writes the data only
+PLOT_MODES = ('image', 'native', 'none')
+# 'sheets' writes a data and a plot sheet per section, 'long' one "All Sections" data sheet plus an "Index" sheet
+WORKBOOK_LAYOUTS = ('sheets', 'long')
+# Excel's row limit; the long layout continues on a new data sheet past it
+MAX_SHEET_ROWS = 1048576
+# Rows between stacked plots on the long layout's "Plots" sheet
+PLOT_ROW_SPACING = 20
+# Start method of the plot rendering processes. Forking a process whose other threads are inside GDAL or the cache
+# writers can deadlock the children
+PLOT_START_METHOD = 'spawn'
+
+def iter_hydrograph_data(file_path, hycross=None):
+    """
+    Yields (section, DataFrame) hydrographs one at a time, integrating the maximum discharge at its correct
+    time position.
+    :param file_path: Path to HYCROSS.OUT.
+    :param hycross: HycrossData already parsed with read_hycross, to avoid reading the file again.
+    """
+    sections, summary = hycross if hycross is not None else read_hycross(file_path)
 
-def extract_hydrograph_data_corrected(file_path):
+    # Convert the section arrays to pandas DataFrames and integrate max discharge
+    for section in sections:
+        df = pd.DataFrame({'Time': section.time, 'Discharge': section.discharge})
+        if section.section in summary:
+            section_summary = summary[section.section]
+            df = integrate_max_discharge_in_df(df, (section_summary.time_max, section_summary.q_max))
+        yield section.section, df
+
+def extract_hydrograph_data_corrected(file_path, hycross=None):
     """
     Extracts hydrograph data (time and discharge) from the specified file, integrating the maximum discharge
     at its correct time position.
     """
-    hydrograph_data = {}
-    max_discharge_info = {}  # Store max discharge info for each section
-    current_section = None  # Initialize the current_section variable
-
-    with open(file_path, 'r') as file:
-        for line in file:
-            # Check for the line with maximum discharge information
-            if 'THE MAXIMUM DISCHARGE FROM CROSS SECTION' in line:
-                match = re.search(r'THE MAXIMUM DISCHARGE FROM CROSS SECTION\s*(\d+) IS:\s*([\d.]+) CFS AT TIME:\s*([\d.]+)', line)
-                if match:
-                    section = int(match.group(1))
-                    max_discharge = float(match.group(2))
-                    max_time = float(match.group(3))
-                    max_discharge_info[section] = (max_time, max_discharge)
-                continue
-
-            # Check for the start of a hydrograph section
-            if 'HYDROGRAPH AND FLOODPLAIN HYDRAULICS' in line:
-                match = re.search(r'FOR CROSS SECTION NO:\s*(\d+)', line)
-                if match:
-                    current_section = int(match.group(1))
-                    hydrograph_data[current_section] = []
-                continue
-
-            # Detect the start of the data (after the column headers)
-            if 'TIME' in line and 'DISCHARGE' in line:
-                continue  # Skip the header line
-
-            # Extract data if in a data section
-            if current_section is not None:
-                try:
-                    parts = line.split()
-                    time = float(parts[0])
-                    discharge = float(parts[5])
-                    hydrograph_data[current_section].append((time, discharge))
-                except (IndexError, ValueError):
-                    # Handle lines that do not contain valid data
-                    continue
-
-    # Convert lists to pandas DataFrames and integrate max discharge
-    for section in hydrograph_data:
-        df = pd.DataFrame(hydrograph_data[section], columns=['Time', 'Discharge'])
-        if section in max_discharge_info:
-            df = integrate_max_discharge_in_df(df, max_discharge_info[section])
-        hydrograph_data[section] = df
-
-    return hydrograph_data
+    return dict(iter_hydrograph_data(file_path, hycross))
 
 def integrate_max_discharge_in_df(hydrograph_data, max_discharge_info):
     """
@@ -76,57 +65,208 @@ def integrate_max_discharge_in_df(hydrograph_data, max_discharge_info):
 
     return hydrograph_data
 
+def find_max_discharge(data):
+    max_discharge = data['Discharge'].max()
+    max_time = data[data['Discharge'] == max_discharge]['Time'].iloc[0]
+    return max_discharge, max_time
+
 def plot_hydrograph(data, section, plot_file_path):
     """
-    Creates a hydrograph plot for a given section.
+    Creates a hydrograph plot for a given section. plot_file_path may be a path or a binary file-like object.
+    The figure is drawn on its own Agg canvas rather than through pyplot, so the caller's matplotlib backend and
+    figure state are left alone.
     """
-    plt.figure(figsize=(10, 6))
-    plt.plot(data['Time'], data['Discharge'], label='Discharge')
-    max_discharge = data['Discharge'].max()
-    max_time = data[data['Discharge'] == max_discharge]['Time'].iloc[0]
-    plt.title(f'Hydrograph for Section {section}')
-    plt.xlabel('Time (hours)')
-    plt.ylabel('Discharge (cfs)')
-    plt.grid(True)
-    plt.annotate(f'Max Discharge: {max_discharge} cfs at {max_time} hrs',
-                 xy=(max_time, max_discharge), xytext=(max_time, max_discharge + 0.05 * max_discharge),
-                 arrowprops=dict(facecolor='black', shrink=0.05),
-                 ha='center')
-    plt.savefig(plot_file_path)
-    plt.close()
-
-def export_hydrographs_to_excel_small_plots(hydrograph_data, folder_path, file_path):
+    # Imported here so the native chart mode never loads matplotlib
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    figure = Figure(figsize=(10, 6))
+    FigureCanvasAgg(figure)
+    axes = figure.add_subplot()
+    axes.plot(data['Time'], data['Discharge'], label='Discharge')
+    max_discharge, max_time = find_max_discharge(data)
+    axes.set_title(f'Hydrograph for Section {section}')
+    axes.set_xlabel('Time (hours)')
+    axes.set_ylabel('Discharge (cfs)')
+    axes.grid(True)
+    axes.annotate(f'Max Discharge: {max_discharge} cfs at {max_time} hrs',
+                  xy=(max_time, max_discharge), xytext=(max_time, max_discharge + 0.05 * max_discharge),
+                  arrowprops=dict(facecolor='black', shrink=0.05),
+                  ha='center')
+    figure.savefig(plot_file_path, format='png')
+
+def render_hydrograph_png(section, data):
+    """
+    Renders a section's hydrograph plot with the headless Agg canvas and returns the PNG bytes.
+    Runs in worker processes, so it must stay a module-level function.
+    """
+    buffer = BytesIO()
+    plot_hydrograph(data, section, buffer)
+    return buffer.getvalue()
+
+def render_hydrograph_pngs(hydrographs, max_workers=None):
+    """
+    Renders each section's plot, in a process pool started with PLOT_START_METHOD unless max_workers is 1.
+    Yields (section, data, PNG bytes) in section order. Only a couple of plots per worker are in flight at a
+    time, so memory does not grow with the number of sections.
+    """
+    if max_workers == 1:
+        for section, data in hydrographs:
+            yield section, data, render_hydrograph_png(section, data)
+        return
+
+    max_workers = max_workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=max_workers,
+                             mp_context=multiprocessing.get_context(PLOT_START_METHOD)) as executor:
+        pending = deque()
+        for section, data in hydrographs:
+            pending.append((section, data, executor.submit(render_hydrograph_png, section, data)))
+            if len(pending) >= 2 * max_workers:
+                section, data, future = pending.popleft()
+                yield section, data, future.result()
+        while pending:
+            section, data, future = pending.popleft()
+            yield section, data, future.result()
+
+def create_hydrograph_chart(data_sheet, section, data, first_row=2, time_col=1):
+    """
+    Creates a native workbook line chart of a section's hydrograph, referencing the Time and Discharge
+    columns written to its data sheet. Discharge is the column after time_col.
+    """
+    max_discharge, max_time = find_max_discharge(data)
+    chart = ScatterChart()
+    chart.title = f'Hydrograph for Section {section}\nMax Discharge: {max_discharge} cfs at {max_time} hrs'
+    chart.style = 13
+    chart.x_axis.title = 'Time (hours)'
+    chart.y_axis.title = 'Discharge (cfs)'
+    chart.x_axis.delete = False
+    chart.y_axis.delete = False
+    chart.legend = None
+    chart.width, chart.height = 16, 9.6
+
+    last_row = first_row + len(data) - 1
+    times = Reference(data_sheet, min_col=time_col, min_row=first_row, max_row=last_row)
+    discharges = Reference(data_sheet, min_col=time_col + 1, min_row=first_row, max_row=last_row)
+    series = Series(discharges, times, title='Discharge')
+    series.marker.symbol = 'none'
+    series.smooth = False
+    chart.series.append(series)
+    return chart
+
+def create_plot_image(png):
+    img = Image(BytesIO(png))
+
+    # Reduce the size of the image to 1/4
+    img.width, img.height = img.width / 2, img.height / 2
+    return img
+
+def header_row(sheet, names):
+    cells = []
+    for name in names:
+        cell = WriteOnlyCell(sheet, value=name)
+        cell.font = Font(bold=True)
+        cells.append(cell)
+    return cells
+
+def write_section_sheets(workbook, sections, plot_mode):
+    """
+    Writes a data sheet and a plot sheet per cross section. Each write-only sheet holds a temp file open until it
+    is closed, so sheets are closed once written rather than at save, which would run out of file handles on
+    models with a thousand sections or more.
+    """
+    for section, data, png in sections:
+        data_sheet = workbook.create_sheet(f"Section {section} Data")
+        data_sheet.append(header_row(data_sheet, ['Time', 'Discharge']))
+        for row in zip(data['Time'].tolist(), data['Discharge'].tolist()):
+            data_sheet.append(row)
+        data_sheet.close()
+
+        if plot_mode == 'none':
+            continue
+        plot_sheet = workbook.create_sheet(f"Section {section} Plot")
+        # The chart references its data sheet by title, so the closed sheet can still be charted
+        if plot_mode == 'native':
+            plot_sheet.add_chart(create_hydrograph_chart(data_sheet, section, data), 'A1')
+        else:
+            plot_sheet.add_image(create_plot_image(png), 'A1')
+        # Closing writes the sheet's drawing relation, so it follows add_chart and add_image
+        plot_sheet.close()
+
+def create_long_data_sheet(workbook, title):
+    data_sheet = workbook.create_sheet(title)
+    data_sheet.append(header_row(data_sheet, ['Section', 'Time', 'Discharge']))
+    return data_sheet
+
+def write_long_sheets(workbook, sections, plot_mode):
+    """
+    Writes every cross section to a single long-format "All Sections" sheet, with an "Index" sheet locating each
+    section's rows and a "Plots" sheet stacking the plots.
+    """
+    index_sheet = workbook.create_sheet('Index')
+    index_sheet.append(header_row(index_sheet, ['Section', 'Sheet', 'First Row', 'Last Row',
+                                                'Max Discharge', 'Time of Max']))
+    data_sheets = 1
+    data_sheet = create_long_data_sheet(workbook, 'All Sections')
+    plot_sheet = workbook.create_sheet('Plots') if plot_mode != 'none' else None
+    next_row = 2
+
+    for plot_number, (section, data, png) in enumerate(sections):
+        if next_row + len(data) - 1 > MAX_SHEET_ROWS:
+            data_sheets += 1
+            data_sheet = create_long_data_sheet(workbook, f'All Sections ({data_sheets})')
+            next_row = 2
+
+        first_row, last_row = next_row, next_row + len(data) - 1
+        for time, discharge in zip(data['Time'].tolist(), data['Discharge'].tolist()):
+            data_sheet.append([section, time, discharge])
+        next_row = last_row + 1
+
+        max_discharge, max_time = find_max_discharge(data)
+        index_sheet.append([section, data_sheet.title, first_row, last_row, max_discharge, max_time])
+
+        anchor = f'A{1 + plot_number * PLOT_ROW_SPACING}'
+        if plot_mode == 'native':
+            plot_sheet.add_chart(create_hydrograph_chart(data_sheet, section, data, first_row, time_col=2), anchor)
+        elif plot_mode == 'image':
+            plot_sheet.add_image(create_plot_image(png), anchor)
+
+def export_hydrographs_to_excel_small_plots(hydrograph_data, folder_path, file_path, plot_mode='image', max_workers=None,
+                                            layout='sheets'):
     """
     Exports hydrograph data to an Excel file with separate sheets for each cross section's data and plots.
+    The workbook is written in streaming mode: rows are flushed as each section is produced, so memory stays
+    flat however many sections there are.
+    :param hydrograph_data: Dict or iterable of (section, DataFrame) pairs, e.g. iter_hydrograph_data().
+    :param plot_mode: 'image' to embed matplotlib PNGs, 'native' for workbook charts (no images or temp files),
+        'none' for data only.
+    :param max_workers: Processes rendering the 'image' plots. None uses every core, 1 renders in this process.
+    :param layout: 'sheets' for two sheets per section, 'long' for one "All Sections" data sheet plus an index.
     """
-    with pd.ExcelWriter(file_path, engine='openpyxl') as writer:
-        # Export each cross section's data to a different sheet
-        for section, data in hydrograph_data.items():
-            # Export data
-            data_sheet_name = f"Section {section} Data"
-            data.to_excel(writer, sheet_name=data_sheet_name, index=False)
-
-            # Create and save plot
-            plot_file_name = f"section_{section}_plot.png"
-            plot_file_path = os.path.join(folder_path, plot_file_name)
-            plot_hydrograph(data, section, plot_file_path)
-
-            # Add plot to the Excel file on a new sheet with reduced size
-            plot_sheet_name = f"Section {section} Plot"
-            workbook = writer.book
-            plot_sheet = workbook.create_sheet(plot_sheet_name)
-            img = Image(plot_file_path)
-
-            # Reduce the size of the image to 1/4
-            img.width, img.height = img.width / 2, img.height / 2
-            plot_sheet.add_image(img, 'A1')
-
-def hycross_spreadsheet(folder_path):
+    if plot_mode not in PLOT_MODES:
+        raise ValueError(f"plot_mode must be one of {PLOT_MODES}, got {plot_mode!r}")
+    if layout not in WORKBOOK_LAYOUTS:
+        raise ValueError(f"layout must be one of {WORKBOOK_LAYOUTS}, got {layout!r}")
+
+    hydrographs = hydrograph_data.items() if hasattr(hydrograph_data, 'items') else hydrograph_data
+    # Plots render in parallel into memory while the workbook is assembled here in section order
+    if plot_mode == 'image':
+        sections = render_hydrograph_pngs(hydrographs, max_workers)
+    else:
+        sections = ((section, data, None) for section, data in hydrographs)
+
+    workbook = Workbook(write_only=True)
+    if layout == 'long':
+        write_long_sheets(workbook, sections, plot_mode)
+    else:
+        write_section_sheets(workbook, sections, plot_mode)
+    workbook.save(file_path)
+
+def hycross_spreadsheet(folder_path, hycross=None, plot_mode='image', max_workers=None, layout='sheets'):
     file_path = os.path.join(folder_path, 'HYCROSS.OUT')  # Replace with your input file path
     output_excel_path = os.path.join(folder_path, 'fpxsec_hydrographs.xlsx')  # Replace with your output file path
 
-    # Extracting hydrograph data
-    extracted_data = extract_hydrograph_data_corrected(file_path)
+    # Extracting hydrograph data one section at a time, reusing HYCROSS.OUT if it was already parsed
+    extracted_data = iter_hydrograph_data(file_path, hycross)
 
     # Exporting to Excel
-    export_hydrographs_to_excel_small_plots(extracted_data, folder_path, output_excel_path)
+    export_hydrographs_to_excel_small_plots(extracted_data, folder_path, output_excel_path, plot_mode, max_workers, layout)
@@ -1,31 +1,32 @@
 import os
+import numpy as np
 import pandas as pd
 import geopandas as gpd
-from shapely.geometry import Point, LineString
-
-def filter_model_data(model_data):
-    """Filter model data for non-zero fpxsec values and return sorted unique fpxsec IDs."""
-    fpxsec_grids = model_data[pd.notna(model_data['fpxsec'])]
-    fpxsec_ids = fpxsec_grids['fpxsec'].drop_duplicates().sort_values()
-    return fpxsec_ids
-
-def create_linestring_from_data(df, fpxsec_id):
-    """Create a LineString geometry from dataframe coordinates."""
-    points = [Point(float(row['x']), float(row['y'])) for _, row in df.iterrows()]
-    return LineString(points)
-
-def create_geodataframe(fpxsec_ids, model_data, fpxsec_results):
-    """Create a GeoDataFrame with LineStrings and corresponding attributes."""
-    rows = []
-    for fpxsec_id in fpxsec_ids:
-        df = model_data[model_data['fpxsec'] == fpxsec_id]
-        line = create_linestring_from_data(df, fpxsec_id)  # Pass fpxsec_id for debugging
-        result_row = fpxsec_results.loc[fpxsec_results['fpxs_id'] == fpxsec_id].iloc[0]
-        row = result_row.to_dict()
-        row['geometry'] = line
-        rows.append(row)
-
-    gdf = gpd.GeoDataFrame(rows, columns=fpxsec_results.columns.tolist() + ['geometry'])
+import shapely
+from modules.data_extraction import read_fpxsec_nodes
+from modules.grid_index import GridIndex
+
+def create_geodataframe(fpxsec_nodes, grid_index, fpxsec_results):
+    """
+    Create a GeoDataFrame with LineStrings and corresponding attributes.
+    Lines are built in one vectorized pass over the FPXSEC.DAT nodes, keeping their node order.
+    """
+    nodes = fpxsec_nodes.sort_values(['fpxsec', 'node_order'], kind='stable')
+    x, y = grid_index.xy(nodes['grid_id'].to_numpy())
+    located = ~np.isnan(x)
+    section_ids = nodes['fpxsec'].to_numpy()[located]
+    x, y = x[located], y[located]
+
+    # A line needs at least two located nodes
+    fpxs_ids, node_counts = np.unique(section_ids, return_counts=True)
+    keep = np.isin(section_ids, fpxs_ids[node_counts >= 2])
+    fpxs_ids = fpxs_ids[node_counts >= 2]
+    line_index = np.searchsorted(fpxs_ids, section_ids[keep])
+    lines = shapely.linestrings(np.column_stack([x[keep], y[keep]]), indices=line_index)
+
+    lines_df = pd.DataFrame({'fpxs_id': fpxs_ids, 'geometry': lines})
+    rows = fpxsec_results.merge(lines_df, on='fpxs_id', how='inner')
+    gdf = gpd.GeoDataFrame(rows, columns=fpxsec_results.columns.tolist() + ['geometry'], geometry='geometry')
     return gdf
 
 
@@ -33,7 +34,7 @@ def save_geodataframe_to_shapefile(gdf, f_path, coord_system):
     """Save the GeoDataFrame to a shapefile."""
     shapefile_path = os.path.join(f_path, 'FLO2D_SHP', 'fpxsec.shp')
     os.makedirs(os.path.join(f_path, 'FLO2D_SHP'), exist_ok=True)
-    gdf.to_file(shapefile_path, crs=f"EPSG:{coord_system}")
+    gdf.to_file(shapefile_path)
     return shapefile_path
 
 def get_shapefile_associated_paths(shp_path):
@@ -46,10 +47,12 @@ def get_shapefile_associated_paths(shp_path):
     return associated_files
 
 
-def create_fpxsec_shapefile(f_path, coord_system, model_data, fpxsec_results):
-    """Main function to create a shapefile from model data and fpxsec results."""
-    fpxsec_ids = filter_model_data(model_data)
-    gdf = create_geodataframe(fpxsec_ids, model_data, fpxsec_results)
+def create_fpxsec_shapefile(f_path, coord_system, model_data, fpxsec_results, grid_index=None):
+    """Main function to create a shapefile from FPXSEC.DAT nodes and fpxsec results."""
+    if grid_index is None:
+        grid_index = GridIndex.from_dataframe(model_data)
+    fpxsec_nodes = read_fpxsec_nodes(f_path)
+    gdf = create_geodataframe(fpxsec_nodes, grid_index, fpxsec_results)
 
     gdf.crs = f"EPSG:{coord_system}"
     shp_path = save_geodataframe_to_shapefile(gdf, f_path, coord_system)
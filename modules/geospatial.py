@@ -1,20 +1,45 @@
 # geospatial.py
 
 import geopandas as gpd
-from shapely.geometry import Point
+import numpy as np
+import shapely
+from modules.grid_index import grid_cell_size
 from modules.utilities import time_function
 
 @time_function
-def convertToGeoDataFrame(df):
-    geometry = [Point(xy) for xy in zip(df.x, df.y)]
-    geo_df = gpd.GeoDataFrame(df, geometry=geometry)
+def convertToGeoDataFrame(df, crs=None):
+    """
+    Builds a point GeoDataFrame of the model cells. Only needed for vector exports: rasterization and cell
+    size detection work straight from the x/y columns of the model DataFrame.
+    """
+    geometry = gpd.points_from_xy(df.x, df.y)
+    geo_df = gpd.GeoDataFrame(df, geometry=geometry, crs=crs)
     return geo_df
 
+def cell_polygons(x_coords, y_coords, cell_size):
+    """
+    Builds the square cell polygons around cell centers in one vectorized call.
+    :return: Array of shapely Polygons.
+    """
+    half = cell_size / 2
+    x_coords = np.asarray(x_coords, dtype=np.float64)
+    y_coords = np.asarray(y_coords, dtype=np.float64)
+    return shapely.box(x_coords - half, y_coords - half, x_coords + half, y_coords + half)
+
+@time_function
+def convertToCellGeoDataFrame(df, cell_size=None, crs=None):
+    """
+    Builds a GeoDataFrame of the model cells as square polygons.
+    :param cell_size: Grid cell size. Detected from the x/y columns when omitted.
+    """
+    if cell_size is None:
+        cell_size = grid_cell_size(df['x'].to_numpy(), df['y'].to_numpy())
+    geometry = cell_polygons(df['x'].to_numpy(), df['y'].to_numpy(), cell_size)
+    return gpd.GeoDataFrame(df, geometry=geometry, crs=crs)
+
 @time_function
-def calculate_cell_size(geo_df):
-    if len(geo_df) < 2:
-        raise ValueError("The GeoDataFrame should contain at least two points.")
-    point1 = geo_df.geometry.iloc[0]
-    point2 = geo_df.geometry.iloc[1]
-    cell_size = point1.distance(point2)
+def calculate_cell_size(df):
+    if len(df) < 2:
+        raise ValueError("The DataFrame should contain at least two cells.")
+    cell_size = grid_cell_size(df['x'].to_numpy(), df['y'].to_numpy())
     return cell_size
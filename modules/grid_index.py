@@ -0,0 +1,192 @@
+# grid_index.py
+
+import os
+import numpy as np
+from modules.data_extraction import DEPTH_SPEC, read_grid_file
+from modules.model_cache import ModelCache, file_digest
+from modules.rasterization import build_raster_grid
+from modules.utilities import add_metrics, atomic_write, time_function
+
+# Bump when the cached index layout changes
+GRID_INDEX_VERSION = 1
+
+# (row, col) offsets of the 8 neighbors in FLO-2D flow direction order: N, E, S, W, NE, SE, SW, NW
+NEIGHBOR_OFFSETS = ((-1, 0), (0, 1), (1, 0), (0, -1), (-1, 1), (1, 1), (1, -1), (-1, -1))
+
+
+def grid_cell_size(x_coords, y_coords):
+    """
+    Returns the smallest spacing between distinct cell center coordinates. Unlike the distance between the first
+    two cells, this does not depend on how the grid is numbered.
+    """
+    spacings = []
+    for coords in (np.asarray(x_coords, dtype=np.float64), np.asarray(y_coords, dtype=np.float64)):
+        diffs = np.diff(np.unique(coords))
+        # Ignore differences caused by rounding in the output files
+        diffs = diffs[diffs > 1e-6 * max(1.0, np.abs(coords).max())]
+        if len(diffs):
+            spacings.append(diffs.min())
+    if not spacings:
+        raise ValueError("The grid should contain at least two distinct cell centers.")
+    return float(min(spacings))
+
+
+class GridIndex:
+    """
+    Geometry of a FLO-2D grid: grid_id to position, x/y and raster row/col lookups, 8-neighbor positions,
+    cell size and extent. Built once per model and shared by the extractors and exporters.
+    """
+
+    def __init__(self, grid_ids, x_coords, y_coords, cell_size=None):
+        self.grid_ids = np.asarray(grid_ids, dtype=np.int64)
+        self.x = np.asarray(x_coords, dtype=np.float64)
+        self.y = np.asarray(y_coords, dtype=np.float64)
+        self.cell_size = float(cell_size) if cell_size else grid_cell_size(self.x, self.y)
+        self.raster_grid = build_raster_grid(self.x, self.y, self.cell_size)
+
+        # Dense grid_id -> position table for O(1) lookups
+        self._positions = np.full(int(self.grid_ids.max()) + 1 if len(self.grid_ids) else 1, -1, dtype=np.int64)
+        self._positions[self.grid_ids] = np.arange(len(self.grid_ids))
+        self._neighbors = None
+
+    @classmethod
+    def from_dataframe(cls, df):
+        return cls(df['grid_id'].to_numpy(), df['x'].to_numpy(), df['y'].to_numpy())
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        return cls(arrays['grid_id'], arrays['x'], arrays['y'], float(arrays['cell_size']))
+
+    def to_arrays(self):
+        return {'grid_id': self.grid_ids, 'x': self.x, 'y': self.y, 'cell_size': np.float64(self.cell_size)}
+
+    def __len__(self):
+        return len(self.grid_ids)
+
+    @property
+    def rows(self):
+        return self.raster_grid.rows
+
+    @property
+    def cols(self):
+        return self.raster_grid.cols
+
+    @property
+    def extent(self):
+        """
+        Cell-edge extent as (xmin, ymin, xmax, ymax).
+        """
+        half = self.cell_size / 2
+        return (float(self.x.min() - half), float(self.y.min() - half),
+                float(self.x.max() + half), float(self.y.max() + half))
+
+    def positions(self, grid_ids):
+        """
+        Returns the row positions of grid_ids in the model table, -1 for unknown ids.
+        """
+        grid_ids = np.asarray(grid_ids, dtype=np.int64)
+        positions = np.full(grid_ids.shape, -1, dtype=np.int64)
+        valid = (grid_ids >= 0) & (grid_ids < len(self._positions))
+        positions[valid] = self._positions[grid_ids[valid]]
+        return positions
+
+    def xy(self, grid_ids):
+        """
+        Returns (x, y) arrays for grid_ids, NaN for unknown ids.
+        """
+        positions = self.positions(grid_ids)
+        found = positions >= 0
+        return np.where(found, self.x[positions], np.nan), np.where(found, self.y[positions], np.nan)
+
+    def rowcol(self, grid_ids):
+        """
+        Returns raster (row, col) arrays for grid_ids, -1 for unknown ids.
+        """
+        positions = self.positions(grid_ids)
+        found = positions >= 0
+        return np.where(found, self.rows[positions], -1), np.where(found, self.cols[positions], -1)
+
+    @property
+    def neighbors(self):
+        """
+        (n, 8) array of neighbor positions in NEIGHBOR_OFFSETS order, -1 where there is no cell.
+        """
+        if self._neighbors is None:
+            ncols = self.raster_grid.ncols
+            keys = self.rows * ncols + self.cols
+            order = np.argsort(keys, kind='stable')
+            sorted_keys = keys[order]
+
+            neighbors = np.full((len(self), len(NEIGHBOR_OFFSETS)), -1, dtype=np.int64)
+            for k, (d_row, d_col) in enumerate(NEIGHBOR_OFFSETS):
+                rows = self.rows + d_row
+                cols = self.cols + d_col
+                inside = (rows >= 0) & (rows < self.raster_grid.nrows) & (cols >= 0) & (cols < ncols)
+                idx = np.searchsorted(sorted_keys, rows * ncols + cols)
+                idx[idx == len(sorted_keys)] = 0
+                found = inside & (sorted_keys[idx] == rows * ncols + cols)
+                neighbors[found, k] = order[idx[found]]
+            self._neighbors = neighbors
+        return self._neighbors
+
+    def neighbor_ids(self):
+        """
+        (n, 8) array of neighbor grid_ids, 0 where there is no cell.
+        """
+        neighbors = self.neighbors
+        return np.where(neighbors >= 0, self.grid_ids[neighbors], 0)
+
+
+def build_grid_index(file_path, use_cache=True):
+    """
+    Builds the grid index from DEPTH.OUT through the project's model cache.
+    """
+    cache = ModelCache(file_path) if use_cache else None
+
+    def parse():
+        depth = read_grid_file(file_path, DEPTH_SPEC, cache)
+        return GridIndex(depth['grid_id'], depth['x'], depth['y']).to_arrays()
+
+    if cache is None:
+        return GridIndex.from_arrays(parse())
+    arrays = cache.load(DEPTH_SPEC[0], ['grid_index', GRID_INDEX_VERSION], parse, name='GRID_INDEX')
+    cache.save()
+    return GridIndex.from_arrays(arrays)
+
+
+def shared_grid_index_path(file_path, shared_cache):
+    """
+    Returns the shared cache file of the project's grid index, named after the TOPO.DAT content hash so projects
+    on an identical grid share it. None when the project has no TOPO.DAT.
+    """
+    topo_file = os.path.join(file_path, 'TOPO.DAT')
+    if not os.path.exists(topo_file):
+        return None
+    return os.path.join(shared_cache, f'GRID_INDEX_v{GRID_INDEX_VERSION}_{file_digest(topo_file)}.npz')
+
+
+@time_function
+def load_grid_index(file_path, use_cache=True, shared_cache=None):
+    """
+    Builds the grid index from DEPTH.OUT, storing it with the model cache so later runs load it directly.
+    :param file_path: Path to the directory containing the model data files.
+    :param use_cache: Reuse the index cached in the project's flo2d_cache folder when DEPTH.OUT is unchanged.
+    :param shared_cache: Folder shared by several projects. The index and cell size the raster grid is derived from
+        are stored there once per TOPO.DAT content and reused by every project with an identical TOPO.DAT.
+    :return: GridIndex of the model.
+    """
+    shared_file = shared_grid_index_path(file_path, shared_cache) if shared_cache else None
+    if shared_file and os.path.exists(shared_file):
+        with np.load(shared_file) as arrays:
+            grid_index = GridIndex.from_arrays({name: arrays[name] for name in arrays.files})
+        add_metrics(rows=len(grid_index))
+        return grid_index
+
+    grid_index = build_grid_index(file_path, use_cache)
+    if shared_file:
+        os.makedirs(shared_cache, exist_ok=True)
+        with atomic_write(shared_file) as file:
+            np.savez(file, **grid_index.to_arrays())
+    add_metrics(rows=len(grid_index))
+    return grid_index
+
@@ -0,0 +1,96 @@
+# hycross_parser.py
+
+import os
+import re
+from array import array
+from collections import namedtuple
+import numpy as np
+from modules.utilities import add_metrics, time_function
+
+# Field positions in the HYCROSS.OUT hydrograph tables
+TIME_FIELD = 0
+WSE_FIELD = 3
+DISCHARGE_FIELD = 5
+
+SECTION_PATTERN = re.compile(r'FOR CROSS SECTION NO:\s*(\d+)')
+Q_MAX_PATTERN = re.compile(r'MAXIMUM DISCHARGE FROM CROSS SECTION\s*(\d+)\s+IS:\s*([\d.]+)\s*CFS\s+AT TIME:\s*([\d.]+)')
+VOL_PATTERN = re.compile(r'VOLUME OF DISCHARGE IS:\s*([\d.]+)\s*AF')
+
+# Hydrograph table of one cross section
+CrossSection = namedtuple('CrossSection', ['section', 'time', 'discharge', 'wse'])
+# Summary lines of one cross section, in the order they appear in the file
+SectionSummary = namedtuple('SectionSummary', ['q_max', 'time_max', 'volume'])
+# Fully parsed HYCROSS.OUT: list of CrossSection and dict of section number to SectionSummary
+HycrossData = namedtuple('HycrossData', ['sections', 'summary'])
+
+
+def iter_hycross(file_path, summary=None):
+    """
+    Streams HYCROSS.OUT line by line in a single pass and yields one CrossSection of NumPy arrays as each
+    hydrograph table ends. Only the table being read is held in memory.
+    :param file_path: Path to HYCROSS.OUT.
+    :param summary: Optional dict filled with section number -> SectionSummary as the summary lines are read.
+        It is complete once the generator is exhausted.
+    """
+    if summary is None:
+        summary = {}
+    min_fields = max(TIME_FIELD, WSE_FIELD, DISCHARGE_FIELD) + 1
+    current_section = None
+    last_max_section = None
+    time, discharge, wse = array('d'), array('d'), array('d')
+
+    def close_section():
+        return CrossSection(current_section, np.frombuffer(time, dtype=np.float64).copy(),
+                            np.frombuffer(discharge, dtype=np.float64).copy(),
+                            np.frombuffer(wse, dtype=np.float64).copy())
+
+    with open(file_path, 'r') as file:
+        for line in file:
+            if 'CROSS SECTION' in line:
+                match = Q_MAX_PATTERN.search(line)
+                if match:
+                    last_max_section = int(match.group(1))
+                    summary[last_max_section] = SectionSummary(float(match.group(2)), float(match.group(3)), None)
+                    continue
+
+                match = SECTION_PATTERN.search(line)
+                if match and 'HYDROGRAPH AND FLOODPLAIN HYDRAULICS' in line:
+                    if current_section is not None:
+                        yield close_section()
+                        time, discharge, wse = array('d'), array('d'), array('d')
+                    current_section = int(match.group(1))
+                    continue
+
+            if 'VOLUME OF DISCHARGE' in line:
+                match = VOL_PATTERN.search(line)
+                if match and last_max_section is not None:
+                    summary[last_max_section] = summary[last_max_section]._replace(volume=float(match.group(1)))
+                continue
+
+            # Hydrograph rows: skip headers and anything else that is not numeric
+            if current_section is None:
+                continue
+            parts = line.split()
+            if len(parts) < min_fields:
+                continue
+            try:
+                row = float(parts[TIME_FIELD]), float(parts[DISCHARGE_FIELD]), float(parts[WSE_FIELD])
+            except ValueError:
+                continue
+            time.append(row[0])
+            discharge.append(row[1])
+            wse.append(row[2])
+
+    if current_section is not None:
+        yield close_section()
+
+
+@time_function
+def read_hycross(file_path):
+    """
+    Parses HYCROSS.OUT once into a HycrossData shared by the results extraction and the spreadsheet export.
+    """
+    summary = {}
+    sections = list(iter_hycross(file_path, summary))
+    add_metrics(rows=sum(len(section.time) for section in sections), nbytes=os.path.getsize(file_path))
+    return HycrossData(sections, summary)
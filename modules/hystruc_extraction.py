@@ -1,70 +1,52 @@
 import os
 import pandas as pd
+from modules.hystruc_parser import load_structure_series, structure_statistics
+from modules.utilities import add_metrics, time_function
 
-def extract_hystruc_results(file_path):
+# Fields of the HYSTRUC.DAT structure ('S') and culvert equation ('F') lines
+STRUCTURE_FIELDS = [('Structure Name', str), ('IFPROCHAN', int), ('ICURVETABLE', int), ('Inflow Node', int),
+                    ('Outflow Node', int), ('INOUTCONT', int), ('HEADREFEL', float), ('CLENGTH', float),
+                    ('CDIAMETER', float)]
+CULVERT_FIELDS = [('TYPEC', int), ('TYPEEN', int), ('CULVERTN', float), ('KE', float), ('CUBASE', float)]
 
-    hystruc_file_path = os.path.join(file_path, 'HYSTRUC.DAT')
-    hydrostruct_file_path = os.path.join(file_path, 'HYDROSTRUCT.OUT')
-
-    # Extract data from HYSTRUC.DAT file
-    with open(hystruc_file_path, 'r') as file:
-        lines = file.readlines()
 
+@time_function
+def read_hystruc_dat(hystruc_file_path):
+    """
+    Reads the structure and culvert equation lines of HYSTRUC.DAT into a DataFrame, one row per structure.
+    """
     structures = {}
+    culverts = {}
+    structure_name = None
 
-    for line in lines:
-        line = line.strip().split()
-
-        if line[0] == 'S':
-            structure_name = line[1]
-            if structure_name not in structures:
-                structures[structure_name] = {
-                    'Structure Name': structure_name,
-                    'IFPROCHAN': int(line[2]),
-                    'ICURVETABLE': int(line[3]),
-                    'Inflow Node': int(line[4]),
-                    'Outflow Node': int(line[5]),
-                    'INOUTCONT': int(line[6]),
-                    'HEADREFEL': float(line[7]),
-                    'CLENGTH': float(line[8]),
-                    'CDIAMETER': float(line[9]),
-                    'TYPEC': None,
-                    'TYPEEN': None,
-                    'CULVERTN': None,
-                    'KE': None,
-                    'CUBASE': None
-                }
-
-        elif line[0] == 'F' and structure_name in structures:
-            structures[structure_name].update({
-                'TYPEC': int(line[1]),
-                'TYPEEN': int(line[2]),
-                'CULVERTN': float(line[3]),
-                'KE': float(line[4]),
-                'CUBASE': float(line[5])
-            })
-
-    # Extract peak discharge and time of peak discharge from HYDROSTRUCT.OUT file
-    with open(hydrostruct_file_path, 'r') as file:
+    with open(hystruc_file_path, 'r') as file:
         for line in file:
-            if 'THE MAXIMUM DISCHARGE FOR:' in line:
-                parts = line.split()
-                # Assuming structure name is always the fifth element after this specific phrase
-                structure_index = parts.index('FOR:') + 1
-                structure_name = parts[structure_index]
-                # Find index for "IS:" to get the peak discharge and time of peak as next elements
-                is_index = parts.index('IS:')
-                peak_discharge = float(parts[is_index + 1])
-                at_time_index = parts.index('AT', is_index)  # Finding 'AT' after 'IS:'
-                time_of_peak = float(parts[at_time_index + 2])
-                
-                # If the structure name is in the structures dictionary, update it
-                if structure_name in structures:
-                    structures[structure_name].update({
-                        'Qpeak_cfs': peak_discharge,
-                        'Tpeak_hrs': time_of_peak
-                    })
+            parts = line.split()
+            if not parts:
+                continue
+
+            if parts[0] == 'S':
+                structure_name = parts[1]
+                if structure_name not in structures:
+                    structures[structure_name] = [cast(value) for (_, cast), value in zip(STRUCTURE_FIELDS, parts[1:])]
+            elif parts[0] == 'F' and structure_name in structures:
+                culverts[structure_name] = [cast(value) for (_, cast), value in zip(CULVERT_FIELDS, parts[1:])]
+
+    df = pd.DataFrame(list(structures.values()), columns=[name for name, _ in STRUCTURE_FIELDS])
+    culvert_df = pd.DataFrame.from_dict(culverts, orient='index', columns=[name for name, _ in CULVERT_FIELDS])
+    add_metrics(rows=len(df), nbytes=os.path.getsize(hystruc_file_path))
+    return df.join(culvert_df, on='Structure Name')
+
+
+def extract_hystruc_results(file_path, use_cache=True):
+    """
+    Combines the HYSTRUC.DAT structure definitions with peak discharge, time of peak, discharge volume and
+    peak headwater computed from the HYDROSTRUCT.OUT time series.
+    :param file_path: Path to the directory containing HYSTRUC.DAT and HYDROSTRUCT.OUT.
+    :param use_cache: Reuse the structure series stored in the project's flo2d_cache folder when unchanged.
+    """
+    hystruc_file_path = os.path.join(file_path, 'HYSTRUC.DAT')
 
-    # Convert the structures dictionary to a DataFrame
-    df = pd.DataFrame(list(structures.values()))
-    return df
\ No newline at end of file
+    df = read_hystruc_dat(hystruc_file_path)
+    stats = structure_statistics(load_structure_series(file_path, use_cache))
+    return df.merge(stats, on='Structure Name', how='left')
@@ -0,0 +1,155 @@
+# hystruc_parser.py
+
+import os
+import re
+import warnings
+from array import array
+import numpy as np
+import pandas as pd
+from modules.model_cache import ModelCache
+from modules.utilities import add_metrics, time_function
+
+# Field positions in the HYDROSTRUCT.OUT structure hydrograph tables
+TIME_FIELD = 0
+HEADWATER_FIELD = 1
+TAILWATER_FIELD = 2
+DISCHARGE_FIELD = 3
+
+# Heading of each structure hydrograph table, e.g. 'HYDRAULIC STRUCTURE NO.:    1    NAME: CULVERT1'
+STRUCTURE_PATTERN = re.compile(r'\bSTRUCTURE\b.*?\bNAME\s*[:=]\s*(\S+)', re.IGNORECASE)
+SERIES_FIELDS = ('time', 'headwater', 'tailwater', 'discharge')
+# Bump when the layout of the cached series changes
+SERIES_VERSION = 2
+# cfs * hours to acre-feet
+CFS_HOURS_TO_ACFT = 3600.0 / 43560.0
+
+
+@time_function
+def parse_hydrostruct(file_path):
+    """
+    Streams HYDROSTRUCT.OUT line by line in a single pass into a columnar store: one array per series field with
+    every structure's rows back to back, an offsets index delimiting each structure, and the reported maximum
+    discharge lines. Hydrograph rows are the all-numeric lines of a table, which runs from its heading to the first
+    other text line after its rows. Warns when the file reports maximum discharges but no table was recognized.
+    :param file_path: Path to HYDROSTRUCT.OUT.
+    :return: Dict of NumPy arrays. Rows of structure i are offsets[i]:offsets[i + 1] in each series field.
+    """
+    min_fields = max(TIME_FIELD, HEADWATER_FIELD, TAILWATER_FIELD, DISCHARGE_FIELD) + 1
+    series = {field: array('d') for field in SERIES_FIELDS}
+    names = []
+    offsets = array('q', [0])
+    max_names, max_discharge, max_time = [], array('d'), array('d')
+    # Inside a table, and whether its rows have started
+    in_table = in_rows = False
+
+    with open(file_path, 'r') as file:
+        for line in file:
+            if 'THE MAXIMUM DISCHARGE FOR:' in line:
+                in_table = False
+                parts = line.split()
+                is_index = parts.index('IS:')
+                max_names.append(parts[parts.index('FOR:') + 1])
+                max_discharge.append(float(parts[is_index + 1]))
+                max_time.append(float(parts[parts.index('AT', is_index) + 2]))
+                continue
+
+            match = STRUCTURE_PATTERN.search(line)
+            if match:
+                if names:
+                    offsets.append(len(series['time']))
+                names.append(match.group(1))
+                in_table, in_rows = True, False
+                continue
+
+            parts = line.split()
+            if not in_table or not parts:
+                continue
+            try:
+                values = [float(part) for part in parts]
+            except ValueError:
+                values = None
+            if values is None or len(values) < min_fields:
+                # Headings and units before the rows, the end of the table after them
+                in_table = not in_rows
+                continue
+            in_rows = True
+            row = (values[TIME_FIELD], values[HEADWATER_FIELD], values[TAILWATER_FIELD], values[DISCHARGE_FIELD])
+            for field, value in zip(SERIES_FIELDS, row):
+                series[field].append(value)
+
+    if names:
+        offsets.append(len(series['time']))
+    if max_names and not len(series['time']):
+        warnings.warn(f"{file_path} reports maximum discharges but no structure hydrograph table was recognized, so "
+                      f"Vol_acft and HWpeak are left empty", stacklevel=2)
+    store = {field: np.frombuffer(values, dtype=np.float64).copy() for field, values in series.items()}
+    store['names'] = np.array(names, dtype=str)
+    store['offsets'] = np.frombuffer(offsets, dtype=np.int64).copy()
+    store['max_names'] = np.array(max_names, dtype=str)
+    store['max_discharge'] = np.frombuffer(max_discharge, dtype=np.float64).copy()
+    store['max_time'] = np.frombuffer(max_time, dtype=np.float64).copy()
+    add_metrics(rows=len(store['time']), nbytes=os.path.getsize(file_path))
+    return store
+
+
+def load_structure_series(file_path, use_cache=True):
+    """
+    Returns the HYDROSTRUCT.OUT columnar store, kept in the project's model cache so it is only parsed when the
+    file changes.
+    :param file_path: Path to the directory containing HYDROSTRUCT.OUT.
+    """
+    def parse():
+        return parse_hydrostruct(os.path.join(file_path, 'HYDROSTRUCT.OUT'))
+
+    if not use_cache:
+        return parse()
+    cache = ModelCache(file_path)
+    store = cache.load('HYDROSTRUCT.OUT', ['structure_series', SERIES_VERSION], parse, name='HYDROSTRUCT_SERIES')
+    cache.save()
+    return store
+
+
+def structure_statistics(store):
+    """
+    Computes the peak discharge, time of peak, discharge volume and peak headwater of every structure with
+    vectorized segment reductions over the columnar store. Structures without a series fall back to the
+    maximum discharge reported in the file.
+    :return: DataFrame with Structure Name, Qpeak_cfs, Tpeak_hrs, Vol_acft and HWpeak columns.
+    """
+    names = store['names']
+    offsets = store['offsets']
+    counts = np.diff(offsets)
+    stats = pd.DataFrame({'Structure Name': names, 'Qpeak_cfs': np.nan, 'Tpeak_hrs': np.nan,
+                          'Vol_acft': np.nan, 'HWpeak': np.nan})
+
+    has_rows = counts > 0
+    if has_rows.any():
+        time, discharge, headwater = store['time'], store['discharge'], store['headwater']
+        starts = offsets[:-1][has_rows]
+        segment = np.repeat(np.arange(len(starts)), counts[has_rows])
+
+        q_peak = np.maximum.reduceat(discharge, starts)
+        # First row of each segment reaching its peak
+        peak_rows = np.where(discharge == q_peak[segment], np.arange(len(discharge)), len(discharge))
+        t_peak = time[np.minimum.reduceat(peak_rows, starts)]
+
+        # Trapezoidal volume, excluding the steps that cross from one structure to the next
+        same = segment[1:] == segment[:-1]
+        step_volume = np.diff(time) * (discharge[1:] + discharge[:-1]) / 2
+        volume = np.bincount(segment[1:][same], weights=step_volume[same], minlength=len(starts)) * CFS_HOURS_TO_ACFT
+
+        stats.loc[has_rows, 'Qpeak_cfs'] = q_peak
+        stats.loc[has_rows, 'Tpeak_hrs'] = t_peak
+        stats.loc[has_rows, 'Vol_acft'] = volume
+        stats.loc[has_rows, 'HWpeak'] = np.maximum.reduceat(headwater, starts)
+
+    stats = stats[has_rows]
+
+    # Reported maxima for structures listed without a hydrograph table
+    reported = pd.DataFrame({'Structure Name': store['max_names'], 'Qpeak_cfs': store['max_discharge'],
+                             'Tpeak_hrs': store['max_time']}).drop_duplicates('Structure Name', keep='last')
+    reported = reported[~reported['Structure Name'].isin(stats['Structure Name'])]
+    frames = [frame for frame in (stats, reported) if len(frame)]
+    if not frames:
+        return stats.reset_index(drop=True)
+    return pd.concat(frames, ignore_index=True).reindex(columns=stats.columns)
@@ -0,0 +1,152 @@
+# model_cache.py
+
+import hashlib
+import json
+import os
+import threading
+import numpy as np
+from modules.utilities import atomic_write
+
+CACHE_FOLDER = 'flo2d_cache'
+MANIFEST_NAME = 'manifest.json'
+# Bump whenever the layout of the cached arrays changes so caches written by older versions are discarded
+CACHE_VERSION = 1
+HASH_CHUNK_SIZE = 1 << 20
+# Serializes manifest writes of caches sharing a project folder in this process
+_MANIFEST_LOCK = threading.Lock()
+
+
+def file_digest(path):
+    """
+    Returns a BLAKE2 content hash of the file.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_fingerprint(path, with_hash=True):
+    """
+    Returns the size, modification time and (optionally) content hash of a file.
+    """
+    stat = os.stat(path)
+    fingerprint = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    if with_hash:
+        fingerprint['hash'] = file_digest(path)
+    return fingerprint
+
+
+class ModelCache:
+    """
+    On-disk cache of parsed FLO-2D source files stored as .npz arrays next to the project.
+
+    Entries are keyed on the source file name and validated against its size and mtime. When those differ the
+    content hash is compared before re-parsing, so touched-but-unchanged files are not parsed again.
+    """
+
+    def __init__(self, file_path, cache_path=None):
+        self.file_path = file_path
+        self.cache_path = cache_path or os.path.join(file_path, CACHE_FOLDER)
+        self._lock = threading.Lock()
+        self._entries = self._load_manifest()
+        # Entries refreshed by this instance, merged into the manifest on save
+        self._updated = set()
+
+    def _manifest_path(self):
+        return os.path.join(self.cache_path, MANIFEST_NAME)
+
+    def _read_manifest(self):
+        try:
+            with open(self._manifest_path(), 'r') as file:
+                manifest = json.load(file)
+        except (OSError, ValueError):
+            return None
+        return manifest if manifest.get('version') == CACHE_VERSION else None
+
+    def _load_manifest(self):
+        manifest = self._read_manifest()
+        if manifest is None:
+            # Only a stale manifest invalidates the folder: without one, arrays may be mid-write by another cache
+            if os.path.exists(self._manifest_path()):
+                self.clear()
+            return {}
+        return manifest.get('files', {})
+
+    def clear(self):
+        """
+        Removes every cached array and the manifest.
+        """
+        if not os.path.isdir(self.cache_path):
+            return
+        for name in os.listdir(self.cache_path):
+            if name == MANIFEST_NAME or name.endswith('.npz'):
+                os.remove(os.path.join(self.cache_path, name))
+
+    def _is_current(self, name, entry, source, key):
+        if entry is None or entry.get('key') != key:
+            return False
+        if not os.path.exists(os.path.join(self.cache_path, entry['data'])):
+            return False
+        fingerprint = file_fingerprint(source, with_hash=False)
+        if fingerprint['size'] != entry['size']:
+            return False
+        if fingerprint['mtime_ns'] != entry['mtime_ns']:
+            # Touched but possibly unchanged, fall back to the content hash
+            if file_digest(source) != entry['hash']:
+                return False
+            with self._lock:
+                entry['mtime_ns'] = fingerprint['mtime_ns']
+                self._updated.add(name)
+        return True
+
+    def load(self, file_name, key, parse, name=None):
+        """
+        Returns the cached arrays for a source file, calling parse() and storing its result when the cache is stale.
+        :param file_name: Name of the source file inside the project directory.
+        :param key: JSON-serializable description of how the file is parsed. A different key invalidates the entry.
+        :param parse: Callable returning a dict of NumPy arrays.
+        :param name: Entry name, for products derived from the source file. Defaults to file_name.
+        :return: Dict of NumPy arrays.
+        """
+        source = os.path.join(self.file_path, file_name)
+        key = json.loads(json.dumps(key))
+        name = name or file_name
+        with self._lock:
+            entry = self._entries.get(name)
+        if self._is_current(name, entry, source, key):
+            with np.load(os.path.join(self.cache_path, entry['data'])) as arrays:
+                return {name: arrays[name] for name in arrays.files}
+
+        fingerprint = file_fingerprint(source)
+        arrays = parse()
+        os.makedirs(self.cache_path, exist_ok=True)
+        data_name = f'{name}.npz'
+        with atomic_write(os.path.join(self.cache_path, data_name)) as file:
+            np.savez(file, **arrays)
+
+        with self._lock:
+            self._entries[name] = dict(fingerprint, source=file_name, key=key, data=data_name)
+            self._updated.add(name)
+        return arrays
+
+    def save(self):
+        """
+        Writes the manifest describing the cached entries. Entries written meanwhile by other caches on the same
+        folder are kept, so stages sharing a project can save independently. Nothing is written when no entry was
+        refreshed since the last save.
+        """
+        with self._lock:
+            if not self._updated:
+                return
+        os.makedirs(self.cache_path, exist_ok=True)
+        with _MANIFEST_LOCK, self._lock:
+            manifest = self._read_manifest()
+            entries = manifest.get('files', {}) if manifest else {}
+            entries.update({name: self._entries[name] for name in self._updated})
+            self._entries.update(entries)
+            manifest = {'version': CACHE_VERSION, 'files': entries}
+            with atomic_write(self._manifest_path(), 'w') as file:
+                json.dump(manifest, file, indent=2)
+            self._updated.clear()
@@ -0,0 +1,139 @@
+# pipeline.py
+
+import time
+import traceback
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from contextvars import copy_context
+from modules.utilities import extend_profile_records, pop_profile_records, profile_span
+
+EXECUTORS = {'thread': ThreadPoolExecutor, 'process': ProcessPoolExecutor}
+
+# One unit of work: func(*args, **kwargs) plus the results of its dependencies passed as keyword arguments
+# named after the dependency stages
+Stage = namedtuple('Stage', ['name', 'func', 'args', 'kwargs', 'deps'])
+# Outcome of one stage. status is 'done', 'failed', 'cancelled' or 'skipped'
+StageReport = namedtuple('StageReport', ['name', 'status', 'seconds', 'error'])
+
+
+class PipelineError(Exception):
+    """
+    Raised when a stage fails. reports lists the outcome of every stage.
+    """
+
+    def __init__(self, reports):
+        self.reports = reports
+        failed = [report for report in reports if report.status == 'failed']
+        lines = [f"{len(failed)} pipeline stage(s) failed:"]
+        for report in failed:
+            lines.append(f"--- {report.name} ---\n{report.error.rstrip()}")
+        lines.append(format_summary(reports))
+        super().__init__('\n'.join(lines))
+
+
+def run_stage(name, func, args, kwargs, collect_profile=False):
+    """
+    Runs a stage in a profile span and returns (result, seconds, profile records). Module level so process pools
+    can pickle it. With collect_profile, the profile records of the worker process are returned to the caller.
+    """
+    start_time = time.perf_counter()
+    with profile_span(f'stage {name}'):
+        result = func(*args, **kwargs)
+    seconds = time.perf_counter() - start_time
+    return result, seconds, pop_profile_records() if collect_profile else None
+
+
+def format_summary(reports):
+    """
+    Formats stage reports as a table of name, status and elapsed seconds.
+    """
+    width = max([len(report.name) for report in reports] + [5])
+    lines = [f"{'Stage':<{width}}  {'Status':<9}  Seconds"]
+    for report in reports:
+        seconds = f"{report.seconds:.3f}" if report.seconds is not None else '-'
+        lines.append(f"{report.name:<{width}}  {report.status:<9}  {seconds}")
+    return '\n'.join(lines)
+
+
+class Pipeline:
+    """
+    Small dependency-graph scheduler. Stages whose dependencies have completed run concurrently in a thread or
+    process pool. The first failure stops new stages from starting, cancels queued ones and raises a
+    PipelineError summarizing every stage once the running ones finish.
+    """
+
+    def __init__(self, max_workers=None, executor='thread'):
+        if executor not in EXECUTORS:
+            raise ValueError(f"executor must be one of {tuple(EXECUTORS)}, got {executor!r}")
+        self.max_workers = max_workers
+        self.executor = executor
+        self.stages = {}
+        self.reports = []
+
+    def add(self, name, func, *args, deps=(), **kwargs):
+        """
+        Adds a stage. Dependencies must already be added, so the graph cannot contain cycles.
+        :param name: Unique stage name, also the keyword under which its result reaches dependent stages.
+        :param func: Callable run for the stage. With the process executor it must be a module-level function.
+        :param deps: Names of the stages whose results func receives as keyword arguments.
+        """
+        if name in self.stages:
+            raise ValueError(f"Duplicate pipeline stage {name!r}")
+        missing = [dep for dep in deps if dep not in self.stages]
+        if missing:
+            raise ValueError(f"Stage {name!r} depends on unknown stage(s) {missing}")
+        self.stages[name] = Stage(name, func, args, kwargs, tuple(deps))
+        return name
+
+    def run(self):
+        """
+        Runs every stage and returns a dict of stage name to result.
+        """
+        results, reports, running = {}, {}, {}
+        failed = False
+
+        def submit_ready(executor):
+            for stage in self.stages.values():
+                if stage.name in reports or stage.name in running.values():
+                    continue
+                if all(dep in results for dep in stage.deps):
+                    kwargs = dict(stage.kwargs, **{dep: results[dep] for dep in stage.deps})
+                    if self.executor == 'process':
+                        future = executor.submit(run_stage, stage.name, stage.func, stage.args, kwargs, True)
+                    else:
+                        # Run in a copy of this context so the stage's profile span nests under the pipeline's
+                        future = executor.submit(copy_context().run, run_stage, stage.name, stage.func, stage.args,
+                                                 kwargs)
+                    running[future] = stage.name
+
+        with profile_span('pipeline'), EXECUTORS[self.executor](max_workers=self.max_workers) as executor:
+            submit_ready(executor)
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    if future.cancelled():
+                        reports[name] = StageReport(name, 'cancelled', None, None)
+                        continue
+                    try:
+                        results[name], seconds, profile_records = future.result()
+                        if profile_records:
+                            extend_profile_records(profile_records)
+                        reports[name] = StageReport(name, 'done', seconds, None)
+                    except Exception as error:
+                        failed = True
+                        error_text = ''.join(traceback.format_exception(type(error), error, error.__traceback__))
+                        reports[name] = StageReport(name, 'failed', None, error_text)
+
+                if failed:
+                    for future in list(running):
+                        if future.cancel():
+                            name = running.pop(future)
+                            reports[name] = StageReport(name, 'cancelled', None, None)
+                else:
+                    submit_ready(executor)
+
+        self.reports = [reports.get(name, StageReport(name, 'skipped', None, None)) for name in self.stages]
+        if failed:
+            raise PipelineError(self.reports)
+        return results
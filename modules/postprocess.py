@@ -0,0 +1,299 @@
+# postprocess.py
+
+import copy
+import os
+import sys
+import time
+from collections import namedtuple
+from modules.build_manifest import BuildPlan
+from modules.data_extraction import DEPTH_SPEC, grid_column_specs, load_model_data, unavailable_columns
+from modules.hycross_extraction import extract_fpxsec_results
+from modules.hycross_parser import read_hycross
+from modules.rasterization import TILED_RASTER_OPTIONS, build_raster_blocks, create_rasters_from_gdf
+from modules.fpxsec_vectorization import create_fpxsec_shapefile
+from modules.vectorization import VECTOR_FORMATS, export_model_points
+from modules.derived_products import create_derived_rasters, product_columns
+from modules.zonal_statistics import ZONAL_COLUMNS, write_zonal_statistics
+from modules.timdep import TIMDEP_INDEX_NAME, TIMDEP_RASTER_OPTIONS, write_timdep_rasters
+from modules.utilities import (create_required_folders, pop_profile_records, profile_span, profiling_enabled,
+                               write_profile_report)
+from modules.hystruc_vectorization import create_hystruc_shapefile
+from modules.hystruc_extraction import extract_hystruc_results
+from modules.grid_index import load_grid_index
+from modules.fpxsec_spreadsheet import hycross_spreadsheet
+from modules.pipeline import Pipeline, PipelineError, format_summary
+
+# Written in the project folder as .json and .csv when profiling is on
+PROFILE_REPORT_NAME = 'flo2d_profile'
+
+# Outcome of one project run: exit status, StageReport list, and the outputs built and found up to date
+ProjectResult = namedtuple('ProjectResult', ['status', 'reports', 'built', 'up_to_date'])
+
+# Products that can be selected on the command line. The full-grid point layer, the TIMDEP.OUT step rasters, the
+# derived rasters and the zonal statistics are only written on request
+OUTPUTS = ('fpxsec', 'spreadsheet', 'hystruc', 'rasters', 'points', 'timdep', 'derived', 'zonal')
+DEFAULT_OUTPUTS = ('fpxsec', 'spreadsheet', 'hystruc', 'rasters')
+
+# Model data columns written as rasters. The Green and Ampt ones are left out of the default selection of projects
+# whose INFIL.DAT uses another method
+RASTER_COLUMNS = ['depth_max', 'xksat', 'psif', 'dtheta',
+                  'abstrinf', 'rtimpf', 'soil_depth', 'velocity',
+                  'q_max', 'wse_max', 'infil_depth', 'infil_stop',
+                  'time_of_oneft', 'time_of_twoft', 'time_to_peak', 'mannings_n',
+                  'topo', 'final_velocity', 'final_depth',
+                  ]
+
+# Model data columns that can be written to the point layer, one point per grid cell
+POINT_COLUMNS = ['grid_id'] + RASTER_COLUMNS
+# Point layer formats, by the file extension they are written with
+POINT_FORMATS = tuple(extension.lstrip('.') for extension in VECTOR_FORMATS)
+
+
+# Stage functions are module level so the process executor can pickle them
+
+def write_fpxsec_shapefile(file_path, coord_system, hycross, grid_index):
+    # Save floodplain cross section results to shapefile
+    fpxsec_results = extract_fpxsec_results(file_path, hycross)
+    return create_fpxsec_shapefile(file_path, coord_system, None, fpxsec_results, grid_index)
+
+
+def write_hystruc_shapefile(file_path, coord_system, shp_outpath, use_cache, grid_index):
+    # Save hydraulic structure results to shapefile
+    hystruc_df = extract_hystruc_results(file_path, use_cache)
+    return create_hystruc_shapefile(hystruc_df, None, coord_system, shp_outpath, grid_index)
+
+
+def build_tiled_blocks(grid_index):
+    return build_raster_blocks(grid_index.raster_grid, TILED_RASTER_OPTIONS['blocksize'])
+
+
+def write_column_raster(column, raster_outpath, coord_system, model_data, grid_index, raster_blocks):
+    return create_rasters_from_gdf(model_data, [column], raster_outpath, grid_index.cell_size,
+                                   crs=f"EPSG:{coord_system}", tiled=True, grid=grid_index.raster_grid,
+                                   blocks=raster_blocks)[0]
+
+
+def write_derived_raster(product, raster_outpath, coord_system, model_data, grid_index, raster_blocks):
+    return create_derived_rasters(model_data, [product], raster_outpath, grid_index.raster_grid,
+                                  blocks=raster_blocks, crs=f"EPSG:{coord_system}")[0]
+
+
+def write_zone_statistics(zones_path, output_path, columns, method, coord_system, model_data, grid_index):
+    return write_zonal_statistics(model_data, zones_path, output_path, grid_index, columns, method,
+                                  crs=f"EPSG:{coord_system}")
+
+
+def write_timdep_stack(file_path, output_folder, fields, every, coord_system, grid_index):
+    return write_timdep_rasters(file_path, output_folder, grid_index, fields, every, crs=f"EPSG:{coord_system}")
+
+
+def write_point_layer(output_path, columns, coord_system, model_data):
+    return export_model_points(model_data, output_path, columns, crs=f"EPSG:{coord_system}")
+
+
+def resolve_model_columns(args):
+    """
+    Fills in the default raster and point column selections with the columns the project has, printing a note for
+    those left out of a selected output, and checks the columns named on the command line.
+    :return: Copy of args with args.rasters and args.point_columns set.
+    :raise ValueError: When a column named for a selected output is not available in the project.
+    """
+    args = copy.copy(args)
+    for option, name, output, defaults in [('--rasters', 'rasters', 'rasters', RASTER_COLUMNS),
+                                           ('--point-columns', 'point_columns', 'points', POINT_COLUMNS),
+                                           ('--zonal-columns', 'zonal_columns', 'zonal', ZONAL_COLUMNS)]:
+        columns = getattr(args, name)
+        missing = unavailable_columns(args.project, defaults if columns is None else columns)
+        if columns is None:
+            if missing and output in args.outputs:
+                print(f"Note: {', '.join(missing)} left out of {option}, INFIL.DAT does not use the Green and "
+                      f"Ampt method")
+            setattr(args, name, [column for column in defaults if column not in missing])
+        elif missing and output in args.outputs:
+            raise ValueError(f"{option} {' '.join(missing)}: only available when INFIL.DAT uses the Green and Ampt "
+                             f"method")
+    return args
+
+
+def build_pipeline(args, plan):
+    """
+    Builds the stage graph for the selected outputs that are out of date. Each export only waits for the inputs it
+    reads, so the shapefiles, the spreadsheet and the rasters overlap.
+    :param plan: BuildPlan deciding which outputs are stale.
+    :return: (Pipeline, dict of stage name to the output file it writes).
+    """
+    file_path = args.project
+    use_cache = not args.no_cache
+    raster_outpath = os.path.join(file_path, 'flo2d_rasters')
+    shp_outpath = os.path.join(file_path, 'flo2d_shp')
+    outputs = set(args.outputs)
+
+    def sources(*file_names):
+        return [os.path.join(file_path, file_name) for file_name in file_names]
+
+    # Only outputs whose inputs or parameters changed since they were last built get a stage
+    stage_outputs = {}
+    if 'fpxsec' in outputs:
+        fpxsec_shp = os.path.join(file_path, 'FLO2D_SHP', 'fpxsec.shp')
+        if plan.needs_build(fpxsec_shp, sources('FPXSEC.DAT', 'HYCROSS.OUT', 'DEPTH.OUT'), {'epsg': args.epsg}):
+            stage_outputs['fpxsec'] = fpxsec_shp
+    if 'spreadsheet' in outputs:
+        workbook = os.path.join(file_path, 'fpxsec_hydrographs.xlsx')
+        if plan.needs_build(workbook, sources('HYCROSS.OUT'), {'plot_mode': args.plot_mode, 'layout': args.layout}):
+            stage_outputs['spreadsheet'] = workbook
+    if 'hystruc' in outputs:
+        hystruc_shp = os.path.join(shp_outpath, 'hystruc_lines.shp')
+        if plan.needs_build(hystruc_shp, sources('HYSTRUC.DAT', 'HYDROSTRUCT.OUT', 'DEPTH.OUT'), {'epsg': args.epsg}):
+            stage_outputs['hystruc'] = hystruc_shp
+    if 'rasters' in outputs:
+        column_specs = grid_column_specs()
+        for column in args.rasters:
+            raster_file = os.path.join(raster_outpath, f'{column}.tif')
+            params = {'epsg': args.epsg, 'spec': column_specs[column], 'options': TILED_RASTER_OPTIONS}
+            if plan.needs_build(raster_file, sources(DEPTH_SPEC[0], column_specs[column][0]), params):
+                stage_outputs[f'raster_{column}'] = raster_file
+    if 'points' in outputs:
+        column_specs = grid_column_specs()
+        points_file = os.path.join(shp_outpath, f'flo2d_data.{args.vector_format}')
+        point_sources = sources(DEPTH_SPEC[0], *sorted({column_specs[column][0] for column in args.point_columns
+                                                        if column != 'grid_id'}))
+        params = {'epsg': args.epsg, 'columns': args.point_columns,
+                  'specs': [column_specs.get(column) for column in args.point_columns]}
+        if plan.needs_build(points_file, point_sources, params):
+            stage_outputs['points'] = points_file
+    if 'timdep' in outputs:
+        timdep_index = os.path.join(raster_outpath, 'timdep', TIMDEP_INDEX_NAME)
+        params = {'epsg': args.epsg, 'fields': args.timdep_fields, 'every': args.timdep_every,
+                  'options': TIMDEP_RASTER_OPTIONS}
+        if plan.needs_build(timdep_index, sources('TIMDEP.OUT', DEPTH_SPEC[0]), params):
+            stage_outputs['timdep'] = timdep_index
+    if 'derived' in outputs:
+        column_specs = grid_column_specs()
+        for product in args.derived:
+            raster_file = os.path.join(raster_outpath, f'{product.name}.tif')
+            columns = product_columns([product])
+            params = {'epsg': args.epsg, 'product': product._asdict(), 'options': TILED_RASTER_OPTIONS,
+                      'specs': [column_specs.get(column) for column in columns]}
+            product_sources = sources(DEPTH_SPEC[0], *sorted({column_specs[column][0] for column in columns
+                                                              if column in column_specs}))
+            if plan.needs_build(raster_file, product_sources, params):
+                stage_outputs[f'derived_{product.name}'] = raster_file
+    if 'zonal' in outputs:
+        column_specs = grid_column_specs()
+        zones_name = os.path.splitext(os.path.basename(args.zones))[0]
+        zonal_file = os.path.join(shp_outpath, f'zonal_{zones_name}.{args.vector_format}')
+        zonal_sources = [args.zones] + sources(DEPTH_SPEC[0], *sorted({column_specs[column][0]
+                                                                       for column in args.zonal_columns}))
+        params = {'epsg': args.epsg, 'columns': args.zonal_columns, 'method': args.zone_method,
+                  'specs': [column_specs[column] for column in args.zonal_columns]}
+        if plan.needs_build(zonal_file, zonal_sources, params):
+            stage_outputs['zonal'] = zonal_file
+    raster_columns = [column for column in args.rasters if f'raster_{column}' in stage_outputs]
+    zonal_columns = args.zonal_columns if 'zonal' in stage_outputs else []
+    derived_products = [product for product in args.derived if f'derived_{product.name}' in stage_outputs]
+    point_columns = args.point_columns if 'points' in stage_outputs else []
+
+    pipeline = Pipeline(args.workers, args.executor)
+    if not stage_outputs:
+        return pipeline, stage_outputs
+    if set(stage_outputs) - {'spreadsheet', 'points'}:
+        pipeline.add('grid_index', load_grid_index, file_path, use_cache, args.shared_cache)
+
+    if {'fpxsec', 'spreadsheet'} & set(stage_outputs):
+        # Parse HYCROSS.OUT once for the cross section results and the spreadsheet
+        pipeline.add('hycross', read_hycross, os.path.join(file_path, 'HYCROSS.OUT'))
+    if 'fpxsec' in stage_outputs:
+        pipeline.add('fpxsec', write_fpxsec_shapefile, file_path, args.epsg, deps=['hycross', 'grid_index'])
+    if 'spreadsheet' in stage_outputs:
+        pipeline.add('spreadsheet', hycross_spreadsheet, file_path, plot_mode=args.plot_mode,
+                     max_workers=args.workers, layout=args.layout, deps=['hycross'])
+    if 'hystruc' in stage_outputs:
+        pipeline.add('hystruc', write_hystruc_shapefile, file_path, args.epsg, shp_outpath, use_cache,
+                     deps=['grid_index'])
+    if raster_columns or point_columns or derived_products or zonal_columns:
+        # Lazy: each raster stage reads its column's source file when it first accesses it
+        model_columns = list(dict.fromkeys(raster_columns + product_columns(derived_products) + zonal_columns +
+                                           [column for column in point_columns if column != 'grid_id']))
+        pipeline.add('model_data', load_model_data, file_path, model_columns, use_cache)
+    if 'points' in stage_outputs:
+        pipeline.add('points', write_point_layer, stage_outputs['points'], point_columns, args.epsg,
+                     deps=['model_data'])
+    if 'zonal' in stage_outputs:
+        pipeline.add('zonal', write_zone_statistics, args.zones, stage_outputs['zonal'], zonal_columns,
+                     args.zone_method, args.epsg, deps=['model_data', 'grid_index'])
+    if 'timdep' in stage_outputs:
+        pipeline.add('timdep', write_timdep_stack, file_path, os.path.dirname(stage_outputs['timdep']),
+                     args.timdep_fields, args.timdep_every, args.epsg, deps=['grid_index'])
+    if raster_columns or derived_products:
+        pipeline.add('raster_blocks', build_tiled_blocks, deps=['grid_index'])
+    for column in raster_columns:
+        pipeline.add(f'raster_{column}', write_column_raster, column, raster_outpath, args.epsg,
+                     deps=['model_data', 'grid_index', 'raster_blocks'])
+    for product in derived_products:
+        # Evaluated straight from the model data, without reading the column rasters back
+        pipeline.add(f'derived_{product.name}', write_derived_raster, product, raster_outpath, args.epsg,
+                     deps=['model_data', 'grid_index', 'raster_blocks'])
+    return pipeline, stage_outputs
+
+
+def run_project(args):
+    """
+    Post-processes one project: builds its stale outputs and records them in the build manifests. When profiling
+    is on, the spans of the run are written to PROFILE_REPORT_NAME in the project folder.
+    :param args: Parsed command line options, with args.project the project folder.
+    :return: ProjectResult.
+    """
+    if not profiling_enabled():
+        return build_project(args)
+
+    # Drop spans left over from an earlier project run by the same batch worker
+    pop_profile_records()
+    started = time.time()
+    with profile_span('project'):
+        result = build_project(args)
+    json_path, _ = write_profile_report(pop_profile_records(), os.path.join(args.project, PROFILE_REPORT_NAME),
+                                        project=os.path.abspath(args.project), started=started,
+                                        options={name: value for name, value in vars(args).items()
+                                                 if name != 'projects'})
+    print(f"Profile written to {json_path}")
+    return result
+
+
+def build_project(args):
+    # Create required directories
+    create_required_folders([os.path.join(args.project, 'flo2d_rasters'), os.path.join(args.project, 'flo2d_shp')])
+    try:
+        args = resolve_model_columns(args)
+    except ValueError as error:
+        print(error, file=sys.stderr)
+        return ProjectResult(1, [], 0, 0)
+
+    plan = BuildPlan(force=args.force)
+    pipeline, stage_outputs = build_pipeline(args, plan)
+    if not pipeline.stages:
+        # Saved anyway to keep the refreshed mtimes of touched but unchanged inputs
+        plan.save()
+        print("All selected outputs are up to date.")
+        return ProjectResult(0, [], 0, len(plan.up_to_date))
+
+    status = 0
+    try:
+        pipeline.run()
+    except PipelineError as error:
+        print(error, file=sys.stderr)
+        status = 1
+
+    # Record the outputs that were built, even when another stage failed
+    built = 0
+    for report in pipeline.reports:
+        if report.status == 'done' and report.name in stage_outputs:
+            plan.record(stage_outputs[report.name])
+            built += 1
+    plan.save()
+    result = ProjectResult(status, pipeline.reports, built, len(plan.up_to_date))
+    if status:
+        return result
+
+    print(format_summary(pipeline.reports))
+    print("Processing completed successfully.")
+    return result
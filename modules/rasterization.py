@@ -1,33 +1,142 @@
 # rasterization.py
 
+import os
+from collections import namedtuple
 import numpy as np
 import rasterio
+import rasterio.shutil
+from rasterio.enums import Resampling
 from rasterio.transform import from_origin
-from modules.utilities import time_function
+from rasterio.windows import Window
+from modules.utilities import add_metrics, time_function
+
+# Raster placement of every model cell, computed once per model and shared by all columns
+RasterGrid = namedtuple('RasterGrid', ['rows', 'cols', 'nrows', 'ncols', 'transform'])
+
+# Defaults for the tiled output mode: compact dtype, nodata tag, compressed internal tiles and COG layout
+TILED_RASTER_OPTIONS = dict(dtype='float32', nodata=-9999.0, compress='deflate', blocksize=512, overviews=True, cog=True)
+
+
+def build_raster_grid(x_coords, y_coords, cell_size):
+    """
+    Computes the raster row/column of each cell center and the raster transform.
+    :param x_coords: Cell center x coordinates.
+    :param y_coords: Cell center y coordinates.
+    :param cell_size: Grid cell size.
+    :return: RasterGrid with per-cell row and column index arrays.
+    """
+    x_coords = np.asarray(x_coords, dtype=np.float64)
+    y_coords = np.asarray(y_coords, dtype=np.float64)
+    xmin, xmax = x_coords.min(), x_coords.max()
+    ymin, ymax = y_coords.min(), y_coords.max()
+
+    # Cell centers sit on whole multiples of the cell size from the extent, so round rather than floor
+    # to stay on the right cell despite floating-point error in the coordinates
+    cols = np.rint((x_coords - xmin) / cell_size).astype(np.int64)
+    rows = np.rint((ymax - y_coords) / cell_size).astype(np.int64)
+    nrows = int(np.rint((ymax - ymin) / cell_size)) + 1
+    ncols = int(np.rint((xmax - xmin) / cell_size)) + 1
+
+    transform = from_origin(xmin - cell_size / 2, ymax + cell_size / 2, cell_size, cell_size)
+    return RasterGrid(rows, cols, nrows, ncols, transform)
+
+
+def rasterize_values(grid, values):
+    """
+    Scatters per-cell values onto a NaN-filled raster array.
+    """
+    raster = np.full((grid.nrows, grid.ncols), np.nan)
+    raster[grid.rows, grid.cols] = values
+    return raster
+
+
+def build_raster_blocks(grid, blocksize):
+    """
+    Groups cells by the raster block they fall in, so tiles can be filled and written one at a time.
+    :param grid: RasterGrid of the model.
+    :param blocksize: Tile width and height in pixels, a multiple of 16.
+    :return: List of (Window, cell positions) for every block that holds at least one cell.
+    """
+    nblock_cols = -(-grid.ncols // blocksize)
+    block_ids = (grid.rows // blocksize) * nblock_cols + grid.cols // blocksize
+    order = np.argsort(block_ids, kind='stable')
+    sorted_ids = block_ids[order]
+    starts = np.flatnonzero(np.r_[True, sorted_ids[1:] != sorted_ids[:-1]])
+    ends = np.r_[starts[1:], len(order)]
+
+    blocks = []
+    for start, end in zip(starts, ends):
+        row_off = int(sorted_ids[start] // nblock_cols) * blocksize
+        col_off = int(sorted_ids[start] % nblock_cols) * blocksize
+        window = Window(col_off, row_off, min(blocksize, grid.ncols - col_off), min(blocksize, grid.nrows - row_off))
+        blocks.append((window, order[start:end]))
+    return blocks
+
+
+def overview_factors(grid, blocksize):
+    factors = []
+    factor = 2
+    while max(grid.nrows, grid.ncols) / factor >= blocksize / 2:
+        factors.append(factor)
+        factor *= 2
+    return factors
 
-@time_function
-def create_raster_from_gdf(geo_df, column, raster_file, cell_size):
-    x_coords = geo_df.geometry.x.to_numpy()
-    y_coords = geo_df.geometry.y.to_numpy()
-    values = geo_df[column].to_numpy()
-
-    xmin, ymin, xmax, ymax = geo_df.total_bounds
-    xmin -= cell_size / 2
-    xmax += cell_size / 2
-    ymin -= cell_size / 2
-    ymax += cell_size / 2
-    nrows = int(np.ceil((ymax - ymin) / cell_size))
-    ncols = int(np.ceil((xmax - xmin) / cell_size))
-
-    transform = from_origin(xmin, ymax, cell_size, cell_size)
-    raster = np.full((nrows, ncols), np.nan)
-
-    for x, y, value in zip(x_coords, y_coords, values):
-        col_idx = int(np.floor((x - xmin - cell_size / 2) / cell_size))
-        row_idx = int(np.floor((ymax - y - cell_size / 2) / cell_size))
-        if 0 <= row_idx < nrows and 0 <= col_idx < ncols:
-            raster[row_idx, col_idx] = value
 
+def write_raster_tiled(grid, blocks, values, raster_file, crs=None, dtype='float32', nodata=-9999.0,
+                       compress='deflate', blocksize=512, overviews=True, cog=True):
+    """
+    Writes per-cell values as a tiled, compressed GeoTIFF one block at a time, so peak memory is bounded by the
+    tile size rather than the raster extent. Blocks without cells are left sparse and read back as nodata.
+    :param grid: RasterGrid of the model.
+    :param blocks: Output of build_raster_blocks for the same grid and blocksize.
+    :param values: Per-cell values in model order.
+    :param dtype: Output data type.
+    :param nodata: Nodata value, also written where values are NaN.
+    :param compress: GDAL compression, e.g. 'deflate', 'zstd' or 'lzw'.
+    :param overviews: Build internal overviews.
+    :param cog: Rewrite the result with the COG driver so overviews and tiles follow the Cloud-Optimized layout.
+    """
+    dtype = np.dtype(dtype)
+    profile = dict(
+        driver='GTiff',
+        height=grid.nrows,
+        width=grid.ncols,
+        count=1,
+        dtype=dtype,
+        crs=crs,
+        transform=grid.transform,
+        nodata=nodata,
+        tiled=True,
+        blockxsize=blocksize,
+        blockysize=blocksize,
+        compress=compress,
+        predictor=3 if dtype.kind == 'f' else 2,
+        sparse_ok=True,
+        bigtiff='IF_SAFER',
+    )
+    tiled_file = f'{raster_file}.tmp.tif' if cog else raster_file
+
+    values = np.asarray(values)
+    with rasterio.open(tiled_file, 'w', **profile) as dst:
+        for window, positions in blocks:
+            block_values = values[positions]
+            if block_values.dtype.kind == 'f':
+                block_values = np.where(np.isnan(block_values), nodata, block_values)
+            tile = np.full((window.height, window.width), nodata, dtype=dtype)
+            tile[grid.rows[positions] - window.row_off, grid.cols[positions] - window.col_off] = block_values
+            dst.write(tile, 1, window=window)
+        if overviews and not cog:
+            dst.build_overviews(overview_factors(grid, blocksize), Resampling.average)
+
+    if cog:
+        rasterio.shutil.copy(tiled_file, raster_file, driver='COG', compress=compress, blocksize=blocksize,
+                             predictor='YES', overviews='AUTO' if overviews else 'NONE',
+                             overview_resampling='average', bigtiff='IF_SAFER')
+        os.remove(tiled_file)
+    return raster_file
+
+
+def write_raster(raster, raster_file, transform, crs=None):
     with rasterio.open(
         raster_file, 'w',
         driver='GTiff',
@@ -35,8 +144,51 @@ def create_raster_from_gdf(geo_df, column, raster_file, cell_size):
         width=raster.shape[1],
         count=1,
         dtype=raster.dtype,
-        crs=geo_df.crs,
+        crs=crs,
         transform=transform,
     ) as dst:
         dst.write(raster, 1)
-    return raster_file
\ No newline at end of file
+    return raster_file
+
+
+@time_function
+def create_raster_from_gdf(geo_df, column, raster_file, cell_size, grid=None, crs=None):
+    if grid is None:
+        grid = build_raster_grid(geo_df['x'].to_numpy(), geo_df['y'].to_numpy(), cell_size)
+    raster = rasterize_values(grid, geo_df[column].to_numpy())
+    return write_raster(raster, raster_file, grid.transform, crs if crs is not None else getattr(geo_df, 'crs', None))
+
+
+@time_function
+def create_rasters_from_gdf(geo_df, columns, raster_outpath, cell_size, crs=None, tiled=False, grid=None,
+                            blocks=None, **tiled_options):
+    """
+    Writes one GeoTIFF per column, sharing a single raster grid across all of them.
+    :param geo_df: DataFrame or GeoDataFrame of model cells with x/y columns. No point geometry is required.
+    :param columns: Columns to rasterize.
+    :param raster_outpath: Output folder. Rasters are named <column>.tif.
+    :param cell_size: Grid cell size.
+    :param crs: Raster CRS. Defaults to the GeoDataFrame CRS, if any.
+    :param tiled: Stream tiled, compressed Cloud-Optimized GeoTIFFs block by block instead of full float64 arrays.
+    :param grid: Prebuilt RasterGrid, e.g. GridIndex.raster_grid. Built from the x/y columns when omitted.
+    :param blocks: Prebuilt build_raster_blocks output for grid and the tiled blocksize, when writing in several calls.
+    :param tiled_options: Overrides for TILED_RASTER_OPTIONS (dtype, nodata, compress, blocksize, overviews, cog).
+    :return: List of written raster paths.
+    """
+    if grid is None:
+        grid = build_raster_grid(geo_df['x'].to_numpy(), geo_df['y'].to_numpy(), cell_size)
+    crs = crs if crs is not None else getattr(geo_df, 'crs', None)
+    options = dict(TILED_RASTER_OPTIONS, **tiled_options)
+    if tiled and blocks is None:
+        blocks = build_raster_blocks(grid, options['blocksize'])
+
+    raster_files = []
+    for column in columns:
+        raster_file = os.path.join(raster_outpath, f'{column}.tif')
+        if tiled:
+            raster_files.append(write_raster_tiled(grid, blocks, geo_df[column].to_numpy(), raster_file, crs, **options))
+        else:
+            raster = rasterize_values(grid, geo_df[column].to_numpy())
+            raster_files.append(write_raster(raster, raster_file, grid.transform, crs))
+        add_metrics(rows=len(geo_df), nbytes=os.path.getsize(raster_file))
+    return raster_files
@@ -0,0 +1,187 @@
+# synthetic_project.py
+
+import argparse
+import os
+import numpy as np
+
+# Rows formatted per write, bounding memory on large grids
+WRITE_CHUNK_ROWS = 500000
+# Hours between hydrograph output intervals
+TIME_STEP = 0.1
+
+
+def write_table(path, columns, fmt, header='', chunk_rows=WRITE_CHUNK_ROWS, mode='w'):
+    """
+    Writes whitespace separated fixed-width columns, formatting chunk_rows rows at a time.
+    :param columns: Equal-length 1-D arrays, one per column.
+    :param fmt: One printf-style format per column.
+    :param mode: 'a' to append to the file.
+    """
+    row_format = ' '.join(fmt)
+    n_rows = len(columns[0])
+    with open(path, mode) as file:
+        file.write(header)
+        for start in range(0, n_rows, chunk_rows):
+            chunk = zip(*[np.asarray(column[start:start + chunk_rows]).tolist() for column in columns])
+            file.write('\n'.join([row_format % row for row in chunk]))
+            file.write('\n')
+
+
+def grid_layout(cells, cell_size=10.0, x_origin=500000.0, y_origin=1000000.0):
+    """
+    Lays cells out row by row on a near-square grid, the last row possibly partial.
+    :return: (grid_ids, x, y, ncols) with grid ids numbered from 1.
+    """
+    ncols = int(np.ceil(np.sqrt(cells)))
+    grid_ids = np.arange(1, cells + 1, dtype=np.int64)
+    x = x_origin + ((grid_ids - 1) % ncols) * cell_size
+    y = y_origin - ((grid_ids - 1) // ncols) * cell_size
+    return grid_ids, x, y, ncols
+
+
+def hydrograph(times, peak, peak_time, width):
+    return peak * np.exp(-((times - peak_time) / width) ** 2)
+
+
+def trapezoid_volume(discharge, times):
+    """
+    Returns the discharge volume in acre-feet of a hydrograph in cfs over hours.
+    """
+    return float(np.sum(np.diff(times) * (discharge[1:] + discharge[:-1]) / 2)) * 3600 / 43560
+
+
+def generate_project(folder, cells=10000, cross_sections=10, structures=5, timesteps=100, cell_size=10.0, seed=0,
+                     timdep_steps=0):
+    """
+    Writes a synthetic FLO-2D project with the files read by the post-processor: the per-cell outputs, TOPO.DAT,
+    MANNINGS_N.DAT, a Green and Ampt INFIL.DAT, FPXSEC.DAT with HYCROSS.OUT, HYSTRUC.DAT with HYDROSTRUCT.OUT, and
+    TIMDEP.OUT when timdep_steps is set.
+    :param folder: Project folder, created when missing.
+    :param cells: Number of grid cells.
+    :param cross_sections: Number of floodplain cross sections.
+    :param structures: Number of hydraulic structures.
+    :param timesteps: Output intervals in every cross section and structure hydrograph.
+    :param timdep_steps: Output intervals in TIMDEP.OUT, 0 to leave it out.
+    :param seed: Random seed, so the same arguments always write the same project.
+    :return: folder.
+    """
+    os.makedirs(folder, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    grid_ids, x, y, ncols = grid_layout(cells, cell_size)
+    nrows = -(-cells // ncols)
+
+    def path(file_name):
+        return os.path.join(folder, file_name)
+
+    # Gently sloping terrain with noise, and a depth field to derive the other outputs from
+    topo = 1000.0 + (y - y.min()) * 0.002 + (x - x.min()) * 0.001 + rng.random(cells) * 0.5
+    depth = np.maximum(rng.normal(0.5, 0.6, cells), 0.0)
+    velocity = depth * rng.uniform(0.5, 2.0, cells)
+    wet = depth > 0
+
+    ixy = [grid_ids, x, y]
+    ixy_fmt = ['%9d', '%15.3f', '%15.3f']
+    write_table(path('DEPTH.OUT'), ixy + [depth], ixy_fmt + ['%10.3f'])
+    write_table(path('VELFP.OUT'), ixy + [velocity], ixy_fmt + ['%10.3f'])
+    write_table(path('MAXWSELEV.OUT'), ixy + [topo + depth], ixy_fmt + ['%10.3f'])
+    write_table(path('TIMEONEFT.OUT'), ixy + [np.where(depth > 1, rng.uniform(0.5, 10, cells), 0)],
+                ixy_fmt + ['%10.2f'])
+    write_table(path('TIMETWOFT.OUT'), ixy + [np.where(depth > 2, rng.uniform(1, 12, cells), 0)],
+                ixy_fmt + ['%10.2f'])
+    write_table(path('TIMETOPEAK.OUT'), ixy + [np.where(wet, rng.uniform(0.5, 24, cells), 0)], ixy_fmt + ['%10.2f'])
+    write_table(path('FINALVEL.OUT'), ixy + [velocity * 0.1], ixy_fmt + ['%10.3f'])
+    write_table(path('FINALDEP.OUT'), ixy + [depth * 0.2], ixy_fmt + ['%10.3f'])
+    write_table(path('TOPO.DAT'), [x, y, topo], ['%15.3f', '%15.3f', '%10.2f'])
+    write_table(path('MANNINGS_N.DAT'), [grid_ids, rng.choice([0.035, 0.04, 0.06, 0.1], cells)], ['%9d', '%8.3f'])
+    write_table(path('MAXQHYD.OUT'),
+                ixy + [topo, depth, velocity, velocity, velocity * depth * cell_size, rng.integers(1, 9, cells),
+                       topo + depth],
+                ixy_fmt + ['%10.2f', '%10.3f', '%10.3f', '%10.3f', '%12.3f', '%4d', '%10.2f'],
+                header=' MAXIMUM DISCHARGE AND FLOW DIRECTION\n\n'
+                       '     NODE         X              Y            ELEV    DEPTH   VEL   VELMAX   QMAX  DIR  WSE\n\n')
+    write_table(path('INFIL_DEPTH.OUT'), ixy + [topo, depth * 0.3, wet.astype(np.int64)],
+                ixy_fmt + ['%10.2f', '%10.3f', '%4d'],
+                header='     NODE         X              Y            ELEV   INFIL DEPTH  STOP\n')
+    # Green and Ampt: method line and global parameters, then one F line per cell
+    write_table(path('INFIL.DAT'),
+                [np.full(cells, 'F'), grid_ids, rng.uniform(0.01, 1.0, cells), rng.uniform(2, 12, cells),
+                 rng.uniform(0.1, 0.4, cells), rng.uniform(0, 0.2, cells), rng.uniform(0, 0.5, cells),
+                 rng.uniform(1, 10, cells)],
+                ['%s', '%9d', '%8.3f', '%8.3f', '%8.3f', '%8.3f', '%8.3f', '%8.3f'],
+                header='1\n  0.100  0.200  0.300\nR  0.500\n')
+
+    if timdep_steps:
+        # Every cell at every step, the flood rising to the maximum depth at the last step
+        open(path('TIMDEP.OUT'), 'w').close()
+        for step in range(1, timdep_steps + 1):
+            step_depth = depth * step / timdep_steps
+            write_table(path('TIMDEP.OUT'),
+                        [grid_ids, step_depth, velocity * 0.7 * step / timdep_steps,
+                         velocity * 0.7 * step / timdep_steps, topo + step_depth],
+                        ['%9d', '%10.3f', '%10.3f', '%10.3f', '%10.3f'], header=f'{step * TIME_STEP:10.2f}\n', mode='a')
+
+    times = np.round(np.arange(1, timesteps + 1) * TIME_STEP, 4)
+    duration = times[-1]
+
+    # Cross sections: short rows of cells spread over the grid
+    section_rows = np.linspace(0, nrows - 1, cross_sections + 2)[1:-1].astype(np.int64) if cross_sections else []
+    with open(path('FPXSEC.DAT'), 'w') as file:
+        file.write('P 1\n')
+        for k, row in enumerate(section_rows):
+            start = row * ncols + (k * 7) % max(ncols - 8, 1)
+            nodes = [node for node in range(start + 1, start + 9) if node <= cells]
+            file.write(f"X 1 {len(nodes)} {' '.join(map(str, nodes))}\n")
+
+    summaries = []
+    with open(path('HYCROSS.OUT'), 'w') as file:
+        for section in range(1, cross_sections + 1):
+            discharge = hydrograph(times, rng.uniform(100, 5000), rng.uniform(0.2, 0.8) * duration, duration / 6)
+            wse = 1000 + np.sqrt(discharge) / 10
+            file.write(f'\n   HYDROGRAPH AND FLOODPLAIN HYDRAULICS FOR CROSS SECTION NO:{section:5d}\n\n')
+            file.write('     TIME   TOP WIDTH   DEPTH       WSE   VELOCITY   DISCHARGE\n\n')
+            np.savetxt(file, np.column_stack([times, np.full(timesteps, 80.0), wse - 1000, wse,
+                                              np.sqrt(discharge) / 20, discharge]),
+                       fmt=['%9.2f', '%10.2f', '%8.2f', '%9.2f', '%8.2f', '%11.2f'])
+            peak = int(np.argmax(discharge))
+            summaries.append((section, discharge[peak], times[peak], trapezoid_volume(discharge, times)))
+        for section, q_max, time_max, volume in summaries:
+            file.write(f'  THE MAXIMUM DISCHARGE FROM CROSS SECTION{section:5d} IS:{q_max:12.2f} CFS AT TIME:'
+                       f'{time_max:9.2f} HOURS\n')
+            file.write(f'  THE VOLUME OF DISCHARGE IS:{volume:12.2f} AF\n')
+
+    # Structures: culverts between random cells
+    nodes = rng.integers(1, cells + 1, size=(structures, 2))
+    with open(path('HYSTRUC.DAT'), 'w') as file:
+        for s, (inflow, outflow) in enumerate(nodes, start=1):
+            file.write(f'S CULV{s} 0 1 {inflow} {outflow} 0 {topo[inflow - 1]:.2f} 50.0 2.0\n')
+            file.write('F 1 1 0.013 0.5 0.0\n')
+
+    maxima = []
+    with open(path('HYDROSTRUCT.OUT'), 'w') as file:
+        for s in range(1, structures + 1):
+            discharge = hydrograph(times, rng.uniform(5, 200), rng.uniform(0.2, 0.8) * duration, duration / 6)
+            headwater = 1000 + np.sqrt(discharge) / 5
+            file.write(f'\n  HYDRAULIC STRUCTURE NO:{s:4d}   NAME: CULV{s}\n\n')
+            file.write('     TIME    HEADWATER   TAILWATER   DISCHARGE\n\n')
+            np.savetxt(file, np.column_stack([times, headwater, headwater - 0.5, discharge]),
+                       fmt=['%9.2f', '%10.2f', '%10.2f', '%10.2f'])
+            peak = int(np.argmax(discharge))
+            maxima.append((s, discharge[peak], times[peak]))
+        for s, q_max, time_max in maxima:
+            file.write(f'  THE MAXIMUM DISCHARGE FOR: CULV{s} IS: {q_max:10.2f} CFS AT TIME: {time_max:8.2f}\n')
+
+    return folder
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Write a synthetic FLO-2D project for benchmarks.")
+    parser.add_argument('folder')
+    parser.add_argument('--cells', type=int, default=10000)
+    parser.add_argument('--cross-sections', type=int, default=10)
+    parser.add_argument('--structures', type=int, default=5)
+    parser.add_argument('--timesteps', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--timdep-steps', type=int, default=0, help="Output intervals written to TIMDEP.OUT.")
+    args = parser.parse_args()
+    generate_project(args.folder, args.cells, args.cross_sections, args.structures, args.timesteps, seed=args.seed,
+                     timdep_steps=args.timdep_steps)
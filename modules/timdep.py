@@ -0,0 +1,133 @@
+# timdep.py
+
+import csv
+import io
+import os
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+from modules.rasterization import TILED_RASTER_OPTIONS, build_raster_blocks, write_raster_tiled
+from modules.utilities import add_metrics, atomic_write, time_function
+
+# Fields of the cell records of TIMDEP.OUT, after the grid_id in field 0
+TIMDEP_FIELDS = {'depth': 1, 'x_velocity': 2, 'y_velocity': 3, 'wse': 4}
+# Bytes parsed per read, bounding the reader's memory whatever the size of the file
+TIMDEP_CHUNK_BYTES = 64 << 20
+# Written next to the step rasters, listing the step, time and raster file of each
+TIMDEP_INDEX_NAME = 'timdep_steps.csv'
+# Per-step rasters skip overviews and the COG rewrite, which would dominate hundreds of small writes
+TIMDEP_RASTER_OPTIONS = dict(TILED_RASTER_OPTIONS, overviews=False, cog=False)
+
+# One output interval of TIMDEP.OUT: step number counted from 0, time in hours, grid ids and per-field values
+TimeStep = namedtuple('TimeStep', ['index', 'time', 'grid_ids', 'values'])
+
+
+def _record_width(path):
+    # Fields per cell record, taken from the first line after the first time line
+    with open(path, 'r') as file:
+        for line in file:
+            parts = line.split()
+            if len(parts) > 1:
+                return len(parts)
+    return len(TIMDEP_FIELDS) + 1
+
+
+def _read_chunks(path, chunk_bytes):
+    # Blocks of whole lines
+    with open(path, 'rb') as file:
+        while True:
+            block = file.read(chunk_bytes)
+            if not block:
+                return
+            yield block + file.readline()
+
+
+def iter_timdep(path, fields=('depth',), every=1, chunk_bytes=TIMDEP_CHUNK_BYTES):
+    """
+    Streams the output intervals of TIMDEP.OUT, a time line followed by one 'grid_id depth x_velocity y_velocity
+    wse' record per cell. The file is parsed chunk_bytes at a time and only the step being assembled is held, so
+    memory does not grow with the number of steps.
+    :param path: Path to TIMDEP.OUT.
+    :param fields: TIMDEP_FIELDS to return.
+    :param every: Keep one step in every, starting with the first.
+    :return: Generator of TimeStep, values mapping each field to a float32 array in the order of grid_ids.
+    """
+    if every < 1:
+        raise ValueError(f"every should be at least 1, got {every}")
+    fields = tuple(dict.fromkeys(fields))
+    width = _record_width(path)
+    missing = [field for field in fields if TIMDEP_FIELDS[field] >= width]
+    if missing:
+        raise ValueError(f"{path} has no {', '.join(missing)} field")
+    # pandas returns usecols in file order, so the columns are picked by label to follow the order of fields
+    usecols = [0] + [TIMDEP_FIELDS[field] for field in fields]
+
+    step_index, step_time, pieces = -1, None, []
+
+    def finish():
+        if step_time is None or step_index % every:
+            return None
+        grid_ids = np.concatenate([piece[0] for piece in pieces]) if pieces else np.empty(0, dtype=np.int64)
+        values = {field: np.concatenate([piece[1][:, k] for piece in pieces]) if pieces
+                  else np.empty(0, dtype=np.float32) for k, field in enumerate(fields)}
+        return TimeStep(step_index, step_time, grid_ids, values)
+
+    for block in _read_chunks(path, chunk_bytes):
+        # Time lines only fill field 0, so they parse as rows with NaN in the value fields
+        table = pd.read_csv(io.BytesIO(block), sep=r'\s+', header=None, names=range(width), usecols=usecols,
+                            dtype=np.float64, engine='c')[usecols].to_numpy()
+        add_metrics(rows=len(table), nbytes=len(block))
+        time_rows = np.flatnonzero(np.isnan(table[:, 1]))
+        bounds = np.r_[time_rows, len(table)]
+        segments = [(-1, 0, bounds[0])] + [(row, row + 1, end) for row, end in zip(time_rows, bounds[1:])]
+
+        for time_row, start, end in segments:
+            if time_row >= 0:
+                step = finish()
+                if step is not None:
+                    yield step
+                step_index, step_time, pieces = step_index + 1, float(table[time_row, 0]), []
+            if end > start and step_time is not None and step_index % every == 0:
+                pieces.append((table[start:end, 0].astype(np.int64), table[start:end, 1:].astype(np.float32)))
+
+    step = finish()
+    if step is not None:
+        yield step
+
+
+@time_function
+def write_timdep_rasters(file_path, output_folder, grid_index, fields=('depth',), every=1, crs=None,
+                         chunk_bytes=TIMDEP_CHUNK_BYTES, **tiled_options):
+    """
+    Scatters every kept step of TIMDEP.OUT onto the model raster grid and writes it as a tiled, compressed GeoTIFF
+    per field, <field>_<step>.tif, listing them in TIMDEP_INDEX_NAME. Cells missing from a step are nodata.
+    :param file_path: Path to the directory containing TIMDEP.OUT.
+    :param output_folder: Folder receiving the step rasters, created when missing.
+    :param grid_index: GridIndex of the model.
+    :param fields: TIMDEP_FIELDS to write.
+    :param every: Keep one step in every, starting with the first.
+    :param crs: Raster CRS.
+    :param tiled_options: Overrides for TIMDEP_RASTER_OPTIONS.
+    :return: Path of the step index.
+    """
+    options = dict(TIMDEP_RASTER_OPTIONS, **tiled_options)
+    fields = tuple(dict.fromkeys(fields))
+    grid = grid_index.raster_grid
+    blocks = build_raster_blocks(grid, options['blocksize'])
+    os.makedirs(output_folder, exist_ok=True)
+
+    index_path = os.path.join(output_folder, TIMDEP_INDEX_NAME)
+    with atomic_write(index_path, 'w', newline='') as index_file:
+        writer = csv.writer(index_file)
+        writer.writerow(['step', 'time_hrs', 'field', 'raster'])
+        values = np.empty(len(grid_index), dtype=np.float32)
+        for step in iter_timdep(os.path.join(file_path, 'TIMDEP.OUT'), fields, every, chunk_bytes):
+            positions = grid_index.positions(step.grid_ids)
+            found = positions >= 0
+            for field in fields:
+                values.fill(np.nan)
+                values[positions[found]] = step.values[field][found]
+                raster_name = f'{field}_{step.index:05d}.tif'
+                write_raster_tiled(grid, blocks, values, os.path.join(output_folder, raster_name), crs, **options)
+                writer.writerow([step.index, step.time, field, raster_name])
+    return index_path
@@ -1,21 +1,205 @@
 # utilities.py
 
+from contextlib import contextmanager
+from contextvars import ContextVar
 from functools import wraps
-import time
+from itertools import count
+import csv
+import json
 import os
+import sys
+import threading
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, where the RSS column stays empty
+    resource = None
+
+# Set to 1 to profile every run, or to 'memory' to also trace Python allocations
+PROFILE_ENV = 'FLO2D_PROFILE'
+PROFILE_FIELDS = ['id', 'parent', 'name', 'depth', 'pid', 'thread', 'start', 'wall_s', 'cpu_s', 'peak_mem_mb',
+                  'mem_delta_mb', 'max_rss_mb', 'rows', 'bytes']
+
+_profile = {'enabled': False, 'memory': False}
+_records = []
+_open_spans = []
+_profile_lock = threading.Lock()
+_span_ids = count(1)
+_current_span = ContextVar('flo2d_profile_span', default=None)
+
+
+def enable_profiling(memory=False):
+    """
+    Turns profiling on for this process and, through PROFILE_ENV, for worker processes started afterwards.
+    :param memory: Trace Python allocations with tracemalloc to report peak memory per span. Slows the run down.
+    """
+    _profile['enabled'] = True
+    _profile['memory'] = memory
+    os.environ[PROFILE_ENV] = 'memory' if memory else '1'
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def profiling_enabled():
+    return _profile['enabled']
+
+
+def _fold_peak():
+    # tracemalloc has a single peak, so fold it into every open span before resetting it for nested ones
+    peak = tracemalloc.get_traced_memory()[1]
+    for span in _open_spans:
+        span['peak'] = max(span['peak'], peak)
+    tracemalloc.reset_peak()
+
+
+def _max_rss_mb():
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return max_rss / (1 << 20 if sys.platform == 'darwin' else 1 << 10)
+
+
+@contextmanager
+def profile_span(name):
+    """
+    Records the wall time, CPU time of the calling thread, peak traced memory, and the rows and bytes reported
+    through add_metrics of a block of work. Spans nest: a span opened inside another, also in threads started
+    with contextvars.copy_context().run, records it as its parent. Does nothing when profiling is off.
+    """
+    if not _profile['enabled']:
+        yield None
+        return
+
+    parent = _current_span.get()
+    span = {'id': f'{os.getpid()}-{next(_span_ids)}', 'parent': parent['id'] if parent else None, 'name': name,
+            'depth': parent['depth'] + 1 if parent else 0, 'pid': os.getpid(), 'thread': threading.current_thread().name,
+            'start': time.time(), 'rows': None, 'bytes': None, 'peak': 0, 'start_mem': 0}
+    memory = _profile['memory'] and tracemalloc.is_tracing()
+    if memory:
+        with _profile_lock:
+            _fold_peak()
+            span['start_mem'] = tracemalloc.get_traced_memory()[0]
+            _open_spans.append(span)
+    token = _current_span.set(span)
+    start_wall, start_cpu = time.perf_counter(), time.thread_time()
+    try:
+        yield span
+    finally:
+        wall, cpu = time.perf_counter() - start_wall, time.thread_time() - start_cpu
+        _current_span.reset(token)
+        peak_mb = delta_mb = None
+        if memory:
+            with _profile_lock:
+                _fold_peak()
+                _open_spans.remove(span)
+            peak_mb = span['peak'] / (1 << 20)
+            delta_mb = (span['peak'] - span['start_mem']) / (1 << 20)
+
+        record = {field: span.get(field) for field in PROFILE_FIELDS}
+        record.update(wall_s=wall, cpu_s=cpu, peak_mem_mb=peak_mb, mem_delta_mb=delta_mb, max_rss_mb=_max_rss_mb())
+        with _profile_lock:
+            _records.append(record)
+
+
+def add_metrics(rows=None, nbytes=None):
+    """
+    Adds rows or bytes processed to the innermost open profile span of the caller.
+    """
+    span = _current_span.get()
+    if span is None:
+        return
+    if rows is not None:
+        span['rows'] = (span['rows'] or 0) + int(rows)
+    if nbytes is not None:
+        span['bytes'] = (span['bytes'] or 0) + int(nbytes)
+
+
+def pop_profile_records():
+    """
+    Returns the finished span records of this process and clears them.
+    """
+    with _profile_lock:
+        records = list(_records)
+        _records.clear()
+    return records
+
+
+def extend_profile_records(records):
+    """
+    Adds span records collected in a worker process.
+    """
+    with _profile_lock:
+        _records.extend(records)
+
+
+def write_profile_report(records, report_path, **metadata):
+    """
+    Writes span records as <report_path>.json, with the metadata, and as <report_path>.csv.
+    :return: Paths of the JSON and CSV reports.
+    """
+    records = sorted(records, key=lambda record: record['start'])
+    json_path, csv_path = f'{report_path}.json', f'{report_path}.csv'
+    with open(json_path, 'w') as file:
+        json.dump(dict(metadata, spans=records), file, indent=2)
+    with open(csv_path, 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=PROFILE_FIELDS)
+        writer.writeheader()
+        writer.writerows(records)
+    return json_path, csv_path
+
+
+# Decorator for timing functions. An optional name labels the report, e.g. time_function(read, name='DEPTH.OUT')
+# When profiling is on, each call is also recorded as a profile span
+def time_function(func=None, name=None):
+    if func is None:
+        return lambda f: time_function(f, name=name)
+    label = name or func.__name__
 
-# Decorator for timing functions
-def time_function(func):
     @wraps(func)
     def wrapper(*args, **kwargs):
-        start_time = time.time()
-        result = func(*args, **kwargs)
-        end_time = time.time()
-        print(f"Finished {func.__name__!r} in {end_time - start_time:.3f} seconds")
+        start_time = time.perf_counter()
+        if _profile['enabled']:
+            with profile_span(label):
+                result = func(*args, **kwargs)
+        else:
+            result = func(*args, **kwargs)
+        end_time = time.perf_counter()
+        # Single write so reports from concurrent threads do not interleave
+        print(f"Finished {label!r} in {end_time - start_time:.3f} seconds\n", end='')
         return result
     return wrapper
 
+
+@contextmanager
+def atomic_write(path, mode='wb', **open_options):
+    """
+    Opens a temporary file next to path and moves it over path when the block completes, so readers never see a
+    partly written file. The temporary name carries the process and thread ids, so concurrent writers of the same
+    path do not collide. If the block raises, the temporary file is removed and path is left as it was.
+    :param mode: Write mode, 'wb' or 'w'.
+    :param open_options: Passed to open, e.g. newline=''.
+    """
+    temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        with open(temp_path, mode, **open_options) as file:
+            yield file
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
 # Create folders for shapefile, raster and spreadsheet outputs
 def create_required_folders(folders):
     for folder in folders:
         os.makedirs(folder, exist_ok=True)
+
+
+_profile_setting = os.environ.get(PROFILE_ENV, '').strip().lower()
+if _profile_setting not in ('', '0', 'false', 'no', 'off'):
+    enable_profiling(memory=_profile_setting == 'memory')
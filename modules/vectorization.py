@@ -1,7 +1,21 @@
 # vectorization.py
 
+import json
+import os
+import numpy as np
 import geopandas as gpd
-from modules.utilities import time_function
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pyogrio
+from pyproj import CRS
+from modules.utilities import add_metrics, time_function
+
+# Point layer formats by file extension. GeoParquet is written with pyarrow, the others through GDAL's Arrow writer
+VECTOR_FORMATS = {'.parquet': 'GeoParquet', '.fgb': 'FlatGeobuf', '.gpkg': 'GPKG'}
+# Rows converted and written per batch, bounding the memory of the export on multi-million-cell grids
+VECTOR_CHUNK_ROWS = 500000
+# Little-endian WKB point: byte order, geometry type, x, y (21 bytes, unpadded)
+WKB_POINT_DTYPE = np.dtype([('byte_order', 'u1'), ('geometry_type', '<u4'), ('x', '<f8'), ('y', '<f8')])
 
 @time_function
 def convert_gdf_to_shapefile(geo_df, output_path, coord_system, columns=None):
@@ -13,9 +27,83 @@ def convert_gdf_to_shapefile(geo_df, output_path, coord_system, columns=None):
     """
     if columns is not None:
         geo_df = geo_df[columns + ['geometry']]
-        geo_df = geodf.crs(f"EPSG: {coord_system}")
+    geo_df = geo_df.set_crs(f"EPSG:{coord_system}", allow_override=True)
     flo2d_data = geo_df.to_file(output_path, driver='ESRI Shapefile')
 
     return flo2d_data
 
+def wkb_points(x_coords, y_coords):
+    """
+    Encodes points as WKB in one vectorized step, without creating geometry objects.
+    :return: Arrow binary array.
+    """
+    records = np.empty(len(x_coords), dtype=WKB_POINT_DTYPE)
+    records['byte_order'] = 1
+    records['geometry_type'] = 1
+    records['x'] = x_coords
+    records['y'] = y_coords
+    offsets = np.arange(len(records) + 1, dtype=np.int32) * WKB_POINT_DTYPE.itemsize
+    return pa.Array.from_buffers(pa.binary(), len(records),
+                                 [None, pa.py_buffer(offsets), pa.py_buffer(records.view(np.uint8))])
+
+def point_batches(model_data, columns, chunk_rows=VECTOR_CHUNK_ROWS):
+    """
+    Returns the Arrow schema and a generator of record batches of chunk_rows cells: the columns, with NaN as null,
+    and a WKB point geometry column.
+    """
+    x_coords = model_data['x'].to_numpy()
+    y_coords = model_data['y'].to_numpy()
+    values = {column: model_data[column].to_numpy() for column in columns}
+    schema = pa.schema([pa.field(column, pa.from_numpy_dtype(values[column].dtype)) for column in columns] +
+                       [pa.field('geometry', pa.binary())])
+
+    def batches():
+        for start in range(0, len(x_coords), chunk_rows):
+            stop = start + chunk_rows
+            arrays = [pa.array(values[column][start:stop], from_pandas=True) for column in columns]
+            arrays.append(wkb_points(x_coords[start:stop], y_coords[start:stop]))
+            yield pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+    return schema, batches()
+
+def write_geoparquet(schema, batches, output_path, crs=None):
+    geo = {'version': '1.0.0', 'primary_column': 'geometry',
+           'columns': {'geometry': {'encoding': 'WKB', 'geometry_types': ['Point'],
+                                    'crs': CRS.from_user_input(crs).to_json_dict() if crs else None}}}
+    schema = schema.with_metadata({b'geo': json.dumps(geo).encode()})
+    with pq.ParquetWriter(output_path, schema, compression='zstd') as writer:
+        for batch in batches:
+            writer.write_batch(batch)
+
+@time_function
+def export_model_points(model_data, output_path, columns=None, crs=None, chunk_rows=VECTOR_CHUNK_ROWS):
+    """
+    Writes one point per model cell to GeoParquet (.parquet), FlatGeobuf (.fgb) or GeoPackage (.gpkg). Cells are
+    encoded and streamed to the writer chunk_rows at a time, with no per-cell geometry objects, so the
+    Shapefile 2 GB and 10-character field name limits do not apply.
+    :param model_data: ModelData or DataFrame with x/y columns.
+    :param output_path: Output file. Its extension selects the format.
+    :param columns: Attribute columns. Defaults to every column besides x and y.
+    :param crs: Layer CRS, e.g. "EPSG:2223".
+    :return: output_path.
+    """
+    driver = VECTOR_FORMATS.get(os.path.splitext(output_path)[1].lower())
+    if driver is None:
+        raise ValueError(f"Unsupported vector format {output_path!r}, use one of {tuple(VECTOR_FORMATS)}")
+    columns = [column for column in (columns if columns is not None else model_data.columns)
+               if column not in ('x', 'y')]
+
+    schema, batches = point_batches(model_data, columns, chunk_rows)
+    if os.path.exists(output_path):
+        os.remove(output_path)
+    if driver == 'GeoParquet':
+        write_geoparquet(schema, batches, output_path, crs)
+    else:
+        reader = pa.RecordBatchReader.from_batches(schema, batches)
+        pyogrio.write_arrow(reader, output_path, driver=driver, geometry_name='geometry', geometry_type='Point',
+                            crs=CRS.from_user_input(crs).to_wkt() if crs else None)
+
+    add_metrics(rows=len(model_data), nbytes=os.path.getsize(output_path))
+    return output_path
+
 # Additional vector-related functions can be added here in the future.
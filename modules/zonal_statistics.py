@@ -0,0 +1,177 @@
+# zonal_statistics.py
+
+import os
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+from rasterio.features import rasterize
+from modules.utilities import add_metrics, time_function
+
+# How cells are assigned to zones: 'centers' tests the cell centers in the bounding box of each zone against its
+# polygon, so overlapping zones share cells; 'raster' burns the zones onto the model raster grid, faster with many
+# zones, the last zone winning where zones overlap
+ZONE_METHODS = ('centers', 'raster')
+ZONAL_STATISTICS = ('min', 'max', 'mean', 'sum')
+# Prefix of the statistics columns, keeping them apart from zone attributes such as a parcel 'area'
+ZONAL_PREFIX = 'zonal_'
+# Model data columns summarized by default
+ZONAL_COLUMNS = ['depth_max', 'velocity']
+
+
+def zone_cells_centers(grid_index, zones):
+    # The grid is regular, so the raster window of a zone's bounds holds every candidate cell and no spatial tree
+    # or per-cell point geometry is needed. A center on a shared boundary counts in both zones
+    grid = grid_index.raster_grid
+    lookup = np.full((grid.nrows, grid.ncols), -1, dtype=np.int64)
+    lookup[grid.rows, grid.cols] = np.arange(len(grid_index))
+    geometries = np.asarray(zones.geometry.values)
+    bounds = shapely.bounds(geometries)
+    cell_size = grid_index.cell_size
+    # Window of cell centers within the bounds, one cell wider to absorb rounding
+    col_start = np.floor((bounds[:, 0] - grid.transform.c) / cell_size - 0.5) - 1
+    col_stop = np.ceil((bounds[:, 2] - grid.transform.c) / cell_size - 0.5) + 2
+    row_start = np.floor((grid.transform.f - bounds[:, 3]) / cell_size - 0.5) - 1
+    row_stop = np.ceil((grid.transform.f - bounds[:, 1]) / cell_size - 0.5) + 2
+
+    cells, zone_ids = [], []
+    for zone, geometry in enumerate(geometries):
+        if geometry is None or geometry.is_empty:
+            continue
+        window = lookup[int(max(row_start[zone], 0)):int(max(row_stop[zone], 0)),
+                        int(max(col_start[zone], 0)):int(max(col_stop[zone], 0))]
+        candidates = window[window >= 0]
+        inside = candidates[shapely.intersects_xy(geometry, grid_index.x[candidates], grid_index.y[candidates])]
+        cells.append(inside)
+        zone_ids.append(np.full(len(inside), zone, dtype=np.int64))
+    if not cells:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return np.concatenate(cells), np.concatenate(zone_ids)
+
+
+def zone_cells_raster(grid_index, zones):
+    grid = grid_index.raster_grid
+    shapes = ((geometry, zone + 1) for zone, geometry in enumerate(zones.geometry.values)
+              if geometry is not None and not geometry.is_empty)
+    burned = rasterize(shapes, out_shape=(grid.nrows, grid.ncols), transform=grid.transform, fill=0, dtype='int32')
+    zone_ids = burned[grid.rows, grid.cols].astype(np.int64) - 1
+    cells = np.flatnonzero(zone_ids >= 0)
+    return cells, zone_ids[cells]
+
+
+def zone_cells(grid_index, zones, method='centers'):
+    """
+    Maps model cells to the zones their centers fall in.
+    :param grid_index: GridIndex of the model.
+    :param zones: GeoDataFrame of zone polygons in the model CRS.
+    :param method: One of ZONE_METHODS.
+    :return: (cell positions, zone positions) pairs as two arrays.
+    """
+    if method == 'centers':
+        return zone_cells_centers(grid_index, zones)
+    if method == 'raster':
+        return zone_cells_raster(grid_index, zones)
+    raise ValueError(f"Unknown zone method {method!r}, use one of {ZONE_METHODS}")
+
+
+def group_statistics(groups, values, n_groups):
+    """
+    Reduces values by group in one sort: count, min, max, mean and sum of the non-NaN values of each group.
+    :param groups: Group number of each value, 0 .. n_groups - 1.
+    :return: Dict of statistic name to an array of n_groups, NaN (0 for count and sum) for groups without values.
+    """
+    valid = ~np.isnan(values)
+    groups, values = groups[valid], values[valid].astype(np.float64)
+    counts = np.bincount(groups, minlength=n_groups)
+    sums = np.bincount(groups, weights=values, minlength=n_groups)
+
+    minima = np.full(n_groups, np.nan)
+    maxima = np.full(n_groups, np.nan)
+    if len(values):
+        order = np.argsort(groups, kind='stable')
+        sorted_groups, sorted_values = groups[order], values[order]
+        starts = np.flatnonzero(np.r_[True, sorted_groups[1:] != sorted_groups[:-1]])
+        present = sorted_groups[starts]
+        minima[present] = np.minimum.reduceat(sorted_values, starts)
+        maxima[present] = np.maximum.reduceat(sorted_values, starts)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = np.where(counts > 0, sums / counts, np.nan)
+    return {'count': counts, 'min': minima, 'max': maxima, 'mean': means, 'sum': sums}
+
+
+def check_zone_bounds(zones, name, source_crs):
+    """
+    Checks that every non-empty zone has finite bounds, which reprojecting zones read in the wrong CRS may not give,
+    e.g. state plane coordinates in a GeoJSON without a crs member, read as EPSG:4326.
+    :raise ValueError: Naming the zones and the CRS they were read in.
+    """
+    geometries = np.asarray(zones.geometry.values)
+    present = ~(shapely.is_missing(geometries) | shapely.is_empty(geometries))
+    infinite = present & ~np.isfinite(shapely.bounds(geometries)).all(axis=1)
+    if infinite.any():
+        raise ValueError(f"{int(infinite.sum())} of {len(zones)} zones of {name} have no finite coordinates in the "
+                         f"model CRS {zones.crs}, check that their CRS {source_crs} is right")
+
+
+@time_function
+def zonal_statistics(model_data, zones, grid_index, columns=None, method='centers', crs=None, name='zones'):
+    """
+    Summarizes model data columns over zone polygons such as parcels or drainage basins. Each cell counts in the
+    zones its center falls in, and per zone the cell count, cell area, and the min, max, mean and sum of each column
+    are computed with NumPy group reductions. depth_max also gets a volume, its sum times the cell area.
+    :param model_data: ModelData or DataFrame of model cells, in grid_index order.
+    :param zones: GeoDataFrame of zone polygons. Reprojected to crs when both CRSs are known.
+    :param grid_index: GridIndex of the model.
+    :param columns: Model data columns to summarize. Defaults to ZONAL_COLUMNS.
+    :param method: One of ZONE_METHODS.
+    :param crs: CRS of the model, e.g. "EPSG:2223".
+    :param name: Label of the zones in error messages, e.g. their file path.
+    :return: Copy of zones with zonal_cells, zonal_area and zonal_<column>_<statistic> columns. Zone attributes
+        already named like one of them are kept with an _input suffix.
+    """
+    columns = ZONAL_COLUMNS if columns is None else columns
+    source_crs = zones.crs
+    if crs is not None and zones.crs is not None:
+        zones = zones.to_crs(crs)
+    zones = zones.reset_index(drop=True)
+    check_zone_bounds(zones, name, source_crs)
+
+    cells, zone_ids = zone_cells(grid_index, zones, method)
+    cell_area = grid_index.cell_size ** 2
+    counts = np.bincount(zone_ids, minlength=len(zones))
+    statistics = {f'{ZONAL_PREFIX}cells': counts, f'{ZONAL_PREFIX}area': counts * cell_area}
+    for column in columns:
+        column_statistics = group_statistics(zone_ids, model_data[column].to_numpy()[cells], len(zones))
+        for name in ZONAL_STATISTICS:
+            statistics[f'{ZONAL_PREFIX}{column}_{name}'] = column_statistics[name]
+        if column == 'depth_max':
+            statistics[f'{ZONAL_PREFIX}depth_max_volume'] = column_statistics['sum'] * cell_area
+
+    add_metrics(rows=len(cells))
+    attributes = zones.drop(columns=zones.geometry.name)
+    attributes = attributes.rename(columns={name: f'{name}_input' for name in attributes.columns if name in statistics})
+    result = pd.concat([attributes, pd.DataFrame(statistics)], axis=1)
+    return gpd.GeoDataFrame(result, geometry=zones.geometry, crs=zones.crs if crs is None else crs)
+
+
+@time_function
+def write_zonal_statistics(model_data, zones_path, output_path, grid_index, columns=None, method='centers',
+                           crs=None):
+    """
+    Reads zone polygons from any vector file, summarizes the model data over them with zonal_statistics and writes
+    the zones with their statistics. Zones without a CRS are taken to be in the model CRS.
+    :param output_path: GeoParquet (.parquet), FlatGeobuf (.fgb), GeoPackage (.gpkg) or Shapefile (.shp) output.
+    :return: output_path.
+    """
+    zones = gpd.read_file(zones_path)
+    if zones.crs is None and crs is not None:
+        zones = zones.set_crs(crs)
+    result = zonal_statistics(model_data, zones, grid_index, columns, method, crs, name=zones_path)
+    if os.path.exists(output_path):
+        os.remove(output_path)
+    if output_path.lower().endswith('.parquet'):
+        result.to_parquet(output_path)
+    else:
+        result.to_file(output_path)
+    return output_path
@@ -0,0 +1,27 @@
+# conftest.py
+
+import os
+import shutil
+import pytest
+from modules.synthetic_project import generate_project
+
+# Size of the synthetic project the tests run on
+PROJECT_OPTIONS = dict(cells=400, cross_sections=2, structures=2, timesteps=10)
+
+
+@pytest.fixture(scope='module')
+def project(request, tmp_path_factory):
+    """
+    Synthetic project shared by the tests of a module. Takes the number of TIMDEP.OUT steps as its parameter,
+    0 unless the module sets it with pytest.mark.parametrize('project', [steps], indirect=True).
+    """
+    timdep_steps = getattr(request, 'param', 0)
+    return generate_project(str(tmp_path_factory.mktemp('project')), timdep_steps=timdep_steps, **PROJECT_OPTIONS)
+
+
+@pytest.fixture
+def project_copy(project, tmp_path):
+    """
+    Copy of the shared project, for tests that change its files.
+    """
+    return shutil.copytree(project, os.path.join(tmp_path, 'project'))
@@ -0,0 +1,97 @@
+# test_build_manifest.py
+
+import os
+import pytest
+from modules.build_manifest import BuildPlan
+
+PARAMS = {'epsg': 2223, 'columns': ['depth_max']}
+
+
+@pytest.fixture
+def files(tmp_path):
+    # One input and the output built from it
+    input_path = os.path.join(tmp_path, 'DEPTH.OUT')
+    with open(input_path, 'w') as file:
+        file.write('1  100.0  200.0  1.5\n2  110.0  200.0  0.0\n')
+    return input_path, os.path.join(tmp_path, 'output', 'depth_max.tif')
+
+
+def write(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as file:
+        file.write(text)
+
+
+def touch(path, seconds=10):
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + seconds * 10 ** 9))
+
+
+def build(input_path, output_path, params=PARAMS, force=False, during=None):
+    """
+    Runs one planning and build cycle. during() runs between planning and recording, like a stage of the run.
+    :return: Whether the output was rebuilt.
+    """
+    plan = BuildPlan(force=force)
+    needed = plan.needs_build(output_path, [input_path], params)
+    if needed:
+        write(output_path, 'raster')
+        if during is not None:
+            during()
+        plan.record(output_path)
+    plan.save()
+    return needed
+
+
+def test_unchanged_output_is_up_to_date(files):
+    assert build(*files)
+    assert not build(*files)
+
+
+def test_touched_but_unchanged_input_stays_up_to_date(files):
+    input_path, output_path = files
+    build(input_path, output_path)
+    touch(input_path)
+    assert not build(input_path, output_path)
+
+
+def test_rewritten_input_rebuilds(files):
+    input_path, output_path = files
+    build(input_path, output_path)
+    # Same size, so only the content hash tells the inputs apart
+    write(input_path, '1  100.0  200.0  2.5\n2  110.0  200.0  0.0\n')
+    touch(input_path)
+    assert build(input_path, output_path)
+
+
+def test_changed_parameter_rebuilds(files):
+    build(*files)
+    assert build(*files, params=dict(PARAMS, epsg=2224))
+    assert not build(*files, params=dict(PARAMS, epsg=2224))
+
+
+def test_input_rewritten_during_the_run_stays_stale(files):
+    input_path, output_path = files
+
+    def rewrite():
+        # Same size, so the next run has to tell it apart from the content planned with
+        write(input_path, '1  100.0  200.0  9.5\n2  110.0  200.0  0.0\n')
+        touch(input_path)
+
+    assert build(input_path, output_path, during=rewrite)
+    # Built from the content seen when planning, so the next run rebuilds it once
+    assert build(input_path, output_path)
+    assert not build(input_path, output_path)
+
+
+def test_missing_output_rebuilds(files):
+    input_path, output_path = files
+    build(input_path, output_path)
+    os.remove(output_path)
+    assert build(input_path, output_path)
+
+
+def test_force_rebuilds(files):
+    build(*files)
+    assert build(*files, force=True)
+    assert not build(*files)
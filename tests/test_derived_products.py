@@ -0,0 +1,61 @@
+# test_derived_products.py
+
+import numpy as np
+import pandas as pd
+import pytest
+from modules.derived_products import (CLASS_NODATA, DERIVED_PRODUCTS, compile_expression, evaluate_product,
+                                      parse_derived_product)
+
+
+@pytest.mark.parametrize('expression', [
+    'depth_max.__class__',
+    '().__class__.__bases__[0].__subclasses__()',
+    'depth_max[0]',
+    'clip(depth_max, a_min=0, a_max=1)',
+    'open(depth_max)',
+    '__import__("os")',
+    'np.sqrt(depth_max)',
+    '(lambda: 1)()',
+    '[depth_max for depth_max in velocity]',
+    '0 < depth_max < 1',
+    'depth_max +',
+])
+def test_unsafe_or_invalid_expressions_are_rejected(expression):
+    with pytest.raises(ValueError):
+        compile_expression(expression)
+
+
+def test_expression_columns():
+    _, columns = compile_expression('where(depth_max > 1, depth_max * velocity, nan) + sqrt(abs(topo))')
+    assert columns == ['depth_max', 'topo', 'velocity']
+
+
+@pytest.mark.parametrize('text', [
+    'dv=depth_max*nosuch',
+    'dv',
+    '2dv=depth_max',
+    'depth_max=depth_max*2',
+    'dv=depth_max*velocity:3,1',
+    'dv=depth_max*velocity:1,1',
+])
+def test_invalid_product_definitions_are_rejected(text):
+    with pytest.raises(ValueError):
+        parse_derived_product(text)
+
+
+def test_product_definition():
+    product = parse_derived_product('deep=depth_max:1,3')
+    assert product.expression == 'depth_max'
+    assert product.bins == [1.0, 3.0]
+    assert parse_derived_product('hazard') is DERIVED_PRODUCTS['hazard']
+
+
+def test_hazard_classes():
+    # (depth ft, velocity ft/s, class): low, medium by depth, medium by depth x velocity, high by depth,
+    # high by depth x velocity, and dry cells as nodata
+    cases = [(1.0, 1.0, 1), (2.0, 1.0, 2), (1.0, 6.0, 2), (6.0, 0.5, 3), (2.0, 9.0, 3), (0.0, 5.0, CLASS_NODATA)]
+    model_data = pd.DataFrame({'depth_max': [depth for depth, _, _ in cases],
+                               'velocity': [velocity for _, velocity, _ in cases]}, dtype=np.float32)
+    classes = evaluate_product(DERIVED_PRODUCTS['hazard'], model_data)
+    assert classes.dtype == np.uint8
+    assert classes.tolist() == [expected for _, _, expected in cases]
@@ -0,0 +1,67 @@
+# test_fpxsec_spreadsheet.py
+
+import os
+import matplotlib
+import numpy as np
+import pandas as pd
+import pytest
+from openpyxl import load_workbook
+from modules.fpxsec_spreadsheet import export_hydrographs_to_excel_small_plots, render_hydrograph_pngs
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Open-file limit of the test, below the number of sheets written
+FILE_LIMIT = 256
+SECTIONS = 300
+
+
+def hydrographs(sections):
+    time = np.arange(0.0, 5.0, 0.5)
+    for section in range(1, sections + 1):
+        yield section, pd.DataFrame({'Time': time, 'Discharge': section * np.sin(time / 5 * np.pi)})
+
+
+@pytest.fixture
+def file_limit():
+    if resource is None:
+        pytest.skip('resource is not available on this platform')
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (min(FILE_LIMIT, hard), hard))
+    yield
+    resource.setrlimit(resource.RLIMIT_NOFILE, (soft, hard))
+
+
+@pytest.mark.parametrize('plot_mode', ['native', 'none'])
+def test_more_sections_than_open_files(file_limit, tmp_path, plot_mode):
+    path = os.path.join(tmp_path, 'fpxsec_hydrographs.xlsx')
+    export_hydrographs_to_excel_small_plots(hydrographs(SECTIONS), str(tmp_path), path, plot_mode)
+
+    workbook = load_workbook(path)
+    sheets_per_section = 1 if plot_mode == 'none' else 2
+    assert len(workbook.sheetnames) == SECTIONS * sheets_per_section
+    last = workbook[f'Section {SECTIONS} Data']
+    assert last.max_row == 11
+    if plot_mode == 'native':
+        chart, = workbook[f'Section {SECTIONS} Plot']._charts
+        assert f"'Section {SECTIONS} Data'" in chart.series[0].yVal.numRef.f
+
+
+def test_in_process_rendering_keeps_the_backend():
+    backend = matplotlib.get_backend()
+    matplotlib.use('svg')
+    try:
+        pngs = [png for _, _, png in render_hydrograph_pngs(hydrographs(2), max_workers=1)]
+        assert matplotlib.get_backend() == 'svg'
+    finally:
+        matplotlib.use(backend)
+    assert all(png.startswith(b'\x89PNG') for png in pngs)
+
+
+def test_pool_rendering_matches_in_process_rendering():
+    in_process = list(render_hydrograph_pngs(hydrographs(3), max_workers=1))
+    pooled = list(render_hydrograph_pngs(hydrographs(3), max_workers=2))
+    assert [section for section, _, _ in pooled] == [1, 2, 3]
+    assert [png for _, _, png in pooled] == [png for _, _, png in in_process]
@@ -0,0 +1,50 @@
+# test_hystruc_parser.py
+
+import os
+import warnings
+import numpy as np
+import pytest
+from modules.hystruc_parser import CFS_HOURS_TO_ACFT, parse_hydrostruct, structure_statistics
+
+# Two structure tables in the layout FLO-2D writes, between a title block and a summary block that also hold numbers
+FIXTURE_PATH = os.path.join(os.path.dirname(__file__), 'data', 'HYDROSTRUCT.OUT')
+
+
+def test_tables_of_the_flo2d_layout_are_parsed():
+    store = parse_hydrostruct(FIXTURE_PATH)
+    assert list(store['names']) == ['CULVERT_A', 'BRIDGE_B']
+    assert list(store['offsets']) == [0, 5, 9]
+    assert list(store['discharge']) == [0.0, 12.4, 38.2, 41.0, 22.6, 5.0, 60.0, 150.0, 90.0]
+
+    stats = structure_statistics(store).set_index('Structure Name')
+    assert stats['Qpeak_cfs'].tolist() == [41.0, 150.0]
+    assert stats['Tpeak_hrs'].tolist() == [1.5, 1.0]
+    assert stats['HWpeak'].tolist() == [1206.30, 1189.20]
+    bridge_volume = 0.5 * ((5 + 60) + (60 + 150) + (150 + 90)) / 2 * CFS_HOURS_TO_ACFT
+    assert stats.loc['BRIDGE_B', 'Vol_acft'] == pytest.approx(bridge_volume)
+
+
+def test_generated_tables_are_parsed(project):
+    store = parse_hydrostruct(os.path.join(project, 'HYDROSTRUCT.OUT'))
+    assert len(store['names']) == 2
+    assert list(np.diff(store['offsets'])) == [10, 10]
+
+
+def test_missing_tables_warn(tmp_path):
+    path = os.path.join(tmp_path, 'HYDROSTRUCT.OUT')
+    with open(path, 'w') as file:
+        file.write('          STRUCTURE 1  CULVERT_A\n'
+                   '           0.00      1204.10      1199.80         0.00\n'
+                   '          THE MAXIMUM DISCHARGE FOR: CULVERT_A  IS:      41.00 CFS  AT TIME:     1.50\n')
+    with pytest.warns(UserWarning, match='no structure hydrograph table'):
+        store = parse_hydrostruct(path)
+    assert len(store['time']) == 0
+    stats = structure_statistics(store)
+    assert stats['Qpeak_cfs'].tolist() == [41.0]
+    assert np.isnan(stats['Vol_acft']).all()
+
+
+def test_parsed_tables_do_not_warn():
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        parse_hydrostruct(FIXTURE_PATH)
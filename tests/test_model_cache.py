@@ -0,0 +1,101 @@
+# test_model_cache.py
+
+import json
+import os
+import pytest
+from modules import data_extraction, model_cache
+from modules.data_extraction import DEPTH_SPEC, extractModelDataToDF, get_grid_file_specs, read_grid_file
+from modules.grid_reader import read_grid_columns
+from modules.model_cache import CACHE_FOLDER, MANIFEST_NAME, ModelCache
+
+
+@pytest.fixture
+def parsed(monkeypatch):
+    # Names of the files parsed, in any order since the files are read concurrently
+    names = []
+
+    def read(source, *args, **kwargs):
+        names.append(os.path.basename(source))
+        return read_grid_columns(source, *args, **kwargs)
+
+    monkeypatch.setattr(data_extraction, 'read_grid_columns', read)
+    return names
+
+
+def extract(project, parsed):
+    parsed.clear()
+    extractModelDataToDF(project)
+    return sorted(parsed)
+
+
+def cache_stats(project):
+    cache_path = os.path.join(project, CACHE_FOLDER)
+    return {name: os.stat(os.path.join(cache_path, name)).st_mtime_ns for name in os.listdir(cache_path)}
+
+
+def touch(path, seconds=10):
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + seconds * 10 ** 9))
+
+
+def test_unchanged_files_are_read_from_the_cache(project_copy, parsed):
+    all_files = sorted(spec[0] for spec in [DEPTH_SPEC] + get_grid_file_specs(project_copy))
+    assert extract(project_copy, parsed) == all_files
+    written = cache_stats(project_copy)
+
+    assert extract(project_copy, parsed) == []
+    # Neither the arrays nor the manifest are written again
+    assert cache_stats(project_copy) == written
+
+
+def test_touched_but_identical_file_is_accepted_by_hash(project_copy, parsed, monkeypatch):
+    extract(project_copy, parsed)
+    hashed = []
+    digest = model_cache.file_digest
+    monkeypatch.setattr(model_cache, 'file_digest', lambda path: hashed.append(os.path.basename(path)) or digest(path))
+
+    touch(os.path.join(project_copy, 'TOPO.DAT'))
+    assert extract(project_copy, parsed) == []
+    assert hashed == ['TOPO.DAT']
+
+    # The new mtime is recorded, so the next run trusts it without hashing again
+    hashed.clear()
+    assert extract(project_copy, parsed) == []
+    assert hashed == []
+
+
+def test_rewritten_file_is_parsed_again(project_copy, parsed):
+    extract(project_copy, parsed)
+    # Same size, different content, so only the hash tells the files apart
+    path = os.path.join(project_copy, 'MANNINGS_N.DAT')
+    with open(path) as file:
+        lines = file.readlines()
+    with open(path, 'w') as file:
+        file.writelines(lines[::-1])
+    touch(path)
+
+    assert extract(project_copy, parsed) == ['MANNINGS_N.DAT']
+    assert extract(project_copy, parsed) == []
+
+
+def test_changed_key_is_parsed_again(project_copy, parsed):
+    extract(project_copy, parsed)
+    cache = ModelCache(project_copy)
+    file_name, columns, skiprows, id_field = next(spec for spec in get_grid_file_specs(project_copy)
+                                                  if spec[0] == 'MAXQHYD.OUT')
+    parsed.clear()
+    arrays = read_grid_file(project_copy, (file_name, {'q_max': columns['q_max']}, skiprows, id_field), cache)
+    assert parsed == ['MAXQHYD.OUT']
+    assert set(arrays) == {'grid_id', 'q_max'}
+
+
+def test_cache_version_change_clears_the_folder(project_copy, parsed, monkeypatch):
+    all_files = extract(project_copy, parsed)
+    stray = os.path.join(project_copy, CACHE_FOLDER, 'REMOVED.DAT.npz')
+    open(stray, 'wb').close()
+
+    monkeypatch.setattr(model_cache, 'CACHE_VERSION', model_cache.CACHE_VERSION + 1)
+    assert extract(project_copy, parsed) == all_files
+    assert not os.path.exists(stray)
+    with open(os.path.join(project_copy, CACHE_FOLDER, MANIFEST_NAME)) as file:
+        assert json.load(file)['version'] == model_cache.CACHE_VERSION
@@ -0,0 +1,37 @@
+# test_postprocess.py
+
+import os
+import pytest
+from main import main
+from modules.data_extraction import GREEN_AMPT_SPEC
+from modules.postprocess import RASTER_COLUMNS
+
+
+@pytest.fixture
+def scs_project(project_copy):
+    # The generated Green and Ampt INFIL.DAT switched to the SCS Curve Number method
+    infil_path = os.path.join(project_copy, 'INFIL.DAT')
+    with open(infil_path) as file:
+        lines = file.readlines()
+    with open(infil_path, 'w') as file:
+        file.writelines(['2\n'] + lines[1:])
+    return project_copy
+
+
+def test_default_rasters_skip_green_and_ampt_columns(scs_project, capsys):
+    assert main([scs_project, '--epsg', '2223', '--outputs', 'rasters']) == 0
+    assert 'left out of --rasters' in capsys.readouterr().out
+    rasters = set(os.listdir(os.path.join(scs_project, 'flo2d_rasters')))
+    for column in RASTER_COLUMNS:
+        assert (f'{column}.tif' in rasters) == (column not in GREEN_AMPT_SPEC[1])
+
+
+def test_named_green_and_ampt_rasters_fail(scs_project, capsys):
+    assert main([scs_project, '--epsg', '2223', '--outputs', 'rasters', '--rasters', 'depth_max', 'xksat']) == 1
+    assert '--rasters xksat' in capsys.readouterr().err
+    assert not os.path.exists(os.path.join(scs_project, 'flo2d_rasters', 'depth_max.tif'))
+
+
+def test_missing_infil_dat_skips_green_and_ampt_columns(scs_project):
+    os.remove(os.path.join(scs_project, 'INFIL.DAT'))
+    assert main([scs_project, '--epsg', '2223', '--outputs', 'rasters']) == 0
@@ -0,0 +1,55 @@
+# test_timdep.py
+
+import os
+import numpy as np
+import pytest
+import rasterio
+from modules.grid_index import load_grid_index
+from modules.timdep import TIMDEP_FIELDS, iter_timdep, write_timdep_rasters
+
+
+pytestmark = pytest.mark.parametrize('project', [3], indirect=True)
+
+
+def read_steps(path):
+    # Reference parse: one table of records per time line
+    steps = []
+    with open(path, 'r') as file:
+        for line in file:
+            parts = line.split()
+            if len(parts) == 1:
+                steps.append((float(parts[0]), []))
+            elif parts:
+                steps[-1][1].append([float(part) for part in parts])
+    return [(time, np.array(rows)) for time, rows in steps]
+
+
+def test_fields_follow_the_requested_order(project):
+    path = os.path.join(project, 'TIMDEP.OUT')
+    expected = read_steps(path)
+    steps = list(iter_timdep(path, ('wse', 'x_velocity', 'depth'), chunk_bytes=4096))
+
+    assert [step.time for step in steps] == pytest.approx([time for time, _ in expected])
+    for step, (_, rows) in zip(steps, expected):
+        np.testing.assert_array_equal(step.grid_ids, rows[:, 0])
+        for field in ('wse', 'x_velocity', 'depth'):
+            np.testing.assert_allclose(step.values[field], rows[:, TIMDEP_FIELDS[field]], rtol=1e-6)
+
+
+def test_duplicate_fields_are_read_once(project):
+    step = next(iter_timdep(os.path.join(project, 'TIMDEP.OUT'), ('depth', 'wse', 'depth')))
+    assert list(step.values) == ['depth', 'wse']
+    assert not np.allclose(step.values['depth'], step.values['wse'])
+
+
+def test_step_rasters_hold_their_field(project, tmp_path):
+    grid_index = load_grid_index(project, use_cache=False)
+    write_timdep_rasters(project, str(tmp_path), grid_index, ('wse', 'depth'), every=2)
+    _, rows = read_steps(os.path.join(project, 'TIMDEP.OUT'))[2]
+    grid = grid_index.raster_grid
+
+    for field in ('wse', 'depth'):
+        with rasterio.open(os.path.join(tmp_path, f'{field}_00002.tif')) as raster:
+            values = raster.read(1)[grid.rows, grid.cols]
+        np.testing.assert_allclose(values, rows[:, TIMDEP_FIELDS[field]], rtol=1e-6)
+    assert not os.path.exists(os.path.join(tmp_path, 'depth_00001.tif'))
@@ -0,0 +1,59 @@
+# test_utilities.py
+
+import os
+import threading
+import pytest
+from modules.utilities import atomic_write
+
+
+def test_atomic_write_replaces_the_file(tmp_path):
+    path = os.path.join(tmp_path, 'manifest.json')
+    with atomic_write(path, 'w') as file:
+        file.write('first')
+    with atomic_write(path, 'w') as file:
+        file.write('second')
+        # The previous content stays readable until the block completes
+        with open(path) as previous:
+            assert previous.read() == 'first'
+    with open(path) as file:
+        assert file.read() == 'second'
+    assert os.listdir(tmp_path) == ['manifest.json']
+
+
+def test_failed_atomic_write_keeps_the_file(tmp_path):
+    path = os.path.join(tmp_path, 'manifest.json')
+    with atomic_write(path, 'w') as file:
+        file.write('first')
+    with pytest.raises(RuntimeError):
+        with atomic_write(path, 'w') as file:
+            file.write('partial')
+            raise RuntimeError('interrupted')
+    with open(path) as file:
+        assert file.read() == 'first'
+    assert os.listdir(tmp_path) == ['manifest.json']
+
+
+def test_concurrent_atomic_writes_do_not_collide(tmp_path):
+    path = os.path.join(tmp_path, 'GRID_INDEX.npz')
+    barrier = threading.Barrier(4)
+    errors = []
+
+    def write(k):
+        try:
+            with atomic_write(path) as file:
+                # Every thread holds its temporary file open at the same time
+                barrier.wait(timeout=10)
+                file.write(bytes([k]) * 1000)
+        except Exception as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=write, args=(k,)) for k in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    with open(path, 'rb') as file:
+        content = file.read()
+    assert len(content) == 1000 and len(set(content)) == 1
+    assert os.listdir(tmp_path) == ['GRID_INDEX.npz']
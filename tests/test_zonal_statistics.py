@@ -0,0 +1,55 @@
+# test_zonal_statistics.py
+
+import os
+import geopandas as gpd
+import numpy as np
+import pytest
+import shapely
+from modules.data_extraction import load_model_data
+from modules.grid_index import load_grid_index
+from modules.zonal_statistics import ZONE_METHODS, write_zonal_statistics
+
+
+@pytest.fixture
+def zones_file(project, tmp_path):
+    # Five parcels across the grid, with attributes named like the statistics columns
+    grid_index = load_grid_index(project, use_cache=False)
+    xmin, ymin, xmax, ymax = grid_index.extent
+    edges = np.linspace(xmin, xmax, 6)
+    boxes = [shapely.box(left, ymin, right, ymax) for left, right in zip(edges[:-1], edges[1:])]
+    zones = gpd.GeoDataFrame({'name': [f'parcel{k}' for k in range(5)], 'area': [1.0] * 5, 'zonal_cells': [0] * 5},
+                             geometry=boxes, crs='EPSG:2223')
+    path = os.path.join(tmp_path, 'parcels.gpkg')
+    zones.to_file(path)
+    return path
+
+
+@pytest.mark.parametrize('method', ZONE_METHODS)
+def test_zone_attributes_named_like_statistics(project, zones_file, tmp_path, method):
+    grid_index = load_grid_index(project, use_cache=False)
+    model_data = load_model_data(project, ['depth_max', 'velocity'], use_cache=False)
+    output_path = os.path.join(tmp_path, 'zonal.gpkg')
+    write_zonal_statistics(model_data, zones_file, output_path, grid_index, method=method, crs='EPSG:2223')
+
+    result = gpd.read_file(output_path)
+    assert result.columns.is_unique
+    assert list(result['area']) == [1.0] * 5
+    assert list(result['zonal_cells_input']) == [0] * 5
+    assert result['zonal_cells'].sum() == len(grid_index)
+    np.testing.assert_allclose(result['zonal_area'], result['zonal_cells'] * grid_index.cell_size ** 2)
+    assert result['zonal_depth_max_max'].max() == pytest.approx(model_data['depth_max'].max())
+
+
+@pytest.mark.parametrize('method', ZONE_METHODS)
+def test_zones_read_in_the_wrong_crs(project, tmp_path, method):
+    # State plane coordinates in a GeoJSON without a crs member, which is read as EPSG:4326
+    grid_index = load_grid_index(project, use_cache=False)
+    zones = gpd.GeoDataFrame({'name': ['basin']}, geometry=[shapely.box(*grid_index.extent)])
+    path = os.path.join(tmp_path, 'basins.geojson')
+    with open(path, 'w') as file:
+        file.write(zones.to_json())
+    model_data = load_model_data(project, ['depth_max'], use_cache=False)
+
+    with pytest.raises(ValueError, match=r'basins\.geojson.*EPSG:4326'):
+        write_zonal_statistics(model_data, path, os.path.join(tmp_path, 'zonal.gpkg'), grid_index, ['depth_max'],
+                               method, crs='EPSG:2223')